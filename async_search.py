@@ -0,0 +1,237 @@
+# summary_aug_keywords 表的异步检索与导入
+#
+# 与 demo_2vec_2txt 使用同一套 SQL。concurrent=True 时四个字段的候选召回分别在独立的连接上并发执行,
+# 再把候选 key 和各字段内的名次作为数组交给一次融合打分查询; 单个查询的延迟取决于最慢的一路召回,
+# 而不是四路召回之和。
+import asyncio
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from async_search_client import AsyncSearchClient
+from demo_2vec_2txt import DB_CONFIG, projection_columns, search_fields, search_sql
+from hybrid_query import candidate_sql
+from vector_index import l2_normalize
+
+# 异步检索客户端, 持有 asyncpg 连接池
+client = AsyncSearchClient(DB_CONFIG)
+
+
+async def hybrid_search(weight_summary_vector, query_summary_vector,
+                        weight_keywords_vector, query_keywords_vector,
+                        weight_summary_text, query_summary_text,
+                        weight_keywords_text, query_keywords_text, top_k=5, table_name="summary_aug_keywords",
+                        fusion="weighted", candidate_k=100, metric="cosine", ef_search=None, probes=None,
+                        quantization=None, concurrent=False, projection="ids", search_client=None):
+    """
+    异步执行混合检索, 参数和返回的行格式与 demo_2vec_2txt.hybrid_search 相同
+
+    参数:
+        concurrent: 融合模式下是否在多个连接上并发召回各字段的候选
+        projection: 结果中返回哪些列, ids / text / full (见 demo_2vec_2txt.PROJECTIONS)
+        search_client: 使用的异步检索客户端, None 表示模块级的 client
+    """
+    search_client = search_client or client
+    results = await _search(search_client, weight_summary_vector, query_summary_vector, weight_keywords_vector,
+                            query_keywords_vector, weight_summary_text, query_summary_text, weight_keywords_text,
+                            query_keywords_text, top_k, table_name, fusion, candidate_k, metric, ef_search, probes,
+                            quantization, concurrent, projection)
+    embedding_columns = projection_columns(projection)[1]
+    if not embedding_columns or not results:
+        return results
+    embeddings = await fetch_embeddings([row[0] for row in results], embedding_columns, table_name, search_client)
+    missing = (None,) * len(embedding_columns)
+    return [tuple(row) + embeddings.get(row[0], missing) for row in results]
+
+
+async def fetch_embeddings(ids, columns=("summary_embedding", "keywords_embedding"),
+                           table_name="summary_aug_keywords", search_client=None):
+    """按 id 取回向量列, 返回 {id: (各向量列的 float32 数组)}"""
+    search_client = search_client or client
+    rows = await search_client.fetch(
+        f"SELECT id, {', '.join(columns)} FROM {table_name} WHERE id = ANY(%(ids)s::bigint[])", {"ids": list(ids)})
+    return {row[0]: tuple(row[1:]) for row in rows}
+
+
+async def _search(search_client, weight_summary_vector, query_summary_vector, weight_keywords_vector,
+                  query_keywords_vector, weight_summary_text, query_summary_text, weight_keywords_text,
+                  query_keywords_text, top_k, table_name, fusion, candidate_k, metric, ef_search, probes,
+                  quantization, concurrent, projection):
+    if metric == "ip":
+        query_summary_vector = l2_normalize(query_summary_vector)
+        query_keywords_vector = l2_normalize(query_keywords_vector)
+
+    params = {
+        "weight_summary_vector": weight_summary_vector,
+        "query_summary_vector": query_summary_vector,
+        "weight_keywords_vector": weight_keywords_vector,
+        "query_keywords_vector": query_keywords_vector,
+        "weight_summary_text": weight_summary_text,
+        "query_summary_text": query_summary_text,
+        "weight_keywords_text": weight_keywords_text,
+        "query_keywords_text": query_keywords_text,
+        "candidate_k": candidate_k,
+        "top_k": top_k,
+    }
+    if not concurrent:
+        return await search_client.fetch(search_sql(table_name, fusion, metric, quantization, projection=projection,
+                                                    weights=params),
+                                         params, ef_search=ef_search, probes=probes)
+    if fusion is None:
+        raise ValueError("并发召回只用于融合模式, 请同时指定 fusion")
+
+    fields = search_fields(metric, quantization, params)
+    candidate_lists = await asyncio.gather(*(
+        search_client.fetch(candidate_sql(field, table_name), params, ef_search=ef_search, probes=probes)
+        for field in fields
+    ))
+
+    # 候选并集, 以及每个候选在各字段内的名次和得分 (未被召回为 None, 由服务端补算得分)
+    hits = [{row[0]: (row[1], row[2]) for row in rows} for rows in candidate_lists]
+    keys = list(dict.fromkeys(row[0] for rows in candidate_lists for row in rows))
+    params["candidate_keys"] = keys
+    for field, field_hits in zip(fields, hits):
+        params[f"{field['name']}_ranks"] = [field_hits.get(key, (None, None))[0] for key in keys]
+        params[f"{field['name']}_hits"] = [field_hits.get(key, (None, None))[1] for key in keys]
+    return await search_client.fetch(search_sql(table_name, fusion, metric, quantization, rescore=True,
+                                                projection=projection, weights=params), params)
+
+
+async def ingest(documents, table_name="summary_aug_keywords", normalize=False):
+    """
+    异步流式导入文档 (二进制 COPY)
+
+    参数:
+        documents: 文档字典的迭代器或异步迭代器
+        table_name: 表名
+        normalize: 是否对向量做 L2 归一化
+    """
+    return await client.copy_documents(documents, table_name, normalize=normalize)
+
+
+def _load_stats(latencies, elapsed):
+    latencies.sort()
+    return {
+        "qps": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies),
+        "p99_ms": latencies[int(len(latencies) * 0.99)],
+    }
+
+
+def _sync_load(queries, concurrency, duration, search_kwargs):
+    from demo_2vec_2txt import hybrid_search as sync_hybrid_search
+
+    latencies = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(offset):
+        i = offset
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            sync_hybrid_search(*queries[i % len(queries)], verbose=False, **search_kwargs)
+            with lock:
+                latencies.append((time.perf_counter() - start) * 1000)
+            i += concurrency
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(worker, range(concurrency)))
+    return _load_stats(latencies, time.perf_counter() - start)
+
+
+def _sync_levels(queries, levels, duration, warmup, search_kwargs):
+    search_client = search_kwargs["search_client"]
+    try:
+        # 预热: 建立全部连接并完成初始化和 PREPARE, 不计入结果
+        _sync_load(queries, search_client.maxconn, warmup, search_kwargs)
+        return {level: _sync_load(queries, level, duration, search_kwargs) for level in levels}
+    finally:
+        search_client.close()
+
+
+async def _async_load(queries, concurrency, duration, search_kwargs):
+    latencies = []
+    deadline = time.perf_counter() + duration
+
+    async def worker(offset):
+        i = offset
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            await hybrid_search(*queries[i % len(queries)], **search_kwargs)
+            latencies.append((time.perf_counter() - start) * 1000)
+            i += concurrency
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(offset) for offset in range(concurrency)))
+    return _load_stats(latencies, time.perf_counter() - start)
+
+
+async def _async_levels(queries, levels, duration, warmup, search_kwargs):
+    # 所有并发级别在同一个事件循环里共用一个连接池, 连接池的创建和预热不计入结果
+    search_client = search_kwargs["search_client"]
+    try:
+        await _async_load(queries, search_client.maxconn, warmup, search_kwargs)
+        return {level: await _async_load(queries, level, duration, search_kwargs) for level in levels}
+    finally:
+        await search_client.close()
+
+
+def benchmark_load(concurrency_levels=(1, 2, 4, 8, 16, 32, 64), duration=10.0, p99_target_ms=50.0,
+                   table_name="summary_aug_keywords", fusion="rrf", pool_size=16, warmup=2.0):
+    """
+    同步 (线程池 + psycopg2) 与异步 (asyncio + asyncpg) 的负载测试
+
+    逐级增加并发数, 记录每一级的 QPS 和 p99 延迟, 报告 p99 不超过 p99_target_ms 时能达到的最高 QPS。
+    每种方式使用各自新建的、大小同为 pool_size 的连接池, 先预热 warmup 秒再开始计时;
+    并发数超过 pool_size 时两种方式都在等待空闲连接上排队。
+
+    参数:
+        concurrency_levels: 并发数 (线程数 / 协程数)
+        duration: 每一级持续的时间 (秒)
+        p99_target_ms: p99 延迟上限 (毫秒)
+        table_name: 表名
+        fusion: 融合方式
+        pool_size: 同步和异步连接池的连接数 (minconn = maxconn)
+        warmup: 每种方式开始计时前的预热时间 (秒)
+    """
+    from search_client import SearchClient
+    from synthetic_data import generate_packages
+
+    queries = [
+        (0.25, doc["summary_embedding"], 0.25, doc["keywords_embedding"],
+         0.25, doc["summary"], 0.25, doc["augmented_keywords"])
+        for doc in generate_packages(100, seed=1)
+    ]
+    search_kwargs = {"table_name": table_name, "fusion": fusion}
+
+    def async_client():
+        return AsyncSearchClient(DB_CONFIG, minconn=pool_size, maxconn=pool_size)
+
+    modes = {
+        "sync": lambda: _sync_levels(queries, concurrency_levels, duration, warmup, {
+            **search_kwargs, "search_client": SearchClient(DB_CONFIG, minconn=pool_size, maxconn=pool_size)}),
+        "async": lambda: asyncio.run(_async_levels(queries, concurrency_levels, duration, warmup, {
+            **search_kwargs, "search_client": async_client()})),
+        "async_concurrent": lambda: asyncio.run(_async_levels(queries, concurrency_levels, duration, warmup, {
+            **search_kwargs, "search_client": async_client(), "concurrent": True})),
+    }
+
+    report = {"pool_size": pool_size}
+    print(f"\n负载测试 ({table_name}, fusion={fusion}, 连接池 {pool_size} 个连接, 每级 {duration} 秒):")
+    print("=" * 80)
+    for mode, run in modes.items():
+        report[mode] = run()
+        for level, stats in report[mode].items():
+            print(f"{mode:>16} 并发 {level:>3}: {stats['qps']:,.1f} QPS, "
+                  f"p50 {stats['p50_ms']:.2f} ms, p99 {stats['p99_ms']:.2f} ms")
+
+    print(f"\np99 <= {p99_target_ms} ms 时的最高 QPS (连接池 {pool_size} 个连接):")
+    for mode in modes:
+        within = [stats["qps"] for stats in report[mode].values() if stats["p99_ms"] <= p99_target_ms]
+        print(f"{mode:>16}: {max(within):,.1f} QPS" if within else f"{mode:>16}: 没有满足延迟要求的并发级别")
+    return report
+
+if __name__ == "__main__":
+    benchmark_load()
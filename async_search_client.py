@@ -0,0 +1,157 @@
+# 基于 asyncio 的检索客户端
+#
+# psycopg2 的调用是阻塞的, 在 asyncio 服务中每个查询都要占用一个执行器线程。
+# AsyncSearchClient 使用 asyncpg 的连接池, 查询在事件循环中等待, 不占用线程;
+# asyncpg 在每个连接上自动缓存预备语句。查询仍然写成 %(name)s 命名参数,
+# 执行前由 to_positional 改写为 $n, 与同步客户端共用同一套 SQL。
+#
+# 会话参数 (ivfflat.probes / hnsw.ef_search / statement_timeout) 在建立连接时通过 server_settings 设置,
+# 连接归还时 asyncpg 执行的 RESET ALL 会恢复到这些值, 而不是服务端默认值。
+# vector 类型使用二进制编解码 (与二进制 COPY 相同的格式), 返回的向量直接是 float32 NumPy 数组。
+import asyncio
+from contextlib import asynccontextmanager
+
+import asyncpg
+
+from binary_copy import COPY_BUFFER_SIZE, COPY_HEADER, COPY_TRAILER, ENCODERS, PACKAGE_COLUMNS, \
+    decode_vector, document_converter, encode_row, encode_vector
+from result_cache import invalidate_table
+from search_client import DB_CONFIG, to_positional
+
+
+async def _iterate(documents):
+    """同时支持普通迭代器和异步迭代器"""
+    if hasattr(documents, "__aiter__"):
+        async for doc in documents:
+            yield doc
+    else:
+        for doc in documents:
+            yield doc
+
+
+class AsyncSearchClient:
+    """
+    异步检索客户端, 管理 asyncpg 连接池
+
+    参数:
+        db_config: 数据库连接配置
+        minconn: 连接池保持的最少连接数
+        maxconn: 连接池的最大连接数, 连接全部借出时 connection() 会等待
+        acquire_timeout: 等待空闲连接的最长时间 (秒), 超时抛出 asyncio.TimeoutError
+        statement_timeout_ms: 语句超时 (毫秒), None 表示不设置
+        ivfflat_probes: 会话级 ivfflat.probes, None 表示使用服务端默认值
+        hnsw_ef_search: 会话级 hnsw.ef_search, None 表示使用服务端默认值
+    """
+
+    def __init__(self, db_config=None, minconn=1, maxconn=10, acquire_timeout=30,
+                 statement_timeout_ms=None, ivfflat_probes=None, hnsw_ef_search=None):
+        self.db_config = dict(db_config or DB_CONFIG)
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.acquire_timeout = acquire_timeout
+        self.session_settings = {
+            "statement_timeout": statement_timeout_ms,
+            "ivfflat.probes": ivfflat_probes,
+            "hnsw.ef_search": hnsw_ef_search,
+        }
+        self._pool = None
+        self._lock = None
+
+    async def _get_pool(self):
+        # 连接池在第一次使用时创建; asyncio.Lock 必须在事件循环中创建
+        if self._pool is None:
+            if self._lock is None:
+                self._lock = asyncio.Lock()
+            async with self._lock:
+                if self._pool is None:
+                    self._pool = await asyncpg.create_pool(
+                        min_size=self.minconn,
+                        max_size=self.maxconn,
+                        server_settings={name: str(value) for name, value in self.session_settings.items()
+                                         if value is not None},
+                        init=self._setup_connection,
+                        **self.db_config,
+                    )
+        return self._pool
+
+    async def _setup_connection(self, conn):
+        """每个新连接注册一次 vector 类型的编解码"""
+        await conn.set_type_codec("vector", schema="public", format="binary",
+                                  encoder=encode_vector, decoder=decode_vector)
+
+    @asynccontextmanager
+    async def connection(self):
+        """借出一个连接并开启事务, 正常结束时提交, 发生异常时回滚, 最后归还连接池"""
+        pool = await self._get_pool()
+        async with pool.acquire(timeout=self.acquire_timeout) as conn:
+            async with conn.transaction():
+                yield conn
+
+    async def set_search_params(self, conn, ef_search=None, probes=None):
+        """设置当前事务内的向量检索参数, 与 vector_index.set_search_params 相同"""
+        if ef_search is not None:
+            await conn.execute("SELECT set_config('hnsw.ef_search', $1, true)", str(ef_search))
+        if probes is not None:
+            await conn.execute("SELECT set_config('ivfflat.probes', $1, true)", str(probes))
+
+    async def fetch(self, sql, params=None, conn=None, ef_search=None, probes=None):
+        """
+        执行查询并返回全部结果行
+
+        参数:
+            sql: 使用 %(name)s 命名参数的查询
+            params: 参数字典
+            conn: 在已借出的连接上执行, None 表示单独借出一个连接
+            ef_search, probes: 本次查询的向量检索参数
+        """
+        positional_sql, names = to_positional(sql)
+        args = [params[name] for name in names]
+        if conn is None:
+            async with self.connection() as conn:
+                await self.set_search_params(conn, ef_search, probes)
+                return await conn.fetch(positional_sql, *args)
+        await self.set_search_params(conn, ef_search, probes)
+        return await conn.fetch(positional_sql, *args)
+
+    async def copy_documents(self, documents, table_name="summary_aug_keywords", columns=PACKAGE_COLUMNS,
+                             normalize=False):
+        """
+        以二进制 COPY 流式导入文档, 与 binary_copy.copy_documents 使用相同的编码
+
+        参数:
+            documents: 文档字典的迭代器或异步迭代器, 边读取边发送
+            table_name: 表名
+            columns: (列名, 类型) 列表
+            normalize: 是否对向量列做 L2 归一化
+
+        返回导入的行数
+        """
+        convert = document_converter(columns, normalize)
+        encoders = [ENCODERS[column_type] for _, column_type in columns]
+        count = 0
+
+        async def chunks():
+            nonlocal count
+            buffer = bytearray(COPY_HEADER)
+            async for doc in _iterate(documents):
+                buffer += encode_row(convert(doc), encoders)
+                count += 1
+                if len(buffer) >= COPY_BUFFER_SIZE:
+                    yield bytes(buffer)
+                    buffer.clear()
+            buffer += COPY_TRAILER
+            yield bytes(buffer)
+
+        async with self.connection() as conn:
+            await conn.copy_to_table(table_name, source=chunks(), columns=[name for name, _ in columns],
+                                     format="binary")
+        invalidate_table(table_name)
+        return count
+
+    async def close(self):
+        """关闭连接池中的所有连接"""
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+        # 下次使用时在新的事件循环中重新创建
+        self._lock = None
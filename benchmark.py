@@ -0,0 +1,265 @@
+# 检索性能与召回率基准测试
+#
+# 用 synthetic_data 生成可复现的合成语料 (1e4 ~ 1e7 行, 与 summary_aug_keywords 的表结构一致),
+# 导入之后逐个建索引, 再运行查询负载, 报告:
+#   导入吞吐量 (rows/s), 每个索引的构建耗时和大小,
+#   单线程混合检索的 p50 / p95 / p99 延迟, 不同并发下的 QPS 和 p99,
+#   向量检索 (不同 ef_search / probes) 相对于精确暴力检索 (关闭索引扫描的顺序扫描) 的 recall@k。
+#
+# 连接 demo_2vec_2txt.DB_CONFIG 指向的本地 PostgreSQL, 用本仓库的镜像启动:
+#   docker build -t pg_test:0.5 .
+#   docker-compose -f ./docker-compose.yml up -d
+#   python benchmark.py --rows 1000000
+# 同样的 --rows / --seed 总是生成同样的语料和查询, 不同索引或查询改动的结果可以直接对比。
+import argparse
+import json
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from binary_copy import copy_documents
+from demo_2vec_2txt import client, hybrid_search, index_statements, setup_database, vector_index_columns
+from quantized_search import rerank_sql
+from synthetic_data import generate_packages
+from upsert import UPSERT_COLUMNS, with_content_hash
+from vector_index import build_vector_index, l2_normalize, set_search_params
+
+# 查询使用与语料不同的种子, 来自同一组主题但不与任何一行完全相同
+QUERY_SEED_OFFSET = 1000
+
+
+def latency_stats(latencies):
+    """毫秒延迟列表 -> p50 / p95 / p99"""
+    return {f"p{q}_ms": float(np.percentile(latencies, q)) for q in (50, 95, 99)}
+
+
+def load_corpus(rows, table_name="summary_aug_keywords", seed=0, batch_size=100000, partitioned=False,
+                normalize=False):
+    """
+    重建表并以二进制 COPY 导入合成语料 (不带索引), 返回导入耗时和 rows/s
+
+    参数:
+        rows: 语料行数
+        table_name: 表名, 会被重建
+        seed: 随机种子
+        batch_size: 每多少行提交一次
+        partitioned: 是否按 ecosystem 分区
+        normalize: 是否对向量做 L2 归一化 (metric="ip" 时需要)
+    """
+    setup_database(table_name, partitioned=partitioned, indexes=False)
+    start = time.perf_counter()
+    with client.connection() as conn:
+        count = copy_documents(conn, with_content_hash(generate_packages(rows, seed=seed)), table_name,
+                               columns=UPSERT_COLUMNS, batch_size=batch_size, normalize=normalize)
+    elapsed = time.perf_counter() - start
+    return {"rows": count, "seconds": elapsed, "rows_per_s": count / elapsed}
+
+
+def build_indexes(table_name="summary_aug_keywords", partitioned=False, metric="cosine", method="hnsw",
+                  maintenance_work_mem="1GB", parallel_workers=None):
+    """
+    逐个构建全部索引, 返回 {索引名: {"seconds", "mb"}}; 逐个构建才能得到每个索引各自的耗时
+    """
+    report = {}
+    with client.connection() as conn:
+        with conn.cursor() as cursor:
+            for statement in index_statements(table_name, partitioned):
+                index_name = re.search(r"INDEX IF NOT EXISTS (\w+)", statement).group(1)
+                # 只在本次构建的事务内生效, 提交后恢复, 不影响之后借到这个连接的检索
+                cursor.execute("SELECT set_config('maintenance_work_mem', %s, true)", (maintenance_work_mem,))
+                start = time.perf_counter()
+                cursor.execute(statement)
+                conn.commit()
+                report[index_name] = {"seconds": time.perf_counter() - start}
+            for index_name, column in vector_index_columns(table_name):
+                elapsed = build_vector_index(cursor, index_name, table_name, column, metric, method,
+                                             maintenance_work_mem=maintenance_work_mem,
+                                             parallel_workers=parallel_workers)
+                conn.commit()
+                report[index_name] = {"seconds": elapsed}
+            cursor.execute(f"ANALYZE {table_name}")
+            for index_name, stats in report.items():
+                # 分区表上的索引没有存储, 大小为各分区索引之和
+                cursor.execute("""
+                SELECT coalesce(sum(pg_relation_size(c.oid)), 0)
+                FROM pg_class c
+                WHERE c.oid = %s::regclass OR c.oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = %s::regclass)
+                """, (index_name, index_name))
+                stats["mb"] = cursor.fetchone()[0] / 2 ** 20
+    return report
+
+
+def make_queries(n_queries, seed=0):
+    """与语料同分布的查询, 按 hybrid_search 前 8 个参数的顺序排列"""
+    return [
+        (0.25, doc["summary_embedding"], 0.25, doc["keywords_embedding"],
+         0.25, doc["summary"][:200], 0.25, doc["augmented_keywords"])
+        for doc in generate_packages(n_queries, seed=seed + QUERY_SEED_OFFSET)
+    ]
+
+
+def measure_latency(queries, table_name="summary_aug_keywords", fusion="rrf", top_k=10, **search_kwargs):
+    """单线程依次执行查询, 返回 p50 / p95 / p99 和 QPS"""
+    hybrid_search(*queries[0], top_k=top_k, table_name=table_name, fusion=fusion, verbose=False, **search_kwargs)
+    latencies = []
+    start = time.perf_counter()
+    for query in queries:
+        query_start = time.perf_counter()
+        hybrid_search(*query, top_k=top_k, table_name=table_name, fusion=fusion, verbose=False, **search_kwargs)
+        latencies.append((time.perf_counter() - query_start) * 1000)
+    return {**latency_stats(latencies), "qps": len(queries) / (time.perf_counter() - start)}
+
+
+def measure_concurrency(queries, levels=(1, 2, 4, 8), duration=10.0, table_name="summary_aug_keywords",
+                        fusion="rrf", top_k=10, **search_kwargs):
+    """
+    多线程持续执行查询, 返回 {并发数: {"qps", p50/p95/p99}}
+
+    每个线程占用一个连接, 超过 client.maxconn 的并发会在连接池上排队, 测到的是排队后的延迟
+    """
+    report = {}
+    for level in levels:
+        deadline = time.perf_counter() + duration
+
+        def worker(offset):
+            latencies = []
+            i = offset
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                hybrid_search(*queries[i % len(queries)], top_k=top_k, table_name=table_name, fusion=fusion,
+                              verbose=False, **search_kwargs)
+                latencies.append((time.perf_counter() - start) * 1000)
+                i += level
+            return latencies
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(level) as executor:
+            latencies = [ms for result in executor.map(worker, range(level)) for ms in result]
+        report[level] = {"qps": len(latencies) / (time.perf_counter() - start), **latency_stats(latencies)}
+    return report
+
+
+def measure_recall(query_vectors, table_name="summary_aug_keywords", column="summary_embedding", metric="cosine",
+                   top_k=10, ef_search_values=(40, 100, 200), probes_values=()):
+    """
+    向量 top-k 检索的 recall@k: 索引检索结果与精确结果 (关闭索引扫描) 的交集比例
+
+    参数:
+        query_vectors: 查询向量列表
+        ef_search_values: 依次测试的 hnsw.ef_search
+        probes_values: 依次测试的 ivfflat.probes (ivfflat 索引时使用)
+    """
+    sql = rerank_sql(table_name, column, ["id"], None, metric)
+    exact = []
+    for query_vector in query_vectors:
+        with client.cursor() as cursor:
+            cursor.execute("SELECT set_config('enable_indexscan', 'off', true)")
+            cursor.execute(sql, {"query_vector": query_vector, "top_k": top_k})
+            exact.append({row[0] for row in cursor.fetchall()})
+
+    settings = [{"ef_search": value} for value in ef_search_values] + [{"probes": value} for value in probes_values]
+    report = {}
+    for setting in settings:
+        hits = 0
+        latencies = []
+        for query_vector, truth in zip(query_vectors, exact):
+            start = time.perf_counter()
+            with client.cursor() as cursor:
+                set_search_params(cursor, **setting)
+                cursor.execute(sql, {"query_vector": query_vector, "top_k": top_k})
+                hits += len(truth.intersection(row[0] for row in cursor.fetchall()))
+            latencies.append((time.perf_counter() - start) * 1000)
+        name, value = next(iter(setting.items()))
+        report[f"{name}={value}"] = {f"recall@{top_k}": hits / (top_k * len(query_vectors)),
+                                     **latency_stats(latencies)}
+    return report
+
+
+def run_benchmark(rows=100000, n_queries=200, recall_queries=50, top_k=10, table_name="summary_aug_keywords",
+                  fusion="rrf", metric="cosine", method="hnsw", concurrency=(1, 2, 4, 8), duration=10.0,
+                  ef_search_values=(40, 100, 200), probes_values=(1, 10, 40), seed=0, skip_load=False,
+                  partitioned=False, output=None):
+    """
+    完整的基准测试: 生成并导入语料、建索引、延迟、并发吞吐量和召回率
+
+    参数:
+        rows: 语料行数 (1e4 ~ 1e7)
+        n_queries: 延迟测试的查询数
+        recall_queries: 召回率测试的查询数, 每个查询都要做一次全表精确检索, 大表上应取小一些
+        top_k: 返回结果数量, recall@k 中的 k
+        table_name: 表名
+        fusion: 混合检索的融合方式
+        metric, method: 向量索引的距离度量和索引类型
+        concurrency: 并发测试的线程数
+        duration: 每个并发级别持续的时间 (秒)
+        ef_search_values, probes_values: 召回率测试中依次使用的检索参数 (按 method 选用其一)
+        seed: 语料和查询的随机种子
+        skip_load: 使用已导入的表, 跳过导入和建索引
+        partitioned: 是否按 ecosystem 分区
+        output: 把报告以 JSON 写入该文件
+    """
+    report = {"config": {"rows": rows, "top_k": top_k, "fusion": fusion, "metric": metric, "method": method,
+                         "seed": seed, "partitioned": partitioned}}
+    if not skip_load:
+        report["ingest"] = load_corpus(rows, table_name, seed, partitioned=partitioned, normalize=metric == "ip")
+        print(f"导入 {report['ingest']['rows']} 行: {report['ingest']['seconds']:.1f} 秒, "
+              f"{report['ingest']['rows_per_s']:,.0f} rows/s")
+        report["indexes"] = build_indexes(table_name, partitioned, metric, method)
+        for index_name, stats in report["indexes"].items():
+            print(f"索引 {index_name}: 构建 {stats['seconds']:.1f} 秒, {stats['mb']:,.1f} MB")
+
+    queries = make_queries(n_queries, seed)
+    # hybrid_search 按 metric 选择查询操作符, ip 时查询向量在其中归一化
+    report["latency"] = measure_latency(queries, table_name, fusion, top_k, metric=metric)
+    latency = report["latency"]
+    print(f"混合检索 (fusion={fusion}) 单线程: p50 {latency['p50_ms']:.2f} ms, p95 {latency['p95_ms']:.2f} ms, "
+          f"p99 {latency['p99_ms']:.2f} ms, {latency['qps']:,.1f} QPS")
+
+    if max(concurrency) > client.maxconn:
+        print(f"注意: 并发数超过连接池上限 {client.maxconn}, 多出的线程会排队等待连接")
+    report["concurrency"] = measure_concurrency(queries, concurrency, duration, table_name, fusion, top_k,
+                                                metric=metric)
+    for level, stats in report["concurrency"].items():
+        print(f"并发 {level:>3}: {stats['qps']:,.1f} QPS, p50 {stats['p50_ms']:.2f} ms, p99 {stats['p99_ms']:.2f} ms")
+
+    recall_vectors = [l2_normalize(query[1]) if metric == "ip" else query[1] for query in queries[:recall_queries]]
+    report["recall"] = measure_recall(recall_vectors, table_name, metric=metric, top_k=top_k,
+                                      ef_search_values=ef_search_values if method == "hnsw" else (),
+                                      probes_values=probes_values if method == "ivfflat" else ())
+    for setting, stats in report["recall"].items():
+        print(f"{setting:>14}: recall@{top_k} {stats[f'recall@{top_k}']:.3f}, "
+              f"p50 {stats['p50_ms']:.2f} ms, p99 {stats['p99_ms']:.2f} ms")
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False, default=str)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="summary_aug_keywords 检索基准测试")
+    parser.add_argument("--rows", type=int, default=100000, help="语料行数 (1e4 ~ 1e7)")
+    parser.add_argument("--queries", type=int, default=200, help="延迟测试的查询数")
+    parser.add_argument("--recall-queries", type=int, default=50, help="召回率测试的查询数")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--table", default="summary_aug_keywords")
+    parser.add_argument("--fusion", default="rrf", choices=["rrf", "weighted"])
+    parser.add_argument("--metric", default="cosine", choices=["cosine", "l2", "ip"])
+    parser.add_argument("--method", default="hnsw", choices=["hnsw", "ivfflat"])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--duration", type=float, default=10.0, help="每个并发级别持续的秒数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skip-load", action="store_true", help="使用已导入的表")
+    parser.add_argument("--partitioned", action="store_true", help="按 ecosystem 分区")
+    parser.add_argument("--output", help="JSON 报告文件")
+    args = parser.parse_args()
+    run_benchmark(rows=args.rows, n_queries=args.queries, recall_queries=args.recall_queries, top_k=args.top_k,
+                  table_name=args.table, fusion=args.fusion, metric=args.metric, method=args.method,
+                  concurrency=tuple(args.concurrency), duration=args.duration, seed=args.seed,
+                  skip_load=args.skip_load, partitioned=args.partitioned, output=args.output)
+
+
+if __name__ == "__main__":
+    main()
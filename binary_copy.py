@@ -0,0 +1,303 @@
+# 基于 COPY ... FROM STDIN (FORMAT BINARY) 的批量导入
+#
+# execute_values 会把每个 float 转成文本 (768 维向量约 15KB SQL 文本), 服务端还要再解析一遍。
+# 这里直接按 PostgreSQL 二进制 COPY 格式编码, 向量使用 pgvector 的二进制格式
+# (int16 维度 + int16 保留位 + 大端 float4 数组), 由 NumPy 一次性完成字节序转换, 不做逐元素的字符串转换。
+# 输入可以是任意迭代器/生成器, 边编码边发送, 内存占用与数据量无关。
+import io
+import itertools
+import json
+import struct
+import time
+
+import numpy as np
+
+from result_cache import invalidate_table
+from vector_index import l2_normalize
+
+COPY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+COPY_HEADER = COPY_SIGNATURE + struct.pack(">ii", 0, 0)
+COPY_TRAILER = struct.pack(">h", -1)
+
+# 每次交给 psycopg2 发送的数据块大小
+COPY_BUFFER_SIZE = 256 * 1024
+
+# summary_aug_keywords 表的导入列及其类型
+PACKAGE_COLUMNS = [
+    ("package_id", "text"),
+    ("package_name", "text"),
+    ("ecosystem", "text"),
+    ("summary", "text"),
+    ("augmented_keywords", "text"),
+    ("summary_embedding", "vector"),
+    ("keywords_embedding", "vector"),
+]
+
+
+def encode_text(value):
+    return value.encode("utf-8")
+
+
+def encode_jsonb(value):
+    # jsonb 二进制格式: 版本号 1 + JSON 文本
+    if not isinstance(value, str):
+        value = json.dumps(value, ensure_ascii=False)
+    return b"\x01" + value.encode("utf-8")
+
+
+def encode_vector(value):
+    array = np.asarray(value, dtype=">f4")
+    return struct.pack(">HH", array.shape[0], 0) + array.tobytes()
+
+
+def encode_halfvec(value):
+    array = np.asarray(value, dtype=">f2")
+    return struct.pack(">HH", array.shape[0], 0) + array.tobytes()
+
+
+ENCODERS = {
+    "text": encode_text,
+    "int4": lambda value: struct.pack(">i", value),
+    "int8": lambda value: struct.pack(">q", value),
+    "float8": lambda value: struct.pack(">d", value),
+    "jsonb": encode_jsonb,
+    "vector": encode_vector,
+    "halfvec": encode_halfvec,
+}
+
+
+def decode_jsonb(data):
+    return json.loads(data[1:].decode("utf-8"))
+
+
+def decode_vector(data):
+    dim = struct.unpack_from(">H", data)[0]
+    return np.frombuffer(data, dtype=">f4", count=dim, offset=4).astype(np.float32)
+
+
+def decode_halfvec(data):
+    dim = struct.unpack_from(">H", data)[0]
+    return np.frombuffer(data, dtype=">f2", count=dim, offset=4).astype(np.float32)
+
+
+DECODERS = {
+    "text": lambda data: data.decode("utf-8"),
+    "int4": lambda data: struct.unpack(">i", data)[0],
+    "int8": lambda data: struct.unpack(">q", data)[0],
+    "float8": lambda data: struct.unpack(">d", data)[0],
+    "jsonb": decode_jsonb,
+    "vector": decode_vector,
+    "halfvec": decode_halfvec,
+}
+
+
+def encode_row(row, encoders):
+    """把一行数据编码为二进制 COPY 的一个元组"""
+    parts = [struct.pack(">h", len(encoders))]
+    for value, encode in zip(row, encoders):
+        if value is None:
+            parts.append(struct.pack(">i", -1))
+        else:
+            data = encode(value)
+            parts.append(struct.pack(">i", len(data)))
+            parts.append(data)
+    return b"".join(parts)
+
+
+class CopyBinaryStream:
+    """把行迭代器包装成 copy_expert 需要的只读文件对象, 按需编码"""
+
+    def __init__(self, rows, types):
+        self.rows = 0
+        self._encoders = [ENCODERS[t] for t in types]
+        self._chunks = self._generate(rows)
+        self._buffer = bytearray()
+
+    def _generate(self, rows):
+        yield COPY_HEADER
+        for row in rows:
+            self.rows += 1
+            yield encode_row(row, self._encoders)
+        yield COPY_TRAILER
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+
+def copy_rows(cursor, table_name, columns, types, rows):
+    """
+    通过二进制 COPY 写入一批行
+
+    参数:
+        cursor: psycopg2 游标
+        table_name: 表名
+        columns: 列名列表
+        types: 与 columns 对应的类型列表 (ENCODERS 中的键)
+        rows: 行元组的迭代器
+
+    返回写入的行数
+    """
+    stream = CopyBinaryStream(rows, types)
+    cursor.copy_expert(
+        f"COPY {table_name} ({', '.join(columns)}) FROM STDIN (FORMAT BINARY)",
+        stream,
+        size=COPY_BUFFER_SIZE,
+    )
+    return stream.rows
+
+
+def decode_rows(data, types):
+    """
+    解码二进制 COPY TO 的输出
+
+    参数:
+        data: COPY ... TO STDOUT (FORMAT BINARY) 的全部字节
+        types: 各列的类型列表 (DECODERS 中的键)
+
+    返回行元组列表
+    """
+    decoders = [DECODERS[t] for t in types]
+    view = memoryview(data)
+    if bytes(view[:len(COPY_SIGNATURE)]) != COPY_SIGNATURE:
+        raise ValueError("不是二进制 COPY 格式的数据")
+    # 签名之后是标志位和头部扩展区长度
+    extension = struct.unpack_from(">i", view, len(COPY_SIGNATURE) + 4)[0]
+    offset = len(COPY_SIGNATURE) + 8 + extension
+
+    rows = []
+    while True:
+        count = struct.unpack_from(">h", view, offset)[0]
+        offset += 2
+        if count == -1:
+            return rows
+        row = []
+        for decode in decoders[:count]:
+            length = struct.unpack_from(">i", view, offset)[0]
+            offset += 4
+            if length == -1:
+                row.append(None)
+            else:
+                row.append(decode(bytes(view[offset:offset + length])))
+                offset += length
+        rows.append(tuple(row))
+
+
+def copy_query_rows(cursor, query, types):
+    """
+    以二进制 COPY 执行查询并解码结果, 向量直接解码为 float32 NumPy 数组, 不经过文本解析
+
+    参数:
+        cursor: psycopg2 游标
+        query: 不带参数的 SELECT 语句 (参数需预先用 cursor.mogrify 绑定)
+        types: 结果各列的类型列表 (DECODERS 中的键)
+    """
+    buffer = io.BytesIO()
+    cursor.copy_expert(f"COPY ({query}) TO STDOUT (FORMAT BINARY)", buffer, size=COPY_BUFFER_SIZE)
+    return decode_rows(buffer.getvalue(), types)
+
+
+def document_converter(columns=PACKAGE_COLUMNS, normalize=False):
+    """
+    返回把文档字典转换为行元组的函数
+
+    参数:
+        columns: (列名, 类型) 列表, 文档字典中以列名为键取值
+        normalize: 是否对向量列做 L2 归一化
+    """
+    names = [name for name, _ in columns]
+    vectors = [normalize and column_type in ("vector", "halfvec") for _, column_type in columns]
+
+    def convert(doc):
+        return tuple(l2_normalize(doc[name]) if vector and doc[name] is not None else doc[name]
+                     for name, vector in zip(names, vectors))
+
+    return convert
+
+
+def copy_documents(conn, documents, table_name="summary_aug_keywords", columns=PACKAGE_COLUMNS, batch_size=None,
+                   normalize=False):
+    """
+    批量导入文档
+
+    参数:
+        conn: 数据库连接
+        documents: 文档字典的迭代器/生成器
+        table_name: 表名
+        columns: (列名, 类型) 列表, 文档字典中以列名为键取值
+        batch_size: 每多少行提交一次事务, None 表示全部数据在一个事务中导入
+        normalize: 是否对向量列做 L2 归一化, 归一化后可以使用 metric="ip" 代替余弦距离
+
+    返回导入的行数
+    """
+    names = [name for name, _ in columns]
+    types = [column_type for _, column_type in columns]
+    rows = map(document_converter(columns, normalize), documents)
+
+    total = 0
+    with conn.cursor() as cursor:
+        while True:
+            batch = rows if batch_size is None else itertools.islice(rows, batch_size)
+            count = copy_rows(cursor, table_name, names, types, batch)
+            conn.commit()
+            invalidate_table(table_name)
+            total += count
+            if batch_size is None or count < batch_size:
+                break
+    return total
+
+
+def benchmark_ingest(n=10000, batch_size=1000, table_name="summary_aug_keywords"):
+    """
+    对比 execute_values 与二进制 COPY 的导入吞吐量 (rows/s)
+
+    参数:
+        n: 导入的行数
+        batch_size: execute_values 每批的行数
+        table_name: 表名, 每种方式导入前都会重建该表
+    """
+    from psycopg2.extras import execute_values
+
+    from demo_2vec_2txt import client, setup_database
+    from synthetic_data import generate_packages
+
+    names = [name for name, _ in PACKAGE_COLUMNS]
+    report = {}
+
+    setup_database(table_name)
+    with client.connection() as conn:
+        start = time.perf_counter()
+        with conn.cursor() as cursor:
+            rows = (tuple(doc[name] for name in names) for doc in generate_packages(n))
+            while True:
+                batch = list(itertools.islice(rows, batch_size))
+                if not batch:
+                    break
+                execute_values(cursor, f"INSERT INTO {table_name} ({', '.join(names)}) VALUES %s", batch,
+                               page_size=batch_size)
+        conn.commit()
+        report["execute_values"] = n / (time.perf_counter() - start)
+
+    setup_database(table_name)
+    with client.connection() as conn:
+        start = time.perf_counter()
+        copy_documents(conn, generate_packages(n), table_name)
+        report["copy_binary"] = n / (time.perf_counter() - start)
+
+    print(f"\n导入吞吐量对比 ({n} 行, {table_name}):")
+    print("=" * 80)
+    for method, rows_per_second in report.items():
+        print(f"{method:>15}: {rows_per_second:,.0f} rows/s")
+    return report
+
+
+if __name__ == "__main__":
+    benchmark_ingest()
@@ -0,0 +1,78 @@
+# 中日韩 (CJK) 文本的全文检索
+#
+# english / simple 文本检索配置按空白和标点切词, 连续的汉字整段成为一个词,
+# "人工智能是研究..." 整句是一个词项, 查询 "人工智能" 几乎无法通过 GIN 索引命中。两种解决方式:
+#   1. pg_search 的 bm25 索引使用 ICU 分词器 (镜像编译时已开启 icu feature), 按词典切分中文, 见 bm25_index_sql
+#   2. 不依赖扩展的二元组 (bigram) 切分: cjk_bigrams() 把每段连续的 CJK 字符改写为相邻两字组成的词,
+#      "人工智能" -> "人工 工智 智能", 非 CJK 部分保持不变。文档和查询用同一个函数切分后再交给
+#      to_tsvector / plainto_tsquery, 仍然是 tsvector + GIN, 任意两个字以上的查询都能通过索引命中;
+#      单个汉字的查询不会命中 (文档中没有单字词项)。
+# cjk_bigrams 声明为 IMMUTABLE, 可以用在存储的生成列中。
+
+# CJK 字符范围: 平假名/片假名、CJK 扩展 A、CJK 统一汉字、韩文音节
+CJK_CHARACTERS = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af"
+
+CJK_BIGRAMS_FUNCTION = f"""
+CREATE OR REPLACE FUNCTION cjk_bigrams(input text) RETURNS text
+LANGUAGE plpgsql IMMUTABLE STRICT PARALLEL SAFE AS $$
+DECLARE
+    run text;
+    tokens text[] := '{{}}';
+BEGIN
+    FOR run IN SELECT m[1] FROM regexp_matches(input, '([{CJK_CHARACTERS}]+)', 'g') AS m LOOP
+        IF char_length(run) = 1 THEN
+            tokens := tokens || run;
+        ELSE
+            FOR i IN 1 .. char_length(run) - 1 LOOP
+                tokens := tokens || substr(run, i, 2);
+            END LOOP;
+        END IF;
+    END LOOP;
+    -- 非 CJK 部分原样保留, 由文本检索配置按空白和标点切词
+    RETURN regexp_replace(input, '[{CJK_CHARACTERS}]+', ' ', 'g') || ' ' || array_to_string(tokens, ' ');
+END
+$$;
+"""
+
+
+def create_cjk_function(cursor):
+    """创建 (或更新) cjk_bigrams 函数"""
+    cursor.execute(CJK_BIGRAMS_FUNCTION)
+
+
+def cjk_tsvector_sql(weighted_columns, config="simple"):
+    """
+    生成列使用的 tsvector 表达式
+
+    参数:
+        weighted_columns: [(列名, 权重)] 例如 [("title", "A"), ("content", "B")]
+        config: 文本检索配置; english 对非 CJK 的英文词仍然做词干化, 二元组本身不受影响
+    """
+    return " ||\n".join(
+        f"setweight(to_tsvector('{config}', cjk_bigrams(coalesce({column}, ''))), '{weight}')"
+        for column, weight in weighted_columns
+    )
+
+
+def cjk_tsquery_sql(placeholder, config="simple"):
+    """查询文本的 tsquery 表达式, 与 cjk_tsvector_sql 使用相同的切分和配置"""
+    return f"plainto_tsquery('{config}', cjk_bigrams({placeholder}))"
+
+
+def bm25_index_sql(index_name, table_name, key_field, text_columns, tokenizer="icu"):
+    """
+    pg_search bm25 索引, 各文本列使用指定的分词器
+
+    参数:
+        index_name: 索引名
+        table_name: 表名
+        key_field: 唯一键列
+        text_columns: 建立倒排索引的文本列
+        tokenizer: icu (按 Unicode 规则和词典切分, 支持中文), chinese_compatible (逐字切分) 或 default
+    """
+    text_fields = ", ".join(f'"{column}": {{"tokenizer": {{"type": "{tokenizer}"}}}}' for column in text_columns)
+    return f"""
+    CREATE INDEX IF NOT EXISTS {index_name} ON {table_name}
+    USING bm25 ({key_field}, {", ".join(text_columns)})
+    WITH (key_field = '{key_field}', text_fields = '{{{text_fields}}}');
+    """
@@ -1,7 +1,12 @@
 import psycopg2
 import numpy as np
 from psycopg2.extras import execute_values
-from psycopg2 import extensions
+
+from cjk_text import cjk_tsquery_sql, cjk_tsvector_sql, create_cjk_function
+from hybrid_query import build_fused_query, text_field, vector_field
+from result_cache import invalidate_table
+from search_client import SearchClient
+from vector_index import build_vector_index, check_vector_index, l2_normalize, score_sql, set_search_params
 
 # 数据库连接配置
 DB_CONFIG = {
@@ -11,111 +16,137 @@ DB_CONFIG = {
     "password": "opensource"
 }
 
-# 注册向量类型适配器
-def adapt_vector(vector):
-    return extensions.QuotedString(f"[{','.join(map(str, vector))}]")
-
-# 连接到数据库并注册适配器
-conn = psycopg2.connect(**DB_CONFIG)
-extensions.register_adapter(np.ndarray, adapt_vector)
-extensions.register_adapter(list, adapt_vector)
-conn.close()
+# 检索客户端, 持有连接池 (导入 search_client 时已注册向量类型适配器)
+client = SearchClient(DB_CONFIG)
 
 def setup_database():
-    """创建数据库表和索引"""
-    conn = psycopg2.connect(**DB_CONFIG)
-    cursor = conn.cursor()
-
-    # 创建表
-    cursor.execute("""
-    CREATE EXTENSION IF NOT EXISTS vector;  -- 确保向量扩展已安装
-    CREATE TABLE IF NOT EXISTS documents (
-        id SERIAL PRIMARY KEY,
-        title TEXT,
-        content TEXT,
-        embedding VECTOR(384),  -- 使用384维向量
-        metadata JSONB
-    );
-    """)
-
-    # 创建全文搜索索引
-    cursor.execute("""
-    CREATE INDEX IF NOT EXISTS idx_documents_content_search ON documents
-    USING gin(to_tsvector('english', content));
-    """)
-
-    # 创建向量索引 (使用IVFFlat或HNSW)
-    cursor.execute("""
-    CREATE INDEX IF NOT EXISTS idx_documents_embedding ON documents
-    USING ivfflat (embedding vector_l2_ops) WITH (lists = 100);
-    """)
-
-    conn.commit()
-    cursor.close()
-    conn.close()
+    """创建数据库表和索引 (向量索引在导入数据之后由 build_vector_indexes 创建)"""
+    with client.connection() as conn:
+        cursor = conn.cursor()
+
+        # 创建表
+        cursor.execute("""
+        CREATE EXTENSION IF NOT EXISTS vector;  -- 确保向量扩展已安装
+        CREATE TABLE IF NOT EXISTS documents (
+            id SERIAL PRIMARY KEY,
+            title TEXT,
+            content TEXT,
+            embedding VECTOR(384),  -- 使用384维向量
+            metadata JSONB
+        );
+        """)
+
+        # 写入时生成并存储 tsvector (标题权重 A, 正文权重 B), 检索时不再逐行重新分词;
+        # english 配置不切分中文, 连续的汉字先由 cjk_bigrams 改写为二元组, 英文词仍按 english 词干化
+        create_cjk_function(cursor)
+        cursor.execute(f"""
+        ALTER TABLE documents ADD COLUMN IF NOT EXISTS tsv_cjk TSVECTOR
+        GENERATED ALWAYS AS (
+            {cjk_tsvector_sql([("title", "A"), ("content", "B")], config="english")}
+        ) STORED;
+        """)
+
+        # 创建全文搜索索引 (旧的表达式索引和不切分中文的 tsv_english 已被 tsv_cjk 取代)
+        cursor.execute("""
+        DROP INDEX IF EXISTS idx_documents_content_search;
+        DROP INDEX IF EXISTS idx_documents_tsv_english;
+        ALTER TABLE documents DROP COLUMN IF EXISTS tsv_english;
+        CREATE INDEX IF NOT EXISTS idx_documents_tsv_cjk ON documents
+        USING gin(tsv_cjk);
+        """)
+
+        cursor.close()
     print("数据库表和索引创建完成")
 
-def insert_sample_data():
-    """插入样例数据"""
-    conn = psycopg2.connect(**DB_CONFIG)
-    cursor = conn.cursor()
-
-    # 样例文档数据
-    sample_documents = [
-        {
-            "title": "人工智能概述 Artificial Intelligence",
-            "content": "Artificial Intelligence 人工智能 是研究、开发用于模拟、延伸和扩展人的智能的理论、方法、技术及应用系统的一门新的技术科学。",
-            "metadata": {"category": "technology", "author": "张三"}
-        },
-        {
-            "title": "机器学习基础",
-            "content": "机器学习是人工智能的一个分支，它通过算法使计算机能够从数据中学习并做出决策或预测。",
-            "metadata": {"category": "technology", "author": "李四"}
-        },
-        {
-            "title": "深度学习进展",
-            "content": "深度学习是机器学习的一个子领域，它使用多层神经网络来模拟人脑的工作方式。",
-            "metadata": {"category": "technology", "author": "王五"}
-        },
-        {
-            "title": "数据库系统原理",
-            "content": "数据库系统是计算机系统中存储、管理和处理数据的核心组件，包括关系型和非关系型数据库。",
-            "metadata": {"category": "database", "author": "赵六"}
-        },
-        {
-            "title": "PostgreSQL高级特性",
-            "content": "PostgreSQL是一个功能强大的开源关系数据库系统，支持扩展如向量搜索和全文检索。",
-            "metadata": {"category": "database", "author": "钱七"}
-        }
-    ]
-
-    # 为每个文档生成随机向量 (实际应用中应使用真实嵌入模型)
-    for doc in sample_documents:
-        # 生成384维随机向量 (实际应用中应使用模型生成)
-        embedding = np.random.rand(384).astype(np.float32).tolist()
-        doc["embedding"] = embedding
-        # 将metadata字典转换为JSON字符串
-        doc["metadata_json"] = psycopg2.extras.Json(doc["metadata"])
-
-    # 插入数据
-    execute_values(
-        cursor,
-        """
-        INSERT INTO documents (title, content, embedding, metadata)
-        VALUES %s
-        """,
-        [
-            (doc["title"], doc["content"], doc["embedding"], doc["metadata_json"])
-            for doc in sample_documents
+def build_vector_indexes(metric="cosine", method="hnsw", m=16, ef_construction=64, lists=None,
+                         parallel_workers=None):
+    """
+    导入数据之后创建向量索引 (使用IVFFlat或HNSW)
+
+    参数:
+        metric: 向量距离度量 (l2 / cosine / ip), 决定索引的操作符类, 检索时必须使用相同的 metric
+        method: hnsw 或 ivfflat
+        m, ef_construction: hnsw 构建参数
+        lists: ivfflat 聚类中心数量, None 表示按行数计算
+        parallel_workers: 并行构建的 worker 数量
+    """
+    with client.connection() as conn:
+        cursor = conn.cursor()
+        elapsed = build_vector_index(cursor, "idx_documents_embedding", "documents", "embedding", metric, method,
+                                     m=m, ef_construction=ef_construction, lists=lists,
+                                     parallel_workers=parallel_workers)
+        cursor.close()
+    print(f"向量索引创建完成 ({method}, {elapsed:.2f} 秒)")
+
+def insert_sample_data(normalize=False):
+    """
+    插入样例数据
+
+    参数:
+        normalize: 是否对向量做 L2 归一化, 归一化后可以使用 metric="ip" 代替余弦距离
+    """
+    with client.connection() as conn:
+        cursor = conn.cursor()
+
+        # 样例文档数据
+        sample_documents = [
+            {
+                "title": "人工智能概述 Artificial Intelligence",
+                "content": "Artificial Intelligence 人工智能 是研究、开发用于模拟、延伸和扩展人的智能的理论、方法、技术及应用系统的一门新的技术科学。",
+                "metadata": {"category": "technology", "author": "张三"}
+            },
+            {
+                "title": "机器学习基础",
+                "content": "机器学习是人工智能的一个分支，它通过算法使计算机能够从数据中学习并做出决策或预测。",
+                "metadata": {"category": "technology", "author": "李四"}
+            },
+            {
+                "title": "深度学习进展",
+                "content": "深度学习是机器学习的一个子领域，它使用多层神经网络来模拟人脑的工作方式。",
+                "metadata": {"category": "technology", "author": "王五"}
+            },
+            {
+                "title": "数据库系统原理",
+                "content": "数据库系统是计算机系统中存储、管理和处理数据的核心组件，包括关系型和非关系型数据库。",
+                "metadata": {"category": "database", "author": "赵六"}
+            },
+            {
+                "title": "PostgreSQL高级特性",
+                "content": "PostgreSQL是一个功能强大的开源关系数据库系统，支持扩展如向量搜索和全文检索。",
+                "metadata": {"category": "database", "author": "钱七"}
+            }
         ]
-    )
 
-    conn.commit()
-    cursor.close()
-    conn.close()
+        # 为每个文档生成随机向量 (实际应用中应使用真实嵌入模型)
+        for doc in sample_documents:
+            # 生成384维随机向量 (实际应用中应使用模型生成)
+            embedding = np.random.rand(384).astype(np.float32)
+            if normalize:
+                embedding = l2_normalize(embedding)
+            doc["embedding"] = embedding.tolist()
+            # 将metadata字典转换为JSON字符串
+            doc["metadata_json"] = psycopg2.extras.Json(doc["metadata"])
+
+        # 插入数据
+        execute_values(
+            cursor,
+            """
+            INSERT INTO documents (title, content, embedding, metadata)
+            VALUES %s
+            """,
+            [
+                (doc["title"], doc["content"], doc["embedding"], doc["metadata_json"])
+                for doc in sample_documents
+            ]
+        )
+
+        cursor.close()
+    # 已提交, 清除该表的缓存结果
+    invalidate_table("documents")
     print(f"插入了 {len(sample_documents)} 条样例数据")
 
-def hybrid_search(query_text, query_vector=None, vector_weight=0.0, text_weight=1.0, top_k=5):
+def hybrid_search(query_text, query_vector=None, vector_weight=0.0, text_weight=1.0, top_k=5,
+                  fusion=None, candidate_k=100, metric="cosine", ef_search=None, probes=None):
     """
     执行混合检索 (向量 + BM25)
 
@@ -125,34 +156,73 @@ def hybrid_search(query_text, query_vector=None, vector_weight=0.0, text_weight=
         vector_weight: 向量相似度权重
         text_weight: 文本相似度权重
         top_k: 返回结果数量
-    """
-    conn = psycopg2.connect(**DB_CONFIG)
-    cursor = conn.cursor()
+        fusion: None 表示对全表打分排序; weighted / rrf 表示先分别通过向量索引和 GIN 索引
+                召回候选, 再对候选做加权求和或 RRF 融合
+        candidate_k: 融合模式下每路召回的候选数量
+        metric: 向量距离度量, 必须与 setup_database 使用的一致, 否则无法使用向量索引;
+                ip 要求数据已归一化, 查询向量会在这里归一化
+        ef_search: 本次查询的 hnsw.ef_search, None 表示使用连接的默认值
+        probes: 本次查询的 ivfflat.probes, None 表示使用连接的默认值
 
+    client 配置了 result_cache 时, 相同的查询直接返回缓存的结果
+    """
     # 如果没有提供查询向量，生成一个随机向量 (实际应用中应使用模型生成)
     if query_vector is None:
         query_vector = np.random.rand(384).astype(np.float32).tolist()
+    # ip 要求数据已归一化, 查询向量也需要归一化
+    if metric == "ip":
+        query_vector = l2_normalize(query_vector)
+
+    params = {
+        "query_vector": query_vector,
+        "query_text": query_text,
+        "vector_weight": vector_weight,
+        "text_weight": text_weight,
+        "candidate_k": candidate_k,
+        "top_k": top_k,
+    }
+    if fusion is not None:
+        # 索引召回 + 融合排序, 只对候选打分
+        sql = build_fused_query(
+            "documents",
+            ["id", "title", "content", "metadata"],
+            [
+                vector_field("vector", "embedding", "%(query_vector)s", "%(vector_weight)s", metric),
+                text_field("text", "tsv_cjk",
+                           cjk_tsquery_sql("%(query_text)s", "english"), "%(text_weight)s"),
+            ],
+            fusion=fusion,
+        )
+    else:
+        # 执行混合查询，不再需要显式类型转换
+        vector_score = score_sql("embedding", "%(query_vector)s", metric)
+        text_query = cjk_tsquery_sql("%(query_text)s", "english")
+        sql = f"""
+        SELECT
+            id,
+            title,
+            content,
+            metadata,
+            {vector_score} AS vector_score,
+            ts_rank(tsv_cjk, {text_query}) AS text_score,
+            %(vector_weight)s * {vector_score} + %(text_weight)s * ts_rank(tsv_cjk, {text_query}) AS combined_score
+        FROM documents
+        ORDER BY combined_score DESC
+        LIMIT %(top_k)s;
+        """
+
+    def search():
+        with client.connection() as conn:
+            cursor = conn.cursor()
+            check_vector_index(cursor, "documents", "embedding", metric)
+            set_search_params(cursor, ef_search, probes)
+            cursor.execute(sql, params)
+            results = cursor.fetchall()
+            cursor.close()
+        return results
 
-    # 执行混合查询，不再需要显式类型转换
-    cursor.execute("""
-    SELECT
-        id,
-        title,
-        content,
-        metadata,
-        (1 - (embedding <=> %s)) AS vector_score,
-        ts_rank(to_tsvector('english', content), plainto_tsquery('english', %s)) AS text_score,
-        %s * (1 - (embedding <=> %s)) + %s * ts_rank(to_tsvector('english', content), plainto_tsquery('english', %s)) AS combined_score
-    FROM documents
-    ORDER BY combined_score DESC
-    LIMIT %s;
-    """, (query_vector,
-          query_text,
-          vector_weight, query_vector,
-          text_weight, query_text,
-          top_k))
-
-    results = cursor.fetchall()
+    results = client.cached_search("documents", sql, params, search, text_params=("query_text",),
+                                   ef_search=ef_search, probes=probes)
 
     print(f"\n混合检索结果 (向量权重: {vector_weight}, 文本权重: {text_weight}):")
     print("="*80)
@@ -164,14 +234,13 @@ def hybrid_search(query_text, query_vector=None, vector_weight=0.0, text_weight=
         print(f"元数据: {row[3]}")
         print(f"向量得分: {row[4]:.4f}, 文本得分: {row[5]:.4f}")
 
-    cursor.close()
-    conn.close()
     return results
 
 if __name__ == "__main__":
     # 初始化数据库
     setup_database()
     insert_sample_data()
+    build_vector_indexes()
 
     # 执行混合检索示例
     query_text = "人工智能"
@@ -188,3 +257,6 @@ if __name__ == "__main__":
     # print("\n尝试不同的权重组合:")
     # hybrid_search(query_text, example_query_vector, vector_weight=0.9, text_weight=0.1)
     # hybrid_search(query_text, example_query_vector, vector_weight=0.1, text_weight=0.9)
+
+    # 索引召回 + RRF 融合
+    # hybrid_search(query_text, example_query_vector, vector_weight=0.5, text_weight=0.5, fusion="rrf")
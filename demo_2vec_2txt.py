@@ -1,7 +1,19 @@
-import psycopg2
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
-from psycopg2.extras import execute_values
-from psycopg2 import extensions
+
+from binary_copy import copy_query_rows
+from hybrid_query import active_fields, build_fused_query, build_rescore_query, text_field, vector_field
+from result_cache import invalidate_table
+from search_client import SearchClient, array_literal
+from search_filter import build_filter
+from search_metrics import NULL_TRACE
+from synthetic_data import ECOSYSTEMS
+from upsert import upsert_documents
+from vector_index import (build_vector_index, check_vector_index, distance_sql, forget_vector_indexes, l2_normalize,
+                          score_sql, set_search_params)
 
 # 数据库连接配置
 DB_CONFIG = {
@@ -12,80 +24,223 @@ DB_CONFIG = {
 }
 
 
-# 注册向量类型适配器
-def adapt_vector(vector):
-    return extensions.QuotedString(f"[{','.join(map(str, vector))}]")
-
-
-# 连接到数据库并注册适配器
-conn = psycopg2.connect(**DB_CONFIG)
-extensions.register_adapter(np.ndarray, adapt_vector)
-extensions.register_adapter(list, adapt_vector)
-conn.close()
-
-
-def setup_database(table_name="summary_aug_keywords"):
-    """创建数据库表和索引"""
-    conn = psycopg2.connect(**DB_CONFIG)
-
-    with conn.cursor() as cursor:
-        # 执行删除表操作（如果表存在）
-        cursor.execute(f"DROP TABLE IF EXISTS {table_name}")
-        conn.commit()  # 提交事务
-        print("表已成功删除（如果存在）")
-
-    cursor = conn.cursor()
-    # 创建表
-    cursor.execute(f"""
-    CREATE EXTENSION IF NOT EXISTS vector;  -- 确保向量扩展已安装
-    CREATE TABLE IF NOT EXISTS {table_name} (
-        id SERIAL PRIMARY KEY,
-        package_id TEXT,
-        package_name TEXT,
-        ecosystem TEXT,
-        summary TEXT,
-        augmented_keywords TEXT,
-        summary_embedding VECTOR(768),  -- 使用384维向量
-        keywords_embedding VECTOR(768)  -- 使用384维向量
-    );
-    """)
-
-    cursor.execute(f"""
-    CREATE UNIQUE INDEX IF NOT EXISTS idx_package_id ON {table_name} (package_id);
-    """)
-
-    cursor.execute(f"""
-    CREATE INDEX IF NOT EXISTS idx_ecosystem ON {table_name} (ecosystem);
-    """)
-
-    # 创建全文搜索索引
-    cursor.execute(f"""
-    CREATE INDEX IF NOT EXISTS idx_summary_search ON {table_name}
-    USING gin(to_tsvector('english', summary));
-    """)
-
-    # 创建关键词搜索索引
-    cursor.execute(f"""
-        CREATE INDEX IF NOT EXISTS idx_keywords_search ON {table_name}
-        USING gin(to_tsvector('english', augmented_keywords));
-        """)
+# 检索客户端, 持有连接池 (导入 search_client 时已注册向量类型适配器)
+client = SearchClient(DB_CONFIG)
+
+
+def setup_database(table_name="summary_aug_keywords", partitioned=False, ecosystems=ECOSYSTEMS, indexes=True,
+                   search_client=None):
+    """
+    创建数据库表和索引 (向量索引在导入数据之后由 build_vector_indexes 创建)
 
-    # 创建向量索引 (使用IVFFlat或HNSW)
-    cursor.execute(f"""
-    CREATE INDEX IF NOT EXISTS idx_summary_embedding ON {table_name}
-    USING ivfflat (summary_embedding vector_l2_ops) WITH (lists = 100);
-    """)
+    参数:
+        table_name: 表名
+        partitioned: 是否按 ecosystem 做 LIST 分区; 分区后每个生态有独立的堆表和索引,
+                     限定生态的查询只访问对应分区, 单个生态重建索引不影响其他分区
+        ecosystems: 分区模式下单独建分区的生态, 其余生态写入默认分区
+        indexes: 是否立即创建 B-tree / 全文索引; 为 False 时先导入数据, 之后再执行 index_statements
+        search_client: 在哪个数据库上创建, None 表示 client (分片时为各分片的 SearchClient)
+    """
+    # 分区表的主键必须包含分区键
+    key_columns = ", ecosystem" if partitioned else ""
+    with (search_client or client).connection() as conn:
+        with conn.cursor() as cursor:
+            # 执行删除表操作（如果表存在）
+            cursor.execute(f"DROP TABLE IF EXISTS {table_name}")
+            conn.commit()  # 提交事务
+            invalidate_table(table_name)
+            forget_vector_indexes(cursor, table_name)
+            print("表已成功删除（如果存在）")
 
-    cursor.execute(f"""
-        CREATE INDEX IF NOT EXISTS idx_keywords_embedding ON {table_name}
-        USING ivfflat (keywords_embedding vector_l2_ops) WITH (lists = 100);
+        cursor = conn.cursor()
+        # 创建表
+        cursor.execute(f"""
+        CREATE EXTENSION IF NOT EXISTS vector;  -- 确保向量扩展已安装
+        CREATE TABLE IF NOT EXISTS {table_name} (
+            id SERIAL,
+            package_id TEXT,
+            package_name TEXT,
+            ecosystem TEXT,
+            summary TEXT,
+            augmented_keywords TEXT,
+            summary_embedding VECTOR(768),  -- 使用384维向量
+            keywords_embedding VECTOR(768),  -- 使用384维向量
+            content_hash TEXT,  -- 内容哈希, 增量更新时跳过内容未变化的行 (见 upsert)
+            -- 写入时生成并存储 tsvector, 检索时不再逐行重新分词 (包名权重 A, 摘要正文权重 B)
+            summary_tsv TSVECTOR GENERATED ALWAYS AS (
+                setweight(to_tsvector('english', coalesce(package_name, '')), 'A') ||
+                setweight(to_tsvector('english', coalesce(summary, '')), 'B')
+            ) STORED,
+            keywords_tsv TSVECTOR GENERATED ALWAYS AS (
+                setweight(to_tsvector('english', coalesce(augmented_keywords, '')), 'A')
+            ) STORED,
+            PRIMARY KEY (id{key_columns})
+        ){" PARTITION BY LIST (ecosystem)" if partitioned else ""};
         """)
 
-    conn.commit()
-    cursor.close()
-    conn.close()
+        if partitioned:
+            for ecosystem in ecosystems:
+                cursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS {partition_name(table_name, ecosystem)}
+                PARTITION OF {table_name} FOR VALUES IN (%s);
+                """, (ecosystem,))
+            cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table_name}_default PARTITION OF {table_name} DEFAULT;
+            """)
+
+        if indexes:
+            for statement in index_statements(table_name, partitioned):
+                cursor.execute(statement)
+
+        cursor.close()
     print("数据库表和索引创建完成")
 
+
+def index_statements(table_name="summary_aug_keywords", partitioned=False):
+    """
+    向量索引以外的索引 (唯一约束、B-tree、全文检索 GIN)
+
+    索引名都带表名前缀, 影子表和线上表的索引不会重名; 在分区表上创建的索引会在每个分区上各建一份
+    """
+    key_columns = ", ecosystem" if partitioned else ""
+    statements = [f"""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_{table_name}_package_id ON {table_name} (package_id{key_columns});
+        """]
+    # 分区模式下按 ecosystem 过滤由分区裁剪完成, 不需要这个索引
+    if not partitioned:
+        statements.append(f"""
+        CREATE INDEX IF NOT EXISTS idx_{table_name}_ecosystem ON {table_name} (ecosystem);
+        """)
+    # 全文搜索索引和关键词搜索索引
+    statements.append(f"""
+        CREATE INDEX IF NOT EXISTS idx_{table_name}_summary_tsv ON {table_name}
+        USING gin(summary_tsv);
+        """)
+    statements.append(f"""
+        CREATE INDEX IF NOT EXISTS idx_{table_name}_keywords_tsv ON {table_name}
+        USING gin(keywords_tsv);
+        """)
+    return statements
+
+
+def vector_index_columns(table_name="summary_aug_keywords", quantization=None):
+    """[(向量索引名, 列名)], 量化索引名带量化方式后缀, 与全精度索引可以并存"""
+    suffix = f"_{quantization}" if quantization else ""
+    return [(f"idx_{table_name}_summary_vec{suffix}", "summary_embedding"),
+            (f"idx_{table_name}_keywords_vec{suffix}", "keywords_embedding")]
+
+
+def partition_name(table_name, ecosystem):
+    return f"{table_name}_{ecosystem}"
+
+
+def reindex_ecosystem(ecosystem, table_name="summary_aug_keywords"):
+    """
+    重建一个生态分区上的全部索引 (向量索引和全文索引)
+
+    REINDEX ... CONCURRENTLY 只对该分区加 SHARE UPDATE EXCLUSIVE 锁, 读写不受影响, 其他分区不会被重建;
+    它不能在事务中执行, 这里临时切换为自动提交。
+    """
+    partition = partition_name(table_name, ecosystem)
+    start = time.perf_counter()
+    with client.connection() as conn:
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(f"REINDEX TABLE CONCURRENTLY {partition}")
+        finally:
+            conn.autocommit = False
+    print(f"分区 {partition} 索引重建完成 ({time.perf_counter() - start:.2f} 秒)")
+
+
+def build_vector_indexes(table_name="summary_aug_keywords", metric="cosine", method="hnsw", m=16,
+                         ef_construction=64, lists=None, parallel_workers=None, quantization=None, search_client=None):
+    """
+    导入数据之后创建向量索引 (使用IVFFlat或HNSW)
+
+    参数:
+        table_name: 表名
+        metric: 向量距离度量 (l2 / cosine / ip), 决定索引的操作符类, 检索时必须使用相同的 metric
+        method: hnsw 或 ivfflat
+        m, ef_construction: hnsw 构建参数
+        lists: ivfflat 聚类中心数量, None 表示按行数计算
+        parallel_workers: 并行构建的 worker 数量
+        quantization: None 表示索引全精度向量; halfvec / bit 表示建量化表达式索引 (与全精度索引可以并存)
+        search_client: 在哪个数据库上创建, None 表示 client
+    """
+    with (search_client or client).connection() as conn:
+        with conn.cursor() as cursor:
+            for index_name, column in vector_index_columns(table_name, quantization):
+                elapsed = build_vector_index(cursor, index_name, table_name, column, metric, method,
+                                             m=m, ef_construction=ef_construction, lists=lists,
+                                             parallel_workers=parallel_workers, quantization=quantization)
+                print(f"向量索引 {index_name} 创建完成 ({method}, {elapsed:.2f} 秒)")
+
+
+def reload_table(documents, table_name="summary_aug_keywords", partitioned=False, metric="cosine", method="hnsw",
+                 parallel_builds=4, maintenance_work_mem="1GB", prewarm=True):
+    """
+    不停机重新导入: 导入影子表, 在完整数据上并行建索引, ANALYZE 和预热之后原子替换线上表 (见 table_swap)
+
+    参数:
+        documents: 文档字典的迭代器/生成器
+        table_name: 线上表名
+        partitioned: 影子表是否按 ecosystem 分区
+        metric, method: 向量索引参数, 与 build_vector_indexes 相同
+        parallel_builds: 同时构建的索引数量, 每个索引占用一个连接和 maintenance_work_mem
+        maintenance_work_mem: 每个索引构建使用的内存
+        prewarm: 切换前是否把表和索引读入 shared_buffers
+    """
+    from binary_copy import copy_documents
+    from table_swap import prewarm as prewarm_table, swap_tables
+    from upsert import UPSERT_COLUMNS, with_content_hash
+
+    shadow = f"{table_name}_shadow"
+    timings = {}
+
+    start = time.perf_counter()
+    setup_database(shadow, partitioned=partitioned, indexes=False)
+    with client.connection() as conn:
+        rows = copy_documents(conn, with_content_hash(documents), shadow, columns=UPSERT_COLUMNS)
+    timings["load"] = time.perf_counter() - start
+
+    def run_statement(statement):
+        with client.cursor() as cursor:
+            cursor.execute("SELECT set_config('maintenance_work_mem', %s, true)", (maintenance_work_mem,))
+            cursor.execute(statement)
+
+    def run_vector_build(index_name, column):
+        with client.cursor() as cursor:
+            build_vector_index(cursor, index_name, shadow, column, metric, method,
+                               maintenance_work_mem=maintenance_work_mem)
+
+    # 全部索引都在数据导入完成之后一次性构建, 不在导入过程中逐行维护
+    start = time.perf_counter()
+    with ThreadPoolExecutor(parallel_builds) as executor:
+        futures = [executor.submit(run_statement, statement) for statement in index_statements(shadow, partitioned)]
+        futures += [executor.submit(run_vector_build, index_name, column)
+                    for index_name, column in vector_index_columns(shadow)]
+        for future in futures:
+            future.result()
+    timings["index"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with client.connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(f"ANALYZE {shadow}")
+            blocks = prewarm_table(cursor, shadow) if prewarm else 0
+    timings["analyze_prewarm"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with client.connection() as conn:
+        swap_tables(conn, table_name, shadow)
+    timings["swap"] = time.perf_counter() - start
+
+    print(f"{table_name} 重新导入完成: {rows} 行, 预热 {blocks} 个块, "
+          + ", ".join(f"{stage} {seconds:.2f} 秒" for stage, seconds in timings.items()))
+    return timings
+
+
 # 样例文档数据
 sample_documents = [
     {
@@ -135,39 +290,104 @@ sample_documents = [
     },
 ]
 
-def insert_sample_data(table_name="summary_aug_keywords"):
-    """插入样例数据"""
-    conn = psycopg2.connect(**DB_CONFIG)
-    cursor = conn.cursor()
+def insert_sample_data(table_name="summary_aug_keywords", normalize=False):
+    """
+    插入样例数据, 已存在的 package_id 按内容哈希增量更新, 重复执行不会报错也不会重写未变化的行
+
+    参数:
+        table_name: 表名
+        normalize: 是否对向量做 L2 归一化, 归一化后可以使用 metric="ip" 代替余弦距离
+    """
+    with client.connection() as conn:
+        stats = upsert_documents(conn, sample_documents, table_name, normalize=normalize)
+    print(f"插入了 {stats['inserted']} 条样例数据, 更新 {stats['updated']} 条, 未变化 {stats['unchanged']} 条")
 
 
-    try:
-        # 插入数据
-        execute_values(
-            cursor,
-            f"""
-            INSERT INTO {table_name} (package_id, package_name, ecosystem, summary, augmented_keywords, summary_embedding, keywords_embedding)
-            VALUES %s
-            """,
-            [
-                (doc["package_id"], doc["package_name"], doc["ecosystem"], doc["summary"], doc["augmented_keywords"],
-                 doc["summary_embedding"], doc["keywords_embedding"])
-                for doc in sample_documents
-            ]
-        )
-    except psycopg2.errors.UniqueViolation:
-        print("psycopg2.errors.UniqueViolation")
-
-    conn.commit()
-    cursor.close()
-    conn.close()
-    print(f"插入了 {len(sample_documents)} 条样例数据")
+# 检索结果的列投影。每行固定为 id, package_id, combined_score 和四个分项得分 (共 7 列), 再依次加上投影中的列:
+#   ids   只返回 id 和得分, 需要时用 fetch_documents / fetch_embeddings 按 id 取回
+#   text  加上 summary, augmented_keywords
+#   full  再加上 summary_embedding, keywords_embedding (float32 NumPy 数组)
+# 向量列不放在检索 SQL 里 (文本格式每个向量约 8KB, 还要在客户端逐个解析), 而是检索完成后按 id 以二进制 COPY 取回。
+PROJECTIONS = {
+    "ids": [],
+    "text": ["summary", "augmented_keywords"],
+    "full": ["summary", "augmented_keywords", "summary_embedding", "keywords_embedding"],
+}
+
+EMBEDDING_COLUMNS = ["summary_embedding", "keywords_embedding"]
+
+
+def projection_columns(projection):
+    """返回投影中的 (文本列, 向量列)"""
+    if projection not in PROJECTIONS:
+        raise ValueError(f"未知的投影: {projection}, 可选: {list(PROJECTIONS)}")
+    columns = PROJECTIONS[projection]
+    return ([column for column in columns if column not in EMBEDDING_COLUMNS],
+            [column for column in columns if column in EMBEDDING_COLUMNS])
+
+
+def fetch_documents(ids, columns=("package_id", "summary", "augmented_keywords"), table_name="summary_aug_keywords",
+                    search_client=None):
+    """
+    按 id 取回文档的文本列
+
+    返回 {id: 行元组}, 行元组中的列与 columns 一致; 不存在的 id 不出现在结果中
+    """
+    if not ids:
+        return {}
+    with (search_client or client).cursor() as cursor:
+        cursor.execute(f"SELECT id, {', '.join(columns)} FROM {table_name} WHERE id = ANY(%s::bigint[])",
+                       (array_literal(list(ids)),))
+        return {row[0]: row[1:] for row in cursor.fetchall()}
+
+
+def fetch_embeddings(ids, columns=EMBEDDING_COLUMNS, table_name="summary_aug_keywords", search_client=None):
+    """
+    按 id 取回向量列, 以二进制 COPY 传输并直接解码为 float32 NumPy 数组
+
+    返回 {id: (各向量列的数组)}
+    """
+    if not ids:
+        return {}
+    with (search_client or client).cursor() as cursor:
+        query = cursor.mogrify(f"SELECT id, {', '.join(columns)} FROM {table_name} WHERE id = ANY(%s::bigint[])",
+                               (array_literal(list(ids)),)).decode()
+        rows = copy_query_rows(cursor, query, ["int4"] + ["vector"] * len(columns))
+    return {row[0]: row[1:] for row in rows}
+
+
+def _attach_embeddings(result_lists, table_name, columns, search_client=None):
+    """为每一行结果追加向量列, result_lists 为结果行列表的列表"""
+    if not columns:
+        return result_lists
+    embeddings = fetch_embeddings({row[0] for rows in result_lists for row in rows}, columns, table_name,
+                                  search_client)
+    missing = (None,) * len(columns)
+    return [[tuple(row) + embeddings.get(row[0], missing) for row in rows] for rows in result_lists]
+
+
+# hybrid_search 中各参数的 PostgreSQL 类型, 用于服务端预备语句
+SEARCH_PARAM_TYPES = {
+    "weight_summary_vector": "float8",
+    "query_summary_vector": "vector",
+    "weight_keywords_vector": "float8",
+    "query_keywords_vector": "vector",
+    "weight_summary_text": "float8",
+    "query_summary_text": "text",
+    "weight_keywords_text": "float8",
+    "query_keywords_text": "text",
+    "candidate_k": "int",
+    "top_k": "int",
+}
 
 
 def hybrid_search(weight_summary_vector, query_summary_vector,
                   weight_keywords_vector, query_keywords_vector,
                   weight_summary_text, query_summary_text,
-                  weight_keywords_text, query_keywords_text, top_k=5, table_name="summary_aug_keywords"):
+                  weight_keywords_text, query_keywords_text, top_k=5, table_name="summary_aug_keywords",
+                  fusion="weighted", candidate_k=100, prepared=True, metric="cosine", ef_search=None, probes=None,
+                  quantization=None, verbose=True, filters=None, iterative_scan="relaxed_order", projection="ids",
+                  search_client=None):
     """
     执行混合检索 (向量 + BM25)
 
@@ -177,84 +397,599 @@ def hybrid_search(weight_summary_vector, query_summary_vector,
         vector_weight: 向量相似度权重
         text_weight: 文本相似度权重
         top_k: 返回结果数量
+        fusion: weighted / rrf 表示四个字段先各自通过索引召回候选, 只对候选补算缺少的字段得分,
+                再做加权求和或 RRF 融合; 权重为 0 的字段不召回也不打分, 结果中该字段得分为 None。
+                None 表示对全表打分排序 (精确结果, 用作对照)
+        candidate_k: 融合模式下每路召回的候选数量
+        prepared: 是否使用服务端预备语句 (每个连接只解析和规划一次)
+        metric: 向量距离度量, 必须与 setup_database 使用的一致, 否则无法使用向量索引;
+                ip 要求数据已归一化, 查询向量会在这里归一化
+        ef_search: 本次查询的 hnsw.ef_search, None 表示使用连接的默认值
+        probes: 本次查询的 ivfflat.probes, None 表示使用连接的默认值
+        quantization: 融合模式下向量字段的粗排方式, halfvec / bit 表示先在量化索引上召回 candidate_k 个候选,
+                      再用全精度向量重排 (需要先 build_vector_indexes(quantization=...));
+                      hnsw 一次最多返回 ef_search 个结果, ef_search 应不小于 candidate_k
+        verbose: 是否打印结果
+        filters: 结构化过滤条件 (见 search_filter), 例如 {"ecosystem": ["npm", "pypi"]}
+        iterative_scan: 向量索引的迭代扫描方式, 过滤条件很严格时保证每路候选仍能凑够 candidate_k 行;
+                        只在有过滤条件时设置, 不带过滤的检索不为它多一次 set_config 往返
+        projection: 结果中返回哪些列, ids / text / full (见 PROJECTIONS)
+        search_client: 执行检索的数据库, None 表示 client; 读写分离时由 replica_routing.ReplicaRouter 选择
+
+    client 配置了 result_cache 时, 相同的查询 (文本规范化后相同、向量相同、其余参数相同) 直接返回缓存的结果
+    """
+    if metric == "ip":
+        query_summary_vector = l2_normalize(query_summary_vector)
+        query_keywords_vector = l2_normalize(query_keywords_vector)
+
+    params = {
+        "weight_summary_vector": weight_summary_vector,
+        "query_summary_vector": query_summary_vector,
+        "weight_keywords_vector": weight_keywords_vector,
+        "query_keywords_vector": query_keywords_vector,
+        "weight_summary_text": weight_summary_text,
+        "query_summary_text": query_summary_text,
+        "weight_keywords_text": weight_keywords_text,
+        "query_keywords_text": query_keywords_text,
+        "candidate_k": candidate_k,
+        "top_k": top_k,
+    }
+    where, filter_params, filter_types = build_filter(filters)
+    params.update(filter_params)
+    sql = search_sql(table_name, fusion, metric, quantization, where=where, projection=projection, weights=params)
+    iterative_scan = iterative_scan if where else None
+
+    def search():
+        trace = client.trace("hybrid_search" if fusion is None else f"hybrid_search_{fusion}", table_name)
+        try:
+            results = _execute_search(sql, params, prepared,
+                                      table_name=table_name, metric=metric, ef_search=ef_search, probes=probes,
+                                      quantization=quantization, types={**SEARCH_PARAM_TYPES, **filter_types},
+                                      iterative_scan=iterative_scan, trace=trace, search_client=search_client)
+            results = _attach_embeddings([results], table_name, projection_columns(projection)[1],
+                                         search_client)[0]
+            trace.mark("decode")
+        except Exception as error:
+            trace.finish(error=error)
+            raise
+        trace.finish(rows=len(results))
+        return results
+
+    # 缓存在 client 上, 读写分离时各备库的检索共用同一份缓存; 备库的回放可能落后于导入,
+    # 只有主库执行的结果才写入缓存, 备库执行时只读缓存
+    results = client.cached_search(table_name, sql, params, search,
+                                   text_params=("query_summary_text", "query_keywords_text"),
+                                   store=search_client is None or search_client is client,
+                                   ef_search=ef_search, probes=probes, iterative_scan=iterative_scan,
+                                   projection=projection)
+    if verbose:
+        print_results(results)
+    return results
+
+
+# 批量检索中每个查询各自的参数 (与 hybrid_search 前 8 个参数的顺序一致), top_k 等其余参数整批共用
+BATCH_QUERY_FIELDS = (
+    "weight_summary_vector", "query_summary_vector",
+    "weight_keywords_vector", "query_keywords_vector",
+    "weight_summary_text", "query_summary_text",
+    "weight_keywords_text", "query_keywords_text",
+)
+
+# 每个查询参数以数组传入, 无论批量大小, 预备语句都相同
+BATCH_PARAM_TYPES = {
+    **{name: SEARCH_PARAM_TYPES[name] + "[]" for name in BATCH_QUERY_FIELDS},
+    "candidate_k": "int",
+    "top_k": "int",
+}
+
+
+def hybrid_search_batch(queries, top_k=5, table_name="summary_aug_keywords", fusion="rrf", candidate_k=100,
+                        prepared=True, metric="cosine", ef_search=None, probes=None, quantization=None,
+                        projection="ids", search_client=None):
+    """
+    在一次往返中执行一批混合检索
+
+    所有查询的参数分别打包成数组, 服务端用 unnest 展开, 每个查询通过 LATERAL 子查询各自检索 top_k,
+    耗时随批量大小增长, 而不是随网络往返次数增长。
+
+    参数:
+        queries: 查询列表, 每个查询是以 BATCH_QUERY_FIELDS 为键的字典, 或按 hybrid_search 前 8 个参数顺序排列的元组
+        其余参数与 hybrid_search 相同, 对整批查询生效
+
+    返回与 queries 顺序一致的列表, 每项为该查询的结果行 (格式与 hybrid_search 相同)
+    """
+    queries = [query if isinstance(query, dict) else dict(zip(BATCH_QUERY_FIELDS, query)) for query in queries]
+    if not queries:
+        return []
+    if metric == "ip":
+        for query in queries:
+            query["query_summary_vector"] = l2_normalize(query["query_summary_vector"])
+            query["query_keywords_vector"] = l2_normalize(query["query_keywords_vector"])
+
+    params = {name: array_literal([query[name] for query in queries]) for name in BATCH_QUERY_FIELDS}
+    params["candidate_k"] = candidate_k
+    params["top_k"] = top_k
+    trace = client.trace("hybrid_search_batch", table_name)
+    try:
+        rows = _execute_search(batch_search_sql(table_name, fusion, metric, quantization, projection), params,
+                               prepared, table_name=table_name, metric=metric, ef_search=ef_search, probes=probes,
+                               quantization=quantization, types=BATCH_PARAM_TYPES, trace=trace,
+                               search_client=search_client)
+
+        results = [[] for _ in queries]
+        for row in rows:
+            results[row[0] - 1].append(row[1:])
+        results = _attach_embeddings(results, table_name, projection_columns(projection)[1], search_client)
+        trace.mark("decode")
+    except Exception as error:
+        trace.finish(error=error)
+        raise
+    trace.finish(rows=len(rows))
+    return results
+
+
+def batch_search_sql(table_name="summary_aug_keywords", fusion="rrf", metric="cosine", quantization=None,
+                     projection="ids"):
+    """把单个查询的检索 SQL 包装为 unnest + LATERAL 的批量形式, 每行第一列为查询序号 (从 1 开始)"""
+    per_query = search_sql(table_name, fusion, metric, quantization, projection=projection).strip().rstrip(";")
+    # 每个查询各自的参数改为引用 unnest 展开后的列
+    per_query = re.sub(r"%\((\w+)\)s",
+                       lambda m: f"q.{m.group(1)}" if m.group(1) in BATCH_QUERY_FIELDS else m.group(0),
+                       per_query)
+    arrays = ", ".join(f"%({name})s::{BATCH_PARAM_TYPES[name]}" for name in BATCH_QUERY_FIELDS)
+    return f"""
+    SELECT q.query_no, r.*
+    FROM unnest({arrays}) WITH ORDINALITY AS q({", ".join(BATCH_QUERY_FIELDS)}, query_no)
+    CROSS JOIN LATERAL ({per_query}
+    ) r
+    ORDER BY q.query_no, r.combined_score DESC
     """
-    conn = psycopg2.connect(**DB_CONFIG)
-    cursor = conn.cursor()
-
-    # 执行混合查询，不再需要显式类型转换
-    # cursor.execute(f"""
-    # SELECT
-    #     package_id,
-    #     summary,
-    #     augmented_keywords,
-    #     %s * (1 - (summary_embedding <=> %s))
-    #     + %s * (1 - (keywords_embedding <=> %s))
-    #     + %s * ts_rank(to_tsvector('english', summary), plainto_tsquery('english', %s))
-    #     + %s * ts_rank(to_tsvector('english', augmented_keywords), plainto_tsquery('english', %s))  AS combined_score,
-    #     (1 - (summary_embedding <=> %s)) AS summary_embedding_score,
-    #     (1 - (keywords_embedding <=> %s)) AS keywords_embedding_score,
-    #     ts_rank(to_tsvector('english', summary), plainto_tsquery('english', %s)) as summary_text_score,
-    #     ts_rank(to_tsvector('english', augmented_keywords), plainto_tsquery('english', %s)) as keywords_text_score,
-    #     summary_embedding,
-    #     keywords_embedding,
-    # FROM {table_name}
-    # ORDER BY combined_score DESC
-    # LIMIT %s;
-    # """, (weight_summary_vector, query_summary_vector,
-    #       weight_keywords_vector, query_keywords_vector,
-    #       weight_summary_text, query_summary_text,
-    #       weight_keywords_text, query_keywords_text,
-    #       query_summary_vector, query_keywords_vector, query_summary_text, query_keywords_text,
-    #       top_k))
 
 
+def search_sql(table_name="summary_aug_keywords", fusion=None, metric="cosine", quantization=None, rescore=False,
+               where=None, projection="ids", weights=None):
+    """
+    构造混合检索 SQL, 所有查询值都通过 %(name)s 参数传入, where 为附加的过滤条件
+
+    每行依次为 id, package_id, combined_score, 四个分项得分, 以及 projection 中的文本列 (见 PROJECTIONS);
+    向量列不在这里返回。融合模式下 weights 为检索参数字典时, 权重为 0 的字段不参与召回和打分 (见 search_fields)
+    """
+    text_columns, _ = projection_columns(projection)
+    if fusion is not None:
+        return _fused_sql(table_name, fusion, metric, quantization, rescore, where, text_columns, weights)
+    if quantization is not None or rescore:
+        raise ValueError("量化粗排和候选重新打分只用于融合模式, 请同时指定 fusion")
+
+    summary_score = score_sql("summary_embedding", "%(query_summary_vector)s", metric)
+    keywords_score = score_sql("keywords_embedding", "%(query_keywords_vector)s", metric)
+    filter_sql = f"\n        WHERE {where}" if where else ""
+    extra_sql = "".join(f",\n            {column}" for column in text_columns)
     # 各分项得分最高为1分
-    cursor.execute(f"""
+    return f"""
         SELECT
+            id,
             package_id,
-            summary,
-            augmented_keywords,
-            {weight_summary_vector} * (1 - (summary_embedding <=> '{query_summary_vector}'))
-            + {weight_keywords_vector} * (1 - (keywords_embedding <=> '{query_keywords_vector}'))
-            + {weight_summary_text} * ts_rank(to_tsvector('english', summary), plainto_tsquery('english', '{query_summary_text}'))
-            + {weight_keywords_text} * ts_rank(to_tsvector('english', augmented_keywords), plainto_tsquery('english', '{query_keywords_text}'))  AS combined_score,
-            (1 - (summary_embedding <=> '{query_summary_vector}')) AS summary_embedding_score,
-            (1 - (keywords_embedding <=> '{query_keywords_vector}')) AS keywords_embedding_score,
-            ts_rank(to_tsvector('english', summary), plainto_tsquery('english', '{query_summary_text}')) as summary_text_score,
-            ts_rank(to_tsvector('english', augmented_keywords), plainto_tsquery('english', '{query_keywords_text}')) as keywords_text_score,
-            summary_embedding,
-            keywords_embedding
-        FROM {table_name}
+            %(weight_summary_vector)s * {summary_score}
+            + %(weight_keywords_vector)s * {keywords_score}
+            + %(weight_summary_text)s * ts_rank(summary_tsv, plainto_tsquery('english', %(query_summary_text)s))
+            + %(weight_keywords_text)s * ts_rank(keywords_tsv, plainto_tsquery('english', %(query_keywords_text)s))  AS combined_score,
+            {summary_score} AS summary_embedding_score,
+            {keywords_score} AS keywords_embedding_score,
+            ts_rank(summary_tsv, plainto_tsquery('english', %(query_summary_text)s)) as summary_text_score,
+            ts_rank(keywords_tsv, plainto_tsquery('english', %(query_keywords_text)s)) as keywords_text_score{extra_sql}
+        FROM {table_name}{filter_sql}
         ORDER BY combined_score DESC
-        LIMIT {top_k};
-        """)
+        LIMIT %(top_k)s;
+        """
+
+
+# search_fields 中各字段的权重参数, 顺序与结果中的四个分项得分一致
+FIELD_WEIGHT_PARAMS = {
+    "summary_vector": "weight_summary_vector",
+    "keywords_vector": "weight_keywords_vector",
+    "summary_text": "weight_summary_text",
+    "keywords_text": "weight_keywords_text",
+}
+
+
+def search_fields(metric="cosine", quantization=None, weights=None):
+    """
+    融合模式下参与召回和打分的字段
+
+    weights 为检索参数字典 (包含 FIELD_WEIGHT_PARAMS 中的权重) 时去掉权重为 0 的字段, None 表示四个字段都参与
+    """
+    fields = [
+        vector_field("summary_vector", "summary_embedding", "%(query_summary_vector)s",
+                     "%(weight_summary_vector)s", metric, quantization),
+        vector_field("keywords_vector", "keywords_embedding", "%(query_keywords_vector)s",
+                     "%(weight_keywords_vector)s", metric, quantization),
+        text_field("summary_text", "summary_tsv",
+                   "plainto_tsquery('english', %(query_summary_text)s)", "%(weight_summary_text)s"),
+        text_field("keywords_text", "keywords_tsv",
+                   "plainto_tsquery('english', %(query_keywords_text)s)", "%(weight_keywords_text)s"),
+    ]
+    if weights is None:
+        return fields
+    return active_fields(fields, {name: weights[param] for name, param in FIELD_WEIGHT_PARAMS.items()})
+
+
+def _fused_sql(table_name, fusion, metric, quantization=None, rescore=False, where=None, text_columns=(),
+               weights=None):
+    """
+    索引召回 + 融合排序, 只对候选打分, 结果列与全表打分模式保持一致
+
+    rescore 为 True 时不在 SQL 中召回候选, 而是对客户端传入的候选数组打分 (见 build_rescore_query),
+    过滤条件已在召回时生效, 这里不再需要 where。
+    被 weights 去掉的字段在结果中得分为 NULL
+    """
+    columns = ["id", "package_id", *text_columns]
+    fields = search_fields(metric, quantization, weights)
+    active = {field["name"] for field in fields}
+    if rescore:
+        fused_sql = build_rescore_query(table_name, columns, fields, fusion=fusion)
+    else:
+        fused_sql = build_fused_query(table_name, columns, fields, fusion=fusion, where=where)
+    scores = ",\n        ".join(
+        f"{name}_score" if name in active else f"NULL::float8 AS {name}_score" for name in FIELD_WEIGHT_PARAMS
+    )
+    extra_sql = "".join(f",\n        {column}" for column in text_columns)
+    return f"""
+    SELECT
+        id,
+        package_id,
+        combined_score,
+        {scores}{extra_sql}
+    FROM ({fused_sql}) fused
+    ORDER BY combined_score DESC
+    """
+
+
+def _execute_search(sql, params, prepared, table_name="summary_aug_keywords", metric="cosine",
+                    ef_search=None, probes=None, quantization=None, types=SEARCH_PARAM_TYPES, iterative_scan=None,
+                    trace=None, search_client=None):
+    """
+    执行检索 SQL; trace 为 client.trace() 返回的记录对象, 记录 connect / execute / fetch 耗时和抽样的执行计划;
+    search_client 为执行查询的数据库, None 表示 client (分片检索时为各分片的 SearchClient)
+    """
+    trace = trace or NULL_TRACE
+    db = search_client or client
+    with db.cursor() as cursor:
+        trace.mark("connect")
+        # 量化粗排走表达式索引, 检查对应的量化表达式索引而不是列上的全精度索引
+        check_vector_index(cursor, table_name, "summary_embedding", metric, quantization=quantization)
+        check_vector_index(cursor, table_name, "keywords_embedding", metric, quantization=quantization)
+        set_search_params(cursor, ef_search, probes, iterative_scan)
+        if prepared:
+            db.execute_prepared(cursor, sql, params, types)
+        else:
+            cursor.execute(sql, params)
+        trace.mark("execute")
+        rows = cursor.fetchall()
+        trace.mark("fetch")
+        # 在同一事务中解释, 检索参数与实际执行时相同
+        if trace.should_explain():
+            trace.set_plan(db.explain(cursor, sql, params, types if prepared else None))
+        return rows
 
-    results = cursor.fetchall()
 
+def benchmark_prepared(n_queries=200, table_name="summary_aug_keywords", fusion=None, metric="cosine"):
+    """
+    对比客户端拼接参数与服务端预备语句的单次查询延迟
+
+    参数:
+        n_queries: 每种方式执行的查询次数
+        table_name: 表名
+        fusion: 传给 search_sql 的融合方式
+        metric: 向量距离度量
+    """
+    sql = search_sql(table_name, fusion, metric)
+    doc = sample_documents[2]
+    params = {
+        "weight_summary_vector": 0.25,
+        "query_summary_vector": doc["summary_embedding"],
+        "weight_keywords_vector": 0.25,
+        "query_keywords_vector": doc["keywords_embedding"],
+        "weight_summary_text": 0.25,
+        "query_summary_text": doc["summary"],
+        "weight_keywords_text": 0.25,
+        "query_keywords_text": doc["augmented_keywords"],
+        "candidate_k": 100,
+        "top_k": 5,
+    }
+
+    report = {}
+    for prepared in (False, True):
+        # 预热一次, 预备语句的 PREPARE 不计入延迟
+        _execute_search(sql, params, prepared, table_name, metric)
+        latencies = []
+        for _ in range(n_queries):
+            start = time.perf_counter()
+            _execute_search(sql, params, prepared, table_name, metric)
+            latencies.append((time.perf_counter() - start) * 1000)
+        latencies.sort()
+        report["prepared" if prepared else "interpolated"] = {
+            "mean_ms": sum(latencies) / len(latencies),
+            "p50_ms": latencies[len(latencies) // 2],
+            "p99_ms": latencies[int(len(latencies) * 0.99)],
+        }
+
+    print(f"\n单次查询延迟对比 ({n_queries} 次, {table_name}, fusion={fusion}):")
+    print("=" * 80)
+    for method, stats in report.items():
+        print(f"{method:>12}: 平均 {stats['mean_ms']:.2f} ms, p50 {stats['p50_ms']:.2f} ms, p99 {stats['p99_ms']:.2f} ms")
+    return report
+
+
+def benchmark_projection(n_queries=200, table_name="summary_aug_keywords", fusion="rrf", top_k=20):
+    """
+    对比不同投影下的检索延迟和结果大小
+
+    结果大小按 pickle 序列化后的字节数估算; inline_text_vectors 为旧的做法 (向量以文本格式随结果返回) 的大小
+
+    参数:
+        n_queries: 每种投影执行的查询次数
+        table_name: 表名
+        fusion: 融合方式
+        top_k: 每个查询返回的结果数
+    """
+    import pickle
+
+    doc = sample_documents[2]
+    query = (0.25, doc["summary_embedding"], 0.25, doc["keywords_embedding"],
+             0.25, doc["summary"], 0.25, doc["augmented_keywords"])
+
+    report = {}
+    for projection in PROJECTIONS:
+        hybrid_search(*query, top_k=top_k, table_name=table_name, fusion=fusion, verbose=False, projection=projection)
+        latencies = []
+        for _ in range(n_queries):
+            start = time.perf_counter()
+            results = hybrid_search(*query, top_k=top_k, table_name=table_name, fusion=fusion, verbose=False,
+                                    projection=projection)
+            latencies.append((time.perf_counter() - start) * 1000)
+        latencies.sort()
+        report[projection] = {
+            "p50_ms": latencies[len(latencies) // 2],
+            "p99_ms": latencies[int(len(latencies) * 0.99)],
+            "bytes_per_row": len(pickle.dumps(results)) / max(len(results), 1),
+        }
+
+    # 旧的结果行: 文本列加上文本格式的向量
+    with client.cursor() as cursor:
+        cursor.execute(f"""
+        SELECT avg(octet_length(summary) + octet_length(augmented_keywords)
+                   + octet_length(summary_embedding::text) + octet_length(keywords_embedding::text))
+        FROM {table_name} WHERE id = ANY(%s::bigint[])
+        """, (array_literal([row[0] for row in results]),))
+        report["inline_text_vectors"] = {"bytes_per_row": float(cursor.fetchone()[0] or 0)}
+
+    print(f"\n结果投影对比 ({n_queries} 次, top_k={top_k}, {table_name}, fusion={fusion}):")
+    print("=" * 80)
+    for projection, stats in report.items():
+        latency = f"p50 {stats['p50_ms']:.2f} ms, p99 {stats['p99_ms']:.2f} ms, " if "p50_ms" in stats else ""
+        print(f"{projection:>20}: {latency}每行约 {stats['bytes_per_row']:,.0f} 字节")
+    return report
+
+
+def benchmark_batch(n_queries=1000, batch_sizes=(1, 10, 100, 1000), table_name="summary_aug_keywords",
+                    fusion="rrf", metric="cosine"):
+    """
+    对比不同批量大小下的检索吞吐量 (queries/s)
+
+    参数:
+        n_queries: 查询总数, 按 batch_size 分批发送
+        batch_sizes: 参与对比的批量大小, 1 相当于逐个调用 hybrid_search
+        table_name: 表名
+        fusion: 融合方式
+        metric: 向量距离度量
+    """
+    from synthetic_data import generate_packages
+
+    queries = [
+        (0.25, doc["summary_embedding"], 0.25, doc["keywords_embedding"],
+         0.25, doc["summary"], 0.25, doc["augmented_keywords"])
+        for doc in generate_packages(n_queries, seed=1)
+    ]
+
+    report = {}
+    for batch_size in batch_sizes:
+        # 预热一次, 预备语句的 PREPARE 不计入耗时
+        hybrid_search_batch(queries[:batch_size], table_name=table_name, fusion=fusion, metric=metric)
+        start = time.perf_counter()
+        for i in range(0, n_queries, batch_size):
+            hybrid_search_batch(queries[i:i + batch_size], table_name=table_name, fusion=fusion, metric=metric)
+        report[batch_size] = n_queries / (time.perf_counter() - start)
+
+    print(f"\n批量检索吞吐量对比 ({n_queries} 个查询, {table_name}, fusion={fusion}):")
+    print("=" * 80)
+    for batch_size, queries_per_second in report.items():
+        print(f"batch_size={batch_size:>5}: {queries_per_second:,.1f} queries/s")
+    return report
+
+
+def benchmark_filtered_search(n=100000, selectivities=(0.1, 0.01, 0.001), top_k=10, n_queries=50,
+                              table_name="summary_aug_keywords", metric="cosine"):
+    """
+    带严格过滤条件的向量 top-k: 对比关闭与开启迭代索引扫描时每个查询实际返回的行数和延迟
+
+    过滤条件为 id <= n * selectivity, 与向量无关, 只有 selectivity 比例的行满足条件。
+    过滤条件很严格时规划器也可能直接选择 B-tree 索引再精确排序, 同样能返回完整的 top_k。
+
+    参数:
+        n: 合成数据行数, 表会被重建
+        selectivities: 满足过滤条件的行所占比例
+        top_k: 返回结果数量
+        n_queries: 每种配置执行的查询次数
+        table_name: 表名
+        metric: 向量距离度量
+    """
+    from binary_copy import copy_documents
+    from synthetic_data import generate_packages
+
+    setup_database(table_name)
+    with client.connection() as conn:
+        copy_documents(conn, generate_packages(n), table_name)
+    build_vector_indexes(table_name, metric)
+
+    queries = [doc["summary_embedding"] for doc in generate_packages(n_queries, seed=1)]
+    report = {}
+    for selectivity in selectivities:
+        where, filter_params, _ = build_filter({"id": {"lte": max(1, int(n * selectivity))}})
+        sql = f"""
+        SELECT id
+        FROM {table_name}
+        WHERE {where}
+        ORDER BY {distance_sql("summary_embedding", "%(query_vector)s", metric)}
+        LIMIT %(top_k)s
+        """
+        for iterative_scan in ("off", "relaxed_order"):
+            latencies = []
+            rows = 0
+            for query_vector in queries:
+                start = time.perf_counter()
+                with client.cursor() as cursor:
+                    set_search_params(cursor, iterative_scan=iterative_scan)
+                    cursor.execute(sql, {"query_vector": query_vector, "top_k": top_k, **filter_params})
+                    rows += len(cursor.fetchall())
+                latencies.append((time.perf_counter() - start) * 1000)
+            latencies.sort()
+            report[(selectivity, iterative_scan)] = {
+                "avg_rows": rows / n_queries,
+                "p50_ms": latencies[len(latencies) // 2],
+                "p95_ms": latencies[int(len(latencies) * 0.95)],
+            }
+
+    print(f"\n过滤向量检索对比 ({n} 行, {table_name}, top_k={top_k}):")
+    print("=" * 80)
+    for (selectivity, iterative_scan), stats in report.items():
+        print(f"选择率 {selectivity:>6.1%}, iterative_scan={iterative_scan:>13}: 平均返回 {stats['avg_rows']:.1f} 行, "
+              f"p50 {stats['p50_ms']:.2f} ms, p95 {stats['p95_ms']:.2f} ms")
+    return report
+
+
+def benchmark_partitioned(n=100000, n_queries=50, ecosystem="npm", table_name="summary_aug_keywords",
+                          fusion="rrf", metric="cosine"):
+    """
+    对比普通表与按 ecosystem 分区的表上, 限定生态与不限定生态的混合检索延迟
+
+    参数:
+        n: 合成数据行数, 表会被重建两次
+        n_queries: 每种配置执行的查询次数
+        ecosystem: 限定查询使用的生态
+        table_name: 表名
+        fusion: 融合方式
+        metric: 向量距离度量
+    """
+    from binary_copy import copy_documents
+    from synthetic_data import generate_packages
+
+    queries = [
+        (0.25, doc["summary_embedding"], 0.25, doc["keywords_embedding"],
+         0.25, doc["summary"], 0.25, doc["augmented_keywords"])
+        for doc in generate_packages(n_queries, seed=1)
+    ]
+    report = {}
+    for partitioned in (False, True):
+        setup_database(table_name, partitioned=partitioned)
+        with client.connection() as conn:
+            copy_documents(conn, generate_packages(n), table_name)
+        build_vector_indexes(table_name, metric)
+        for scope, filters in (("unscoped", None), ("scoped", {"ecosystem": ecosystem})):
+            latencies = []
+            for query in queries:
+                start = time.perf_counter()
+                hybrid_search(*query, table_name=table_name, fusion=fusion, metric=metric, verbose=False,
+                              filters=filters)
+                latencies.append((time.perf_counter() - start) * 1000)
+            latencies.sort()
+            report[("partitioned" if partitioned else "single", scope)] = {
+                "p50_ms": latencies[len(latencies) // 2],
+                "p95_ms": latencies[int(len(latencies) * 0.95)],
+            }
+
+    print(f"\n分区检索对比 ({n} 行, {table_name}, 限定生态 {ecosystem}, fusion={fusion}):")
+    print("=" * 80)
+    for (layout, scope), stats in report.items():
+        print(f"{layout:>11} {scope:>8}: p50 {stats['p50_ms']:.2f} ms, p95 {stats['p95_ms']:.2f} ms")
+    return report
+
+
+def benchmark_candidate_merge(n_queries=200, table_name="summary_aug_keywords", top_k=10, candidate_k=100,
+                              metric="cosine"):
+    """
+    对比全表打分与 "各字段索引召回 + 只对候选补算缺少的得分" 的延迟, 以及后者相对全表打分结果的召回率
+
+    每种权重组合各执行一遍, 权重为 0 的字段在融合模式下不召回也不打分, 全表打分模式仍对每行计算四个得分。
+
+    参数:
+        n_queries: 每种配置执行的查询次数
+        table_name: 表名, 需要已有数据和索引
+        top_k: 返回结果数量
+        candidate_k: 每个字段召回的候选数量
+        metric: 向量距离度量
+    """
+    from benchmark import latency_stats, make_queries
+
+    profiles = {
+        "four_fields": (0.25, 0.25, 0.25, 0.25),
+        "two_vectors": (0.5, 0.5, 0, 0),
+        "summary_vector": (1, 0, 0, 0),
+    }
+    report = {}
+    for profile, weights in profiles.items():
+        queries = [
+            (weights[0], query[1], weights[1], query[3], weights[2], query[5], weights[3], query[7])
+            for query in make_queries(n_queries)
+        ]
+        results = {}
+        for fusion in (None, "weighted"):
+            latencies, results[fusion] = [], []
+            for query in queries:
+                start = time.perf_counter()
+                rows = hybrid_search(*query, top_k=top_k, table_name=table_name, fusion=fusion,
+                                     candidate_k=candidate_k, metric=metric, verbose=False)
+                latencies.append((time.perf_counter() - start) * 1000)
+                results[fusion].append({row[1] for row in rows})
+            report[(profile, fusion or "full_table")] = latency_stats(latencies)
+        # 以全表打分的结果为准, 召回不足 candidate_k 的字段会漏掉的结果
+        report[(profile, "weighted")]["recall"] = float(np.mean([
+            len(exact & merged) / len(exact) if exact else 1.0
+            for exact, merged in zip(results[None], results["weighted"])
+        ]))
+
+    print(f"\n全表打分与候选合并对比 ({n_queries} 次, {table_name}, top_k={top_k}, candidate_k={candidate_k}):")
+    print("=" * 80)
+    for (profile, mode), stats in report.items():
+        recall = f", recall@{top_k} {stats['recall']:.3f}" if "recall" in stats else ""
+        print(f"{profile:>15} {mode:>10}: p50 {stats['p50_ms']:.2f} ms, p95 {stats['p95_ms']:.2f} ms{recall}")
+    return report
+
+
+def print_results(results):
     print(f"\n混合检索结果:")
     print("=" * 80)
     for i, row in enumerate(results):
-        print(f"\n结果 {i + 1} (综合得分: {row[3]:.4f})")
-        print(f"Package ID: {row[0]}")
-        print(f"Summary: {row[1][:100]}...")
-        print(f"Augmented Keywords: {row[2]}")  # 只显示前100个字符
-        print(f"Summary Embedding: {row[8][:5]}...")
-        print(f"Keywords Embedding: {row[9][:5]}...")
-        print(f"Summary Embedding 得分: {row[4]:.4f}")
-        print(f"Keywords Embedding 得分: {row[5]:.4f}")
-        print(f"Summary Text 得分: {row[6]:.4f}")
-        print(f"Keywords Text 得分: {row[7]:.4f}")
-        print(f"综合得分: {row[3]:.4f}")
-
-    cursor.close()
-    conn.close()
-    return results
+        print(f"\n结果 {i + 1} (综合得分: {row[2]:.4f})")
+        print(f"Package ID: {row[1]}")
+        # 列数取决于检索时的 projection
+        if len(row) > 7:
+            print(f"Summary: {row[7][:100]}...")  # 只显示前100个字符
+            print(f"Augmented Keywords: {row[8]}")
+        if len(row) > 9:
+            print(f"Summary Embedding: {row[9][:5]}...")
+            print(f"Keywords Embedding: {row[10][:5]}...")
+        # 权重为 0 的字段没有参与打分, 得分为 None
+        for label, score in zip(("Summary Embedding", "Keywords Embedding", "Summary Text", "Keywords Text"),
+                                row[3:7]):
+            print(f"{label} 得分: {'-' if score is None else f'{score:.4f}'}")
+        print(f"综合得分: {row[2]:.4f}")
 
 
 if __name__ == "__main__":
     # 初始化数据库
     setup_database()
     insert_sample_data()
+    build_vector_indexes()
 
     weight_summary_vector = 0.25
     query_summary_vector = sample_documents[2]["summary_embedding"]
@@ -271,7 +1006,22 @@ if __name__ == "__main__":
     hybrid_search(weight_summary_vector, query_summary_vector,
                   weight_keywords_vector, query_keywords_vector,
                   weight_summary_text, query_summary_text,
-                  weight_keywords_text, query_keywords_text)
+                  weight_keywords_text, query_keywords_text, projection="full")
+
+    # 索引召回 + RRF 融合
+    hybrid_search(weight_summary_vector, query_summary_vector,
+                  weight_keywords_vector, query_keywords_vector,
+                  weight_summary_text, query_summary_text,
+                  weight_keywords_text, query_keywords_text, fusion="rrf", projection="text")
+
+    # 一次往返执行一批查询
+    for i, rows in enumerate(hybrid_search_batch(
+            [(0.25, doc["summary_embedding"], 0.25, doc["keywords_embedding"],
+              0.25, doc["summary"], 0.25, doc["augmented_keywords"]) for doc in sample_documents])):
+        print(f"查询 {i + 1}: {[row[1] for row in rows]}")
+
+    # 对比客户端拼接参数与服务端预备语句的延迟
+    benchmark_prepared()
 
     # 尝试不同的权重组合
     # print("\n尝试不同的权重组合:")
@@ -1,8 +1,14 @@
-import psycopg2
 import numpy as np
 import json
+import time
 from psycopg2.extras import execute_values
-from psycopg2 import extensions
+
+from cjk_text import CJK_CHARACTERS, bm25_index_sql, cjk_tsquery_sql, cjk_tsvector_sql, create_cjk_function
+from hybrid_query import bm25_field, build_fused_query, text_field, vector_field
+from result_cache import invalidate_table
+from search_client import SearchClient
+from search_filter import build_filter, parse_metadata_filter
+from vector_index import build_vector_index, check_vector_index, l2_normalize, score_sql, set_search_params
 
 # 数据库连接配置
 DB_CONFIG = {
@@ -12,27 +18,28 @@ DB_CONFIG = {
     "password": "opensource"
 }
 
-# 注册向量类型适配器
-def adapt_vector(vector):
-    return extensions.QuotedString(f"[{','.join(map(str, vector))}]")
+# 检索客户端, 持有连接池 (导入 search_client 时已注册向量类型适配器)
+client = SearchClient(DB_CONFIG)
 
-# 连接到数据库并注册适配器
+# 从连接池借出连接, 用法: with get_db_connection() as conn
 def get_db_connection():
-    conn = psycopg2.connect(**DB_CONFIG)
-    extensions.register_adapter(np.ndarray, adapt_vector)
-    extensions.register_adapter(list, adapt_vector)
-    return conn
+    return client.connection()
+
+def setup_database(table_name="documents"):
+    """
+    创建数据库表和索引 (向量索引在导入数据之后由 build_vector_indexes 创建)
 
-def setup_database():
-    """创建数据库表和索引"""
+    参数:
+        table_name: 表名, 索引名以 idx_{table_name}_ 开头; plan_check 用单独的表检查执行计划
+    """
     with get_db_connection() as conn:
         with conn.cursor() as cursor:
             # 创建表
-            cursor.execute("""
+            cursor.execute(f"""
             CREATE EXTENSION IF NOT EXISTS vector;
             CREATE EXTENSION IF NOT EXISTS pg_search;
 
-            CREATE TABLE IF NOT EXISTS documents (
+            CREATE TABLE IF NOT EXISTS {table_name} (
                 id SERIAL PRIMARY KEY,
                 title TEXT,
                 content TEXT,
@@ -41,23 +48,74 @@ def setup_database():
             );
             """)
 
-            # 创建文本搜索GIN索引
-            cursor.execute("""
-            CREATE INDEX IF NOT EXISTS idx_documents_text_search ON documents
-            USING gin (to_tsvector('simple', title || ' ' || content));
+            # 写入时生成并存储 tsvector (标题权重 A, 正文权重 B), 检索时不再逐行重新分词
+            cursor.execute(f"""
+            ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS tsv_simple TSVECTOR
+            GENERATED ALWAYS AS (
+                setweight(to_tsvector('simple', coalesce(title, '')), 'A') ||
+                setweight(to_tsvector('simple', coalesce(content, '')), 'B')
+            ) STORED;
+            """)
+
+            # 创建文本搜索GIN索引 (旧的表达式索引已被存储列上的索引取代)
+            cursor.execute(f"""
+            DROP INDEX IF EXISTS idx_{table_name}_text_search;
+            CREATE INDEX IF NOT EXISTS idx_{table_name}_tsv_simple ON {table_name}
+            USING gin (tsv_simple);
+            """)
+
+            # simple 配置不切分中文, 另存一列按 CJK 二元组切分的 tsvector (见 cjk_text)
+            create_cjk_function(cursor)
+            cursor.execute(f"""
+            ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS tsv_cjk TSVECTOR
+            GENERATED ALWAYS AS (
+                {cjk_tsvector_sql([("title", "A"), ("content", "B")])}
+            ) STORED;
+            CREATE INDEX IF NOT EXISTS idx_{table_name}_tsv_cjk ON {table_name}
+            USING gin (tsv_cjk);
             """)
 
-            # 创建向量索引
-            cursor.execute("""
-            CREATE INDEX IF NOT EXISTS idx_documents_embedding ON documents
-            USING ivfflat (embedding vector_l2_ops) WITH (lists = 100);
+            # 元数据过滤索引: jsonb_path_ops 支持 @> 和 @@, 体积比默认的 jsonb_ops 小
+            cursor.execute(f"""
+            CREATE INDEX IF NOT EXISTS idx_{table_name}_metadata ON {table_name}
+            USING gin (metadata jsonb_path_ops);
             """)
 
+            # 创建 pg_search BM25 索引 (Tantivy 倒排索引, 写入时即完成分词和词项统计);
+            # 使用 ICU 分词器切分中文, 取代默认分词器的旧索引
+            cursor.execute(f"DROP INDEX IF EXISTS idx_{table_name}_bm25")
+            cursor.execute(bm25_index_sql(f"idx_{table_name}_bm25_icu", table_name, "id", ["title", "content"]))
+
         conn.commit()
     print("数据库表和索引创建完成")
 
-def insert_sample_data():
-    """插入样例数据"""
+def build_vector_indexes(metric="cosine", method="hnsw", m=16, ef_construction=64, lists=None,
+                         parallel_workers=None, table_name="documents"):
+    """
+    导入数据之后创建向量索引
+
+    参数:
+        metric: 向量距离度量 (l2 / cosine / ip), 决定索引的操作符类, 检索时必须使用相同的 metric
+        method: hnsw 或 ivfflat
+        m, ef_construction: hnsw 构建参数
+        lists: ivfflat 聚类中心数量, None 表示按行数计算
+        parallel_workers: 并行构建的 worker 数量
+        table_name: 表名
+    """
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            elapsed = build_vector_index(cursor, f"idx_{table_name}_embedding", table_name, "embedding", metric,
+                                         method, m=m, ef_construction=ef_construction, lists=lists,
+                                         parallel_workers=parallel_workers)
+    print(f"向量索引创建完成 ({method}, {elapsed:.2f} 秒)")
+
+def insert_sample_data(normalize=False):
+    """
+    插入样例数据
+
+    参数:
+        normalize: 是否对向量做 L2 归一化, 归一化后可以使用 metric="ip" 代替余弦距离
+    """
     with get_db_connection() as conn:
         with conn.cursor() as cursor:
             # 样例文档数据
@@ -91,8 +149,10 @@ def insert_sample_data():
 
             # 为每个文档生成随机向量
             for doc in sample_documents:
-                embedding = np.random.rand(384).astype(np.float32).tolist()
-                doc["embedding"] = embedding
+                embedding = np.random.rand(384).astype(np.float32)
+                if normalize:
+                    embedding = l2_normalize(embedding)
+                doc["embedding"] = embedding.tolist()
 
             # 插入数据，将metadata转换为JSON字符串
             execute_values(
@@ -108,9 +168,33 @@ def insert_sample_data():
             )
 
         conn.commit()
+    # 已提交, 清除该表的缓存结果
+    invalidate_table("documents")
     print(f"插入了 {len(sample_documents)} 条样例数据")
 
-def hybrid_search(query_text, query_vector=None, vector_weight=0.6, bm25_weight=0.4, top_k=10, metadata_filter=None):
+# 文本相关性的计算方式
+#   ts_rank_cd: 基于存储的 tsv_simple 列计算, 不是真正的 BM25; 不切分中文
+#   cjk_bigram: 基于存储的 tsv_cjk 列 (CJK 二元组切分) 计算, 中文查询也能通过 GIN 索引命中
+#   bm25: pg_search 的 @@@ + paradedb.score(), 得分来自 bm25 索引 (ICU 分词)
+TEXT_RANKERS = ("ts_rank_cd", "cjk_bigram", "bm25")
+
+# title 或 content 命中即可, 与 tsv_simple 的检索范围一致
+BM25_QUERY = "paradedb.boolean(should => ARRAY[paradedb.match('title', {q}), paradedb.match('content', {q})])"
+
+def text_match_sql(text_ranker, placeholder="%s"):
+    """返回 (文本命中条件, 文本得分表达式), placeholder 为查询文本的占位符"""
+    if text_ranker == "bm25":
+        return f"id @@@ {BM25_QUERY.format(q=placeholder)}", "paradedb.score(id)"
+    if text_ranker == "ts_rank_cd":
+        return (f"tsv_simple @@ plainto_tsquery('simple', {placeholder})",
+                f"ts_rank_cd(tsv_simple, plainto_tsquery('simple', {placeholder}))")
+    if text_ranker == "cjk_bigram":
+        return f"tsv_cjk @@ {cjk_tsquery_sql(placeholder)}", f"ts_rank_cd(tsv_cjk, {cjk_tsquery_sql(placeholder)})"
+    raise ValueError(f"未知的文本打分方式: {text_ranker}, 可选: {TEXT_RANKERS}")
+
+def hybrid_search(query_text, query_vector=None, vector_weight=0.6, bm25_weight=0.4, top_k=10, metadata_filter=None,
+                  fusion=None, candidate_k=100, text_ranker="cjk_bigram", metric="cosine",
+                  ef_search=None, probes=None, filters=None, iterative_scan="relaxed_order"):
     """
     执行混合检索 (BM25 + 向量)
 
@@ -120,58 +204,151 @@ def hybrid_search(query_text, query_vector=None, vector_weight=0.6, bm25_weight=
         vector_weight: 向量相似度权重
         bm25_weight: BM25权重
         top_k: 返回结果数量
-        metadata_filter: 元数据过滤条件 (例如: "category:technology")
+        metadata_filter: 元数据过滤条件 (例如: "category:technology"), 等价于 filters={"metadata.category": "technology"}
+        fusion: None 表示对全部文本命中行打分排序; weighted / rrf 表示先分别通过向量索引和 GIN 索引
+                召回候选, 再对候选做加权求和或 RRF 融合
+        candidate_k: 融合模式下每路召回的候选数量
+        text_ranker: 文本得分计算方式, ts_rank_cd / cjk_bigram / bm25 (pg_search), 中文查询使用 cjk_bigram 或 bm25
+        metric: 向量距离度量, 必须与 setup_database 使用的一致, 否则无法使用向量索引;
+                ip 要求数据已归一化, 查询向量会在这里归一化
+        ef_search: 本次查询的 hnsw.ef_search, None 表示使用连接的默认值
+        probes: 本次查询的 ivfflat.probes, None 表示使用连接的默认值
+        filters: 结构化过滤条件 (见 search_filter), 例如 {"metadata.category": ["technology", "database"]}
+        iterative_scan: 向量索引的迭代扫描方式, 过滤条件很严格时保证每路候选仍能凑够 candidate_k 行;
+                        只在有过滤条件时设置, 不带过滤的检索不为它多一次 set_config 往返
+
+    client 配置了 result_cache 时, 相同的查询直接返回缓存的结果
     """
     if query_vector is None:
         query_vector = np.random.rand(384).astype(np.float32).tolist()
+    # ip 要求数据已归一化, 查询向量也需要归一化
+    if metric == "ip":
+        query_vector = l2_normalize(query_vector)
+
+    if metadata_filter:
+        filters = {**(filters or {}), **parse_metadata_filter(metadata_filter)}
+    where, filter_params, _ = build_filter(filters)
+
+    if fusion is not None:
+        return _fused_search(query_text, query_vector, vector_weight, bm25_weight, top_k, where, filter_params,
+                             fusion, candidate_k, text_ranker, metric, ef_search, probes, iterative_scan)
+
+    text_match, text_score = text_match_sql(text_ranker, "%(query_text)s")
+    vector_score = score_sql("embedding", "%(query_vector)s", metric)
 
     # 构建SQL查询
-    base_sql = """
+    base_sql = f"""
     SELECT
         id,
         title,
         content,
         metadata,
-        (%s * ts_rank_cd(to_tsvector('simple', title || ' ' || content), plainto_tsquery('simple', %s))) AS bm25_score,
-        (%s * (1 - (embedding <=> %s))) AS vector_score,
-        (%s * ts_rank_cd(to_tsvector('simple', title || ' ' || content), plainto_tsquery('simple', %s))) +
-        (%s * (1 - (embedding <=> %s))) AS combined_score
+        (%(bm25_weight)s * {text_score}) AS bm25_score,
+        (%(vector_weight)s * {vector_score}) AS vector_score,
+        (%(bm25_weight)s * {text_score}) +
+        (%(vector_weight)s * {vector_score}) AS combined_score
     FROM
         documents
     WHERE
-        to_tsvector('simple', title || ' ' || content) @@ plainto_tsquery('simple', %s)
+        {text_match}
     """
     
-    # 添加元数据过滤条件
-    if metadata_filter:
-        key, value = metadata_filter.split(':')
-        base_sql += f" AND metadata @> '{{\"{key}\": \"{value}\"}}'::jsonb"
+    # 添加过滤条件, 条件值以参数传入
+    if where:
+        base_sql += f" AND {where}"
     
     # 添加排序和限制
     base_sql += """
     ORDER BY
         combined_score DESC
-    LIMIT %s;
+    LIMIT %(top_k)s;
     """
 
-    with get_db_connection() as conn:
-        with conn.cursor() as cursor:
-            # 执行混合查询
-            if metadata_filter:
-                cursor.execute(base_sql, (
-                    bm25_weight, query_text, vector_weight, query_vector,
-                    bm25_weight, query_text, vector_weight, query_vector,
-                    query_text, top_k
-                ))
-            else:
-                cursor.execute(base_sql, (
-                    bm25_weight, query_text, vector_weight, query_vector,
-                    bm25_weight, query_text, vector_weight, query_vector,
-                    query_text, top_k
-                ))
+    params = {
+        "query_text": query_text,
+        "query_vector": query_vector,
+        "bm25_weight": bm25_weight,
+        "vector_weight": vector_weight,
+        "top_k": top_k,
+        **filter_params,
+    }
+
+    def search():
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                check_vector_index(cursor, "documents", "embedding", metric)
+                set_search_params(cursor, ef_search, probes)
+                # 执行混合查询
+                cursor.execute(base_sql, params)
+                return cursor.fetchall()
+
+    results = client.cached_search("documents", base_sql, params, search, text_params=("query_text",),
+                                   ef_search=ef_search, probes=probes)
 
-            results = cursor.fetchall()
+    print_results(results, vector_weight, bm25_weight)
+    return results
+
+def _fused_search(query_text, query_vector, vector_weight, bm25_weight, top_k, where, filter_params,
+                  fusion, candidate_k, text_ranker, metric, ef_search, probes, iterative_scan):
+    """索引召回 + 融合排序, 只对候选打分"""
+    sql = fused_search_sql(fusion, text_ranker, metric, where)
+    params = {
+        "query_text": query_text,
+        "query_vector": query_vector,
+        "vector_weight": vector_weight,
+        "bm25_weight": bm25_weight,
+        "candidate_k": candidate_k,
+        "top_k": top_k,
+        # 过滤条件下推到每一路候选召回中
+        **filter_params,
+    }
+
+    iterative_scan = iterative_scan if where else None
+
+    def search():
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                check_vector_index(cursor, "documents", "embedding", metric)
+                set_search_params(cursor, ef_search, probes, iterative_scan)
+                cursor.execute(sql, params)
+                return cursor.fetchall()
+
+    results = client.cached_search("documents", sql, params, search, text_params=("query_text",),
+                                   ef_search=ef_search, probes=probes, iterative_scan=iterative_scan)
+
+    print_results(results, vector_weight, bm25_weight)
+    return results
+
+def fused_search_sql(fusion="rrf", text_ranker="cjk_bigram", metric="cosine", where=None, table_name="documents"):
+    """
+    hybrid_search 融合模式使用的 SQL (plan_check 用同一个函数检查执行计划)
+
+    参数: %(query_text)s, %(query_vector)s, %(bm25_weight)s, %(vector_weight)s, %(candidate_k)s, %(top_k)s
+    以及 where 中的过滤参数
+    """
+    if text_ranker == "bm25":
+        text = bm25_field("bm25", BM25_QUERY.format(q="%(query_text)s"), "%(bm25_weight)s")
+    elif text_ranker == "ts_rank_cd":
+        text = text_field("bm25", "tsv_simple",
+                          "plainto_tsquery('simple', %(query_text)s)", "%(bm25_weight)s", ranker="ts_rank_cd")
+    elif text_ranker == "cjk_bigram":
+        text = text_field("bm25", "tsv_cjk", cjk_tsquery_sql("%(query_text)s"), "%(bm25_weight)s",
+                          ranker="ts_rank_cd")
+    else:
+        raise ValueError(f"未知的文本打分方式: {text_ranker}, 可选: {TEXT_RANKERS}")
 
+    return build_fused_query(
+        table_name,
+        ["id", "title", "content", "metadata"],
+        [
+            text,
+            vector_field("vector", "embedding", "%(query_vector)s", "%(vector_weight)s", metric),
+        ],
+        fusion=fusion,
+        where=where,
+    )
+
+def print_results(results, vector_weight, bm25_weight):
     print(f"\n混合检索结果 (向量权重: {vector_weight}, BM25权重: {bm25_weight}):")
     print("="*80)
     for i, row in enumerate(results):
@@ -182,12 +359,158 @@ def hybrid_search(query_text, query_vector=None, vector_weight=0.6, bm25_weight=
         print(f"元数据: {row[3]}")
         print(f"BM25得分: {row[4]:.4f}, 向量得分: {row[5]:.4f}")
 
-    return results
+def compare_text_rankers(query_texts, top_k=10, repeat=20):
+    """
+    在同一语料上对比 ts_rank_cd、CJK 二元组与 pg_search BM25 的纯文本检索延迟
+
+    参数:
+        query_texts: 查询文本列表
+        top_k: 返回结果数量
+        repeat: 每个查询重复执行的次数
+    """
+    report = {}
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            for text_ranker in TEXT_RANKERS:
+                text_match, text_score = text_match_sql(text_ranker, "%(query_text)s")
+                sql = f"""
+                SELECT id, {text_score} AS score
+                FROM documents
+                WHERE {text_match}
+                ORDER BY score DESC
+                LIMIT %(top_k)s
+                """
+                latencies = []
+                hits = 0
+                for query_text in query_texts:
+                    for _ in range(repeat):
+                        start = time.perf_counter()
+                        cursor.execute(sql, {"query_text": query_text, "top_k": top_k})
+                        rows = cursor.fetchall()
+                        latencies.append((time.perf_counter() - start) * 1000)
+                    hits += len(rows)
+                latencies.sort()
+                report[text_ranker] = {
+                    "mean_ms": sum(latencies) / len(latencies),
+                    "p50_ms": latencies[len(latencies) // 2],
+                    "p95_ms": latencies[int(len(latencies) * 0.95)],
+                    "hits": hits,
+                }
+
+    print(f"\n文本检索延迟对比 ({len(query_texts)} 个查询, 每个重复 {repeat} 次):")
+    print("="*80)
+    for text_ranker, stats in report.items():
+        print(f"{text_ranker:>12}: 平均 {stats['mean_ms']:.2f} ms, p50 {stats['p50_ms']:.2f} ms, "
+              f"p95 {stats['p95_ms']:.2f} ms, 命中 {stats['hits']} 条")
+    return report
+
+def benchmark_cjk(n=100000, n_queries=60, top_k=10, repeat=5):
+    """
+    中英混合语料上对比各文本打分方式: 延迟、命中率、召回率和精确率, 以及计划是否使用了索引
+
+    重建 documents 表并导入 synthetic_data.generate_documents 生成的语料。查询为中文词、英文词和中英混合短语;
+    基准结果为 title / content 中包含查询中每个词的文档 (中文按子串、英文按整词, 顺序扫描)。
+    命中率为至少返回一条结果的查询比例; 召回率为 |返回 ∩ 基准| / min(top_k, |基准|); 精确率为 |返回 ∩ 基准| / |返回|。
+
+    参数:
+        n: 语料行数
+        n_queries: 查询数
+        top_k: 返回结果数量
+        repeat: 每个查询重复执行的次数 (用于延迟统计)
+    """
+    import re
+
+    from binary_copy import copy_documents
+    from search_metrics import seq_scans
+    from synthetic_data import CJK_VOCABULARY, VOCABULARY, generate_documents
+
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("DROP TABLE IF EXISTS documents")
+    setup_database()
+    with get_db_connection() as conn:
+        copy_documents(conn, generate_documents(n), "documents",
+                       columns=[("title", "text"), ("content", "text"), ("metadata", "jsonb"), ("embedding", "vector")])
+    build_vector_indexes()
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("ANALYZE documents")
+
+    rng = np.random.default_rng(1)
+    queries = []
+    for i in range(n_queries):
+        if i % 3 == 0:
+            queries.append(str(rng.choice(CJK_VOCABULARY)))
+        elif i % 3 == 1:
+            queries.append(str(rng.choice(VOCABULARY)))
+        else:
+            queries.append(f"{rng.choice(CJK_VOCABULARY)} {rng.choice(VOCABULARY)}")
+
+    def truth_sql(query_text):
+        conditions, params = [], []
+        for word in query_text.split():
+            if re.search(f"[{CJK_CHARACTERS}]", word):
+                conditions.append("(title LIKE %s OR content LIKE %s)")
+                params += [f"%{word}%"] * 2
+            else:
+                conditions.append("(title ~* %s OR content ~* %s)")
+                params += [rf"\m{re.escape(word)}\M"] * 2
+        return f"SELECT id FROM documents WHERE {' AND '.join(conditions)}", params
+
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            truth = []
+            for query_text in queries:
+                cursor.execute(*truth_sql(query_text))
+                truth.append({row[0] for row in cursor.fetchall()})
+
+    report = {}
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            for text_ranker in TEXT_RANKERS:
+                text_match, text_score = text_match_sql(text_ranker, "%(query_text)s")
+                sql = f"""
+                SELECT id, {text_score} AS score
+                FROM documents
+                WHERE {text_match}
+                ORDER BY score DESC
+                LIMIT %(top_k)s
+                """
+                latencies, hit_queries, recall, precision = [], 0, 0.0, 0.0
+                for query_text, relevant in zip(queries, truth):
+                    for _ in range(repeat):
+                        start = time.perf_counter()
+                        cursor.execute(sql, {"query_text": query_text, "top_k": top_k})
+                        ids = {row[0] for row in cursor.fetchall()}
+                        latencies.append((time.perf_counter() - start) * 1000)
+                    hit_queries += bool(ids)
+                    if relevant:
+                        recall += len(ids & relevant) / min(top_k, len(relevant))
+                    if ids:
+                        precision += len(ids & relevant) / len(ids)
+                plan = client.explain(cursor, sql, {"query_text": queries[0], "top_k": top_k}, analyze=False)
+                report[text_ranker] = {
+                    "p50_ms": float(np.percentile(latencies, 50)),
+                    "p95_ms": float(np.percentile(latencies, 95)),
+                    "hit_rate": hit_queries / len(queries),
+                    "recall": recall / max(1, sum(1 for relevant in truth if relevant)),
+                    "precision": precision / max(1, hit_queries),
+                    "seq_scan": bool(seq_scans(plan, ["documents"])),
+                }
+
+    print(f"\n中英混合语料文本检索对比 ({n} 行, {len(queries)} 个查询, top_k={top_k}):")
+    print("="*80)
+    for text_ranker, stats in report.items():
+        print(f"{text_ranker:>12}: p50 {stats['p50_ms']:.2f} ms, p95 {stats['p95_ms']:.2f} ms, "
+              f"命中率 {stats['hit_rate']:.0%}, 召回率 {stats['recall']:.0%}, 精确率 {stats['precision']:.0%}, "
+              f"{'顺序扫描' if stats['seq_scan'] else '索引扫描'}")
+    return report
 
 if __name__ == "__main__":
     # 初始化数据库
     setup_database()
     insert_sample_data()
+    build_vector_indexes()
 
     # 执行混合检索示例
     query_text = "人工智能"
@@ -205,3 +528,20 @@ if __name__ == "__main__":
     # 执行带元数据过滤的查询
     print("\n执行带元数据过滤的查询:")
     hybrid_search(query_text, example_query_vector, metadata_filter="category:database")
+
+    # 索引召回 + 融合排序
+    print("\n执行索引召回 + RRF 融合查询:")
+    hybrid_search(query_text, example_query_vector, fusion="rrf")
+    hybrid_search(query_text, example_query_vector, fusion="weighted", metadata_filter="category:database")
+
+    # 结构化过滤: IN 条件走 metadata 上的 GIN 索引, 向量索引开启迭代扫描
+    hybrid_search(query_text, example_query_vector, fusion="rrf",
+                  filters={"metadata.category": ["technology", "database"]})
+
+    # 使用 pg_search BM25 计算文本得分
+    print("\n使用 pg_search BM25 计算文本得分:")
+    hybrid_search(query_text, example_query_vector, text_ranker="bm25")
+    hybrid_search(query_text, example_query_vector, fusion="rrf", text_ranker="bm25")
+
+    # 对比各文本打分方式的延迟 (中文查询只有 cjk_bigram 和 ICU 分词的 bm25 能命中)
+    compare_text_rankers([query_text, "PostgreSQL", "机器学习"])
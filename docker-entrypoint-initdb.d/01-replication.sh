@@ -0,0 +1,3 @@
+#!/bin/bash
+# Allow streaming replicas (the "replicas" profile in docker-compose.yml) to run pg_basebackup and stream WAL
+echo "host replication all all scram-sha-256" >> "$PGDATA/pg_hba.conf"
@@ -0,0 +1,298 @@
+# 基于索引召回候选 + 融合排序的混合检索 SQL 构造
+#
+# 直接 ORDER BY (向量得分 + 文本得分) 的写法无法使用任何索引, 每次查询都要对全表打分排序。
+# 这里改为: 每个字段先各自通过索引召回 top-N 候选
+#   - 向量字段: ORDER BY embedding <=> q LIMIT N  (ivfflat / hnsw, 操作符由 metric 决定)
+#     量化字段先在 halfvec / bit 表达式索引上粗排取 N 个候选, 再按全精度距离重排
+#   - 文本字段: WHERE tsvector @@ tsquery ... LIMIT N  (GIN)
+#   - BM25 字段: WHERE key @@@ query ORDER BY paradedb.score(key) LIMIT N  (pg_search bm25 索引)
+# 再只对候选集合做融合打分 (加权求和 或 RRF), 整个过程仍然是一次往返。
+# 每个字段召回时已经算出了自己的得分 ({name}_hit), 融合时只对没有被该字段召回的候选补算这个字段的得分,
+# 每行每个字段的打分函数最多计算一次。
+# 也可以由客户端在多个连接上并发执行各字段的 candidate_sql, 再把候选 key、名次和得分作为数组参数
+# 交给 build_rescore_query 完成融合打分。
+# 查询耗时随候选数量增长, 而不是随表的行数增长。
+
+from vector_index import distance_sql, metric_spec, quantized_distance_sql, score_sql
+
+FUSION_METHODS = ("weighted", "rrf")
+
+# RRF 的平滑常数, 取常用的 60
+RRF_K = 60
+
+
+def vector_field(name, column, query, weight, metric="cosine", quantization=None, dim=768):
+    """
+    向量字段
+
+    参数:
+        name: 字段名, 结果中对应 {name}_score 列
+        column: 表中的向量列
+        query: 查询向量的 SQL 表达式 (例如 "%(query_vector)s")
+        weight: 权重的 SQL 表达式
+        metric: 距离度量 (l2 / cosine / ip), 必须与向量索引的操作符类一致
+        quantization: None 表示直接使用全精度向量索引; halfvec / bit 表示先用量化表达式索引粗排
+        dim: 向量维度, 量化表达式需要
+    """
+    return {
+        "name": name,
+        "kind": "vector",
+        "column": column,
+        "query": query,
+        "weight": weight,
+        "metric": metric,
+        "quantization": quantization,
+        "dim": dim,
+    }
+
+
+def text_field(name, document, query, weight, ranker="ts_rank"):
+    """
+    全文检索字段
+
+    参数:
+        name: 字段名, 结果中对应 {name}_score 列
+        document: tsvector 表达式, 必须与 GIN 索引的表达式一致才能走索引
+        query: tsquery 表达式 (例如 "plainto_tsquery('english', %(query_text)s)")
+        weight: 权重的 SQL 表达式
+        ranker: 打分函数, ts_rank 或 ts_rank_cd
+    """
+    return {
+        "name": name,
+        "kind": "text",
+        "document": document,
+        "query": query,
+        "weight": weight,
+        "ranker": ranker,
+    }
+
+
+def bm25_field(name, query, weight, key="id"):
+    """
+    pg_search BM25 字段, 文本相关性直接来自 Tantivy 倒排索引中预先计算的词项统计
+
+    参数:
+        name: 字段名, 结果中对应 {name}_score 列
+        query: pg_search 查询表达式 (例如 "paradedb.match('content', %(query_text)s)")
+        weight: 权重的 SQL 表达式
+        key: bm25 索引的 key_field
+
+    paradedb.score() 只能在 @@@ 扫描中计算, 因此 BM25 得分随候选一起带出,
+    未被 BM25 召回的候选该字段得分记为 0。BM25 得分没有上界, 与其他字段混合时建议使用 rrf。
+    """
+    return {
+        "name": name,
+        "kind": "bm25",
+        "query": query,
+        "weight": weight,
+        "key": key,
+    }
+
+
+def active_fields(fields, weights):
+    """
+    去掉权重为 0 的字段: 既不召回候选, 也不在候选上打分 (它对加权求和和 RRF 的贡献本来就是 0)
+
+    参数:
+        fields: vector_field / text_field / bm25_field 列表
+        weights: {字段名: 权重值}, 没有列出的字段保留
+
+    字段组合不同, 生成的 SQL 也不同 (预备语句按 SQL 文本区分, 最多 2^字段数 种)
+    """
+    return [field for field in fields if weights.get(field["name"], 1) != 0]
+
+
+def _distance_expr(field):
+    return distance_sql(field["column"], field["query"], field["metric"])
+
+
+def _field_score_expr(field):
+    """字段得分表达式 (向量和全文字段), 对每一行直接计算"""
+    if field["kind"] == "vector":
+        return score_sql(field["column"], field["query"], field["metric"])
+    return f"{field['ranker']}({field['document']}, {field['query']})"
+
+
+def _score_expr(field):
+    """候选行上的字段得分: 召回时已算出的 {name}_hit, 没有被该字段召回的行才计算 (bm25 记为 0)"""
+    hit = f"{field['name']}_hit"
+    if field["kind"] == "bm25":
+        return f"coalesce({hit}, 0)"
+    return f"coalesce({hit}, {_field_score_expr(field)})"
+
+
+def candidate_sql(field, table, key="id", candidate_k="%(candidate_k)s", where=None):
+    """单个字段的候选召回子查询, 返回 key、该字段内的名次 {name}_rank 和该字段的得分 {name}_hit"""
+    rank = f"{field['name']}_rank"
+    hit = f"{field['name']}_hit"
+    if field["kind"] == "vector":
+        filter_sql = f"\n            WHERE {where}" if where else ""
+        # 得分由已算出的距离换算, 不再计算一次距离
+        score = metric_spec(field["metric"])["score"].format(distance="distance")
+        if field.get("quantization"):
+            # 内层按量化距离走量化索引粗排, 中间层计算全精度距离, 外层按全精度距离重排
+            coarse = quantized_distance_sql(field["column"], field["query"], field["quantization"], field["dim"],
+                                            field["metric"])
+            return f"""
+        SELECT {key}, row_number() OVER (ORDER BY distance) AS {rank}, {score} AS {hit}
+        FROM (
+            SELECT {key}, {_distance_expr(field)} AS distance
+            FROM (
+                SELECT {key}, {field['column']}
+                FROM {table}{filter_sql}
+                ORDER BY {coarse}
+                LIMIT {candidate_k}
+            ) coarse_candidates
+        ) c"""
+        # 内层只做 ORDER BY 距离 LIMIT N, 保证可以使用向量索引
+        return f"""
+        SELECT {key}, row_number() OVER (ORDER BY distance) AS {rank}, {score} AS {hit}
+        FROM (
+            SELECT {key}, {_distance_expr(field)} AS distance
+            FROM {table}{filter_sql}
+            ORDER BY distance
+            LIMIT {candidate_k}
+        ) c"""
+    filter_sql = f" AND {where}" if where else ""
+    if field["kind"] == "bm25":
+        return f"""
+        SELECT {key}, row_number() OVER (ORDER BY score DESC) AS {rank}, score AS {hit}
+        FROM (
+            SELECT {key}, paradedb.score({field['key']}) AS score
+            FROM {table}
+            WHERE {field['key']} @@@ {field['query']}{filter_sql}
+            ORDER BY score DESC
+            LIMIT {candidate_k}
+        ) c"""
+    return f"""
+        SELECT {key}, row_number() OVER (ORDER BY score DESC) AS {rank}, score AS {hit}
+        FROM (
+            SELECT {key}, {_field_score_expr(field)} AS score
+            FROM {table}
+            WHERE {field['document']} @@ {field['query']}{filter_sql}
+            ORDER BY score DESC
+            LIMIT {candidate_k}
+        ) c"""
+
+
+def build_fused_query(table, columns, fields, fusion="rrf", key="id", where=None,
+                      candidate_k="%(candidate_k)s", top_k="%(top_k)s", rrf_k=RRF_K):
+    """
+    构造 "索引召回 + 融合排序" 的混合检索 SQL
+
+    参数:
+        table: 表名
+        columns: 结果中需要返回的列 (表别名为 d)
+        fields: vector_field / text_field / bm25_field 列表
+        fusion: 融合方式, weighted (得分加权求和) 或 rrf (Reciprocal Rank Fusion)
+        key: 主键列
+        where: 附加的过滤条件, 会下推到每个字段的候选召回中
+        candidate_k: 每个字段召回的候选数量 (SQL 表达式)
+        top_k: 返回结果数量 (SQL 表达式)
+        rrf_k: RRF 平滑常数
+
+    返回的每一行依次为: columns, 各字段的 {name}_score, combined_score
+    """
+    _check_fusion(fields, fusion)
+    return _fused_select(table, columns, fields, fusion, key, top_k, rrf_k,
+                         _candidate_union(table, fields, key, candidate_k, where))
+
+
+def build_candidate_query(table, columns, fields, key="id", where=None, candidate_k="%(candidate_k)s"):
+    """
+    各字段召回的候选并集及其原始得分, 不做融合排序
+
+    用于分片检索: 每个分片返回自己的候选, 由客户端按全局名次融合 (见 sharded_search)。
+
+    返回的每一行依次为: columns, 各字段的 {name}_rank (未被该字段召回时为 NULL), 各字段的 {name}_score
+    """
+    if not fields:
+        raise ValueError("至少需要一个检索字段")
+    select = ", ".join(f"d.{column}" for column in columns)
+    ranks = ", ".join(f"{field['name']}_rank" for field in fields)
+    scores = ",\n        ".join(f"{_score_expr(field)} AS {field['name']}_score" for field in fields)
+    return f"""
+    SELECT
+        {select},
+        {ranks},
+        {scores}
+    FROM {_candidate_union(table, fields, key, candidate_k, where)}
+    JOIN {table} d USING ({key})
+    """
+
+
+def build_rescore_query(table, columns, fields, fusion="rrf", key="id", top_k="%(top_k)s", rrf_k=RRF_K):
+    """
+    对客户端已召回的候选做融合打分
+
+    候选通过数组参数传入: %(candidate_keys)s 为候选 key (并集), %({name}_ranks)s 和 %({name}_hits)s
+    为各字段内的名次和召回时的得分 (candidate_sql 返回的第 2、3 列); 未被某字段召回的候选对应位置为 NULL。
+    其余参数与返回列和 build_fused_query 相同。
+    """
+    _check_fusion(fields, fusion)
+    arrays = ["%(candidate_keys)s::bigint[]"]
+    for field in fields:
+        arrays.append(f"%({field['name']}_ranks)s::int[]")
+        arrays.append(f"%({field['name']}_hits)s::float8[]")
+    return _fused_select(table, columns, fields, fusion, key, top_k, rrf_k,
+                         f"unnest({', '.join(arrays)}) AS candidates({key}, {', '.join(_candidate_columns(fields))})")
+
+
+def _check_fusion(fields, fusion):
+    if fusion not in FUSION_METHODS:
+        raise ValueError(f"未知的融合方式: {fusion}, 可选: {FUSION_METHODS}")
+    if not fields:
+        raise ValueError("至少需要一个检索字段")
+
+
+def _candidate_union(table, fields, key, candidate_k, where):
+    """各字段候选按 key 做 FULL JOIN, 得到候选并集以及各字段内的名次和得分"""
+    candidates = ""
+    for i, field in enumerate(fields):
+        sub = f"({candidate_sql(field, table, key, candidate_k, where)}\n        ) {field['name']}_candidates"
+        candidates += sub if i == 0 else f"\n        FULL JOIN {sub} USING ({key})"
+    return f"""(
+        SELECT {key}, {", ".join(_candidate_columns(fields))}
+        FROM {candidates}
+    ) candidates"""
+
+
+def _candidate_columns(fields):
+    columns = []
+    for field in fields:
+        columns += [f"{field['name']}_rank", f"{field['name']}_hit"]
+    return columns
+
+
+def _fused_select(table, columns, fields, fusion, key, top_k, rrf_k, candidates):
+    """在候选集合上计算各字段得分和融合得分"""
+    names = [field["name"] for field in fields]
+    scores = ",\n            ".join(f"{_score_expr(field)} AS {field['name']}_score" for field in fields)
+    if fusion == "weighted":
+        # 向量列为 NULL 的行得分为 NULL, 按 0 计入, 否则 DESC 排序时会排在最前
+        combined = " + ".join(f"{field['weight']} * coalesce({field['name']}_score, 0)" for field in fields)
+    else:
+        combined = " + ".join(
+            f"{field['weight']} * coalesce(1.0 / ({rrf_k} + {field['name']}_rank), 0)" for field in fields
+        )
+
+    select = ", ".join(f"d.{column}" for column in columns)
+    ranks = ", ".join(f"candidates.{name}_rank" for name in names)
+    # OFFSET 0 阻止子查询被上提: 上提后外层对 {name}_score 的每次引用都会把得分表达式再计算一遍
+    return f"""
+    SELECT
+        {", ".join(columns)},
+        {", ".join(f"{name}_score" for name in names)},
+        {combined} AS combined_score
+    FROM (
+        SELECT
+            {select},
+            {ranks},
+            {scores}
+        FROM {candidates}
+        JOIN {table} d USING ({key})
+        OFFSET 0
+    ) scored
+    ORDER BY combined_score DESC
+    LIMIT {top_k}
+    """
@@ -0,0 +1,462 @@
+# 流水线式的 embedding + 导入
+#
+# 数百万条软件包摘要需要先计算 embedding 再写入数据库, 逐条计算后一次性写入时, 计算和写入互相等待, 内存随数据量增长。
+# 这里拆成三个阶段同时运行, 阶段之间用有界队列连接:
+#   reader   读取源数据 (任意文档字典的迭代器), 跳过已完成的 package_id, 按 batch_size 分批
+#   embed    进程池中计算 summary / augmented_keywords 的向量, 并在子进程里算好内容哈希、编码为二进制 COPY 元组
+#   writer   多个写线程各自以二进制 COPY 写入目标表; 分片时按 package_id 写入所在的分片 (见 sharded_search)
+# 队列满时上游阻塞 (背压): embedding 跟不上时 reader 不会把整个源读进内存, 写入跟不上时也不会堆积已编码的批次。
+#
+# 断点续传: 每批数据和这批的 package_id (写入 ingest_checkpoint 表) 在同一个事务中提交,
+# 进程崩溃后用相同的 run_name 重新运行, 已提交的 package_id 会在 reader 阶段跳过, 不会重复写入也不会遗漏。
+# 分片时断点写在数据所在的分片上, 续传时合并各分片的断点。
+#
+# embedding 模型可以替换: 任何可以 pickle、实现 embed(texts) -> (len(texts), dim) 数组的对象都可以作为 embedder,
+# 每个子进程初始化时反序列化一次。HashEmbedder 是确定性的本地替身, 不依赖模型, 用于测试和基准。
+#
+# 导入大表时目标表最好先不建索引 (setup_database(indexes=False)), 导入完成后再建, 见 main。
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import multiprocessing
+import queue
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from binary_copy import COPY_BUFFER_SIZE, COPY_HEADER, COPY_TRAILER, ENCODERS, copy_rows, document_converter, encode_row
+from result_cache import invalidate_table
+from upsert import UPSERT_COLUMNS, content_hash
+
+CHECKPOINT_TABLE = "ingest_checkpoint"
+
+# 向量列 -> 计算向量所用的文本列
+EMBEDDED_COLUMNS = {
+    "summary_embedding": "summary",
+    "keywords_embedding": "augmented_keywords",
+}
+
+# 队列关闭标记
+_DONE = object()
+
+
+class HashEmbedder:
+    """
+    确定性的本地 embedding: 每个词按哈希生成固定的随机向量, 文本向量为各词向量之和再归一化
+
+    相同的文本在任何进程、任何一次运行中得到相同的向量 (使用 blake2b 而不是受 PYTHONHASHSEED 影响的 hash()),
+    有相同词的文本向量相近。只用于测试和基准, 没有语义。
+
+    参数:
+        dim: 向量维度
+        seed: 不同的 seed 生成不同的词向量
+    """
+
+    def __init__(self, dim=768, seed=0):
+        self.dim = dim
+        self.seed = seed
+        self._cache = {}
+
+    def __getstate__(self):
+        # 词向量缓存不随 pickle 传给子进程
+        return {"dim": self.dim, "seed": self.seed}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def _word_vector(self, word):
+        vector = self._cache.get(word)
+        if vector is None:
+            digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8, key=str(self.seed).encode()).digest()
+            rng = np.random.default_rng(int.from_bytes(digest, "little"))
+            vector = self._cache[word] = rng.standard_normal(self.dim, dtype=np.float32)
+        return vector
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for word in re.findall(r"\w+", (text or "").lower()):
+                vectors[i] += self._word_vector(word)
+            norm = np.linalg.norm(vectors[i])
+            if norm > 0:
+                vectors[i] /= norm
+        return vectors
+
+
+class SentenceTransformerEmbedder:
+    """
+    sentence-transformers 模型, 每个子进程第一次调用 embed 时加载
+
+    参数:
+        model_name: 模型名或本地路径, 输出维度需要与表的向量列一致
+        batch_size: 模型每次前向计算的文本数
+        device: cpu / cuda, None 表示由 sentence-transformers 选择
+    """
+
+    def __init__(self, model_name, batch_size=64, device=None):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.device = device
+        self._model = None
+
+    def __getstate__(self):
+        return {"model_name": self.model_name, "batch_size": self.batch_size, "device": self.device}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def embed(self, texts):
+        if self._model is None:
+            from sentence_transformers import SentenceTransformer
+
+            self._model = SentenceTransformer(self.model_name, device=self.device)
+        return self._model.encode([text or "" for text in texts], batch_size=self.batch_size,
+                                  convert_to_numpy=True).astype(np.float32)
+
+
+# 子进程中的 embedder 和编码函数, 由 _init_worker 设置
+_worker = {}
+
+
+def _init_worker(embedder, normalize, shard_count=1):
+    from sharded_search import shard_index
+
+    _worker["embedder"] = embedder
+    _worker["shard"] = lambda package_id: shard_index(package_id, shard_count) if shard_count > 1 else 0
+    _worker["convert"] = document_converter(UPSERT_COLUMNS, normalize)
+    _worker["encoders"] = [ENCODERS[column_type] for _, column_type in UPSERT_COLUMNS]
+
+
+def _embed_batch(documents):
+    """
+    子进程中执行: 计算一批文档的向量和内容哈希, 编码为二进制 COPY 元组, 按所在分片分组
+
+    返回 ([(分片编号, package_id 列表, 编码后的字节)], 计算耗时)
+    """
+    start = time.perf_counter()
+    embedder = _worker["embedder"]
+    columns = list(EMBEDDED_COLUMNS.items())
+    # 所有向量列的文本一次交给模型
+    texts = [doc.get(text_column) for _, text_column in columns for doc in documents]
+    vectors = embedder.embed(texts)
+    groups = {}
+    for i, doc in enumerate(documents):
+        doc = {**doc, **{column: vectors[j * len(documents) + i] for j, (column, _) in enumerate(columns)}}
+        doc["content_hash"] = content_hash(doc)
+        package_ids, parts = groups.setdefault(_worker["shard"](doc["package_id"]), ([], []))
+        package_ids.append(doc["package_id"])
+        parts.append(encode_row(_worker["convert"](doc), _worker["encoders"]))
+    return ([(shard, package_ids, b"".join(parts)) for shard, (package_ids, parts) in groups.items()],
+            time.perf_counter() - start)
+
+
+class StageMetrics:
+    """
+    一个阶段的吞吐量统计 (线程安全)
+
+    busy 为阶段实际工作的时间, wait 为阻塞在队列上的时间: 上游阶段 wait 高说明下游是瓶颈, 反之亦然。
+    """
+
+    def __init__(self, name, parallelism=1):
+        self.name = name
+        self.parallelism = parallelism
+        self.rows = 0
+        self.batches = 0
+        self.busy = 0.0
+        self.wait = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, rows=0, busy=0.0, wait=0.0):
+        with self._lock:
+            self.rows += rows
+            self.batches += 1 if rows else 0
+            self.busy += busy
+            self.wait += wait
+
+    def snapshot(self, elapsed):
+        with self._lock:
+            return {
+                "rows": self.rows,
+                "batches": self.batches,
+                "rows_per_s": self.rows / elapsed if elapsed else 0.0,
+                "busy_seconds": self.busy,
+                "wait_seconds": self.wait,
+                # 各并行单元平均有多少比例的时间在工作
+                "utilization": self.busy / (elapsed * self.parallelism) if elapsed else 0.0,
+            }
+
+
+def ensure_checkpoint_table(cursor):
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS {CHECKPOINT_TABLE} (
+        run_name TEXT,
+        package_id TEXT,
+        PRIMARY KEY (run_name, package_id)
+    )
+    """)
+
+
+def completed_ids(cursor, run_name):
+    """该次导入已提交的 package_id 集合"""
+    cursor.execute(f"SELECT package_id FROM {CHECKPOINT_TABLE} WHERE run_name = %s", (run_name,))
+    return {package_id for (package_id,) in cursor.fetchall()}
+
+
+def reset_checkpoint(cursor, run_name):
+    """清除该次导入的断点, 下次运行从头开始"""
+    cursor.execute(f"DELETE FROM {CHECKPOINT_TABLE} WHERE run_name = %s", (run_name,))
+
+
+def _put(q, item, stop):
+    """放入有界队列, 出错停止时放弃; 返回阻塞的时间"""
+    start = time.perf_counter()
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            break
+        except queue.Full:
+            continue
+    return time.perf_counter() - start
+
+
+def _get(q, stop):
+    """从队列取出一项, 出错停止时返回 _DONE; 返回 (项, 阻塞的时间)"""
+    start = time.perf_counter()
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1), time.perf_counter() - start
+        except queue.Empty:
+            continue
+    return _DONE, time.perf_counter() - start
+
+
+def ingest(documents, embedder, table_name="summary_aug_keywords", run_name="default", batch_size=500,
+           embed_workers=4, writers=4, queue_size=8, normalize=False, progress_interval=10.0, sharded=None):
+    """
+    流水线导入: 读取、进程池计算 embedding、多连接二进制 COPY 写入同时进行
+
+    参数:
+        documents: 文档字典的迭代器/生成器, 需要 package_id / package_name / ecosystem / summary / augmented_keywords,
+                   向量列由 embedder 计算
+        embedder: 实现 embed(texts) 的对象, 例如 HashEmbedder 或 SentenceTransformerEmbedder
+        table_name: 目标表
+        run_name: 断点续传的名称, 相同名称的运行共享已完成的 package_id
+        batch_size: 每批的文档数, 也是每个写入事务的行数
+        embed_workers: 计算 embedding 的进程数
+        writers: 写线程数, 每个线程在每个分片上占用一个连接, 不能超过连接池的 maxconn
+        queue_size: 每个队列最多容纳的批次数, 决定背压前最多有多少批在途
+        normalize: 是否对向量做 L2 归一化 (metric="ip" 时需要)
+        progress_interval: 打印进度的间隔 (秒), None 表示不打印
+        sharded: sharded_search.ShardedClient, 按 package_id 写入各分片; None 表示写入 demo_2vec_2txt.client
+
+    返回各阶段的统计和总耗时
+    """
+    from demo_2vec_2txt import client
+
+    names = [name for name, _ in UPSERT_COLUMNS]
+    copy_sql = f"COPY {table_name} ({', '.join(names)}) FROM STDIN (FORMAT BINARY)"
+
+    shards = [client] if sharded is None else sharded.shards
+    done = set()
+    for shard in shards:
+        with shard.cursor() as cursor:
+            ensure_checkpoint_table(cursor)
+            done |= completed_ids(cursor, run_name)
+    skipped = len(done)
+
+    metrics = {
+        "read": StageMetrics("read"),
+        "embed": StageMetrics("embed", embed_workers),
+        "write": StageMetrics("write", writers),
+    }
+    # embed 队列中是已提交给进程池的 future, 队列容量同时限制了进程池中在途的批次数
+    embed_queue = queue.Queue(queue_size)
+    write_queue = queue.Queue(queue_size)
+    stop = threading.Event()
+    errors = []
+
+    def run(target, *args):
+        try:
+            target(*args)
+        except BaseException as error:
+            errors.append(error)
+            stop.set()
+
+    def read(executor):
+        rows = iter(documents)
+        while not stop.is_set():
+            start = time.perf_counter()
+            batch = []
+            for doc in rows:
+                # 已完成的和源中重复的 package_id 都跳过
+                if doc["package_id"] in done:
+                    continue
+                done.add(doc["package_id"])
+                batch.append(doc)
+                if len(batch) == batch_size:
+                    break
+            busy = time.perf_counter() - start
+            if not batch:
+                break
+            wait = _put(embed_queue, executor.submit(_embed_batch, batch), stop)
+            metrics["read"].record(len(batch), busy, wait)
+        _put(embed_queue, _DONE, stop)
+
+    def collect():
+        # 按提交顺序取回计算结果, 交给写入队列
+        while True:
+            future, _ = _get(embed_queue, stop)
+            if future is _DONE:
+                break
+            groups, seconds = future.result()
+            metrics["embed"].record(sum(len(package_ids) for _, package_ids, _ in groups), seconds)
+            for group in groups:
+                _put(write_queue, group, stop)
+        for _ in range(writers):
+            _put(write_queue, _DONE, stop)
+
+    def write():
+        # 每个写线程在用到的分片上各借一个连接
+        with contextlib.ExitStack() as stack:
+            connections = {}
+            while True:
+                item, wait = _get(write_queue, stop)
+                if item is _DONE:
+                    break
+                shard, package_ids, data = item
+                if shard not in connections:
+                    connections[shard] = stack.enter_context(shards[shard].connection())
+                conn = connections[shard]
+                start = time.perf_counter()
+                with conn.cursor() as cursor:
+                    cursor.copy_expert(copy_sql, io.BytesIO(COPY_HEADER + data + COPY_TRAILER),
+                                       size=COPY_BUFFER_SIZE)
+                    copy_rows(cursor, CHECKPOINT_TABLE, ["run_name", "package_id"], ["text", "text"],
+                              ((run_name, package_id) for package_id in package_ids))
+                # 数据和断点在同一个事务中提交
+                conn.commit()
+                invalidate_table(table_name)
+                metrics["write"].record(len(package_ids), time.perf_counter() - start, wait)
+
+    start = time.perf_counter()
+    # 子进程在 reader 线程第一次 submit 时才创建, 此时写线程已经持有连接池中的连接;
+    # fork 会让子进程继承这些连接的套接字和运行中线程持有的锁, 因此用 spawn 启动全新的解释器
+    with ProcessPoolExecutor(embed_workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_worker, initargs=(embedder, normalize, len(shards))) as executor:
+        threads = [threading.Thread(target=run, args=(read, executor), name="ingest-read"),
+                   threading.Thread(target=run, args=(collect,), name="ingest-collect")]
+        threads += [threading.Thread(target=run, args=(write,), name=f"ingest-write-{i}") for i in range(writers)]
+        for thread in threads:
+            thread.start()
+
+        last_report = time.perf_counter()
+        while any(thread.is_alive() for thread in threads):
+            time.sleep(0.5)
+            if progress_interval and time.perf_counter() - last_report >= progress_interval:
+                last_report = time.perf_counter()
+                elapsed = last_report - start
+                written = metrics["write"].snapshot(elapsed)
+                print(f"[{elapsed:,.0f} 秒] 已写入 {written['rows']:,} 行 ({written['rows_per_s']:,.0f} rows/s), "
+                      f"队列 embed {embed_queue.qsize()}/{queue_size}, write {write_queue.qsize()}/{queue_size}")
+        if errors:
+            executor.shutdown(cancel_futures=True)
+            raise errors[0]
+
+    elapsed = time.perf_counter() - start
+    report = {name: stage.snapshot(elapsed) for name, stage in metrics.items()}
+    report["seconds"] = elapsed
+    report["skipped"] = skipped
+    return report
+
+
+def print_report(report):
+    print(f"\n导入完成: {report['write']['rows']:,} 行, {report['seconds']:.2f} 秒, 断点跳过 {report['skipped']:,} 行")
+    print("=" * 80)
+    for stage in ("read", "embed", "write"):
+        stats = report[stage]
+        print(f"{stage:>6}: {stats['rows_per_s']:>10,.0f} rows/s, {stats['batches']} 批, "
+              f"工作 {stats['busy_seconds']:.2f} 秒, 等待队列 {stats['wait_seconds']:.2f} 秒, "
+              f"利用率 {stats['utilization']:.0%}")
+
+
+def synthetic_source(n, seed=0):
+    """合成软件包数据去掉向量列, 作为 ingest 的输入"""
+    from synthetic_data import generate_packages
+
+    for doc in generate_packages(n, seed=seed, topics=0):
+        yield {name: value for name, value in doc.items() if name not in EMBEDDED_COLUMNS}
+
+
+def read_jsonl(path):
+    """每行一个文档 JSON 的文件"""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="流水线计算 embedding 并导入 summary_aug_keywords")
+    parser.add_argument("--jsonl", help="源数据文件 (每行一个文档), 不指定时使用合成数据")
+    parser.add_argument("--rows", type=int, default=100000, help="合成数据的行数")
+    parser.add_argument("--table", default="summary_aug_keywords")
+    parser.add_argument("--run-name", default="default", help="断点续传的名称")
+    parser.add_argument("--reset", action="store_true", help="清除断点并重建表, 从头导入")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--embed-workers", type=int, default=4)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--queue-size", type=int, default=8)
+    parser.add_argument("--dim", type=int, default=768, help="HashEmbedder 的向量维度")
+    parser.add_argument("--model", help="sentence-transformers 模型名, 不指定时使用 HashEmbedder")
+    parser.add_argument("--normalize", action="store_true", help="对向量做 L2 归一化")
+    parser.add_argument("--sharded", action="store_true", help="按 package_id 写入 sharded_search.SHARD_CONFIGS 中的分片")
+    args = parser.parse_args()
+
+    from demo_2vec_2txt import client
+    from sharded_search import ShardedClient, build_shard_indexes, setup_shards
+
+    # 单机时也当作只有一个分片处理
+    sharded = ShardedClient() if args.sharded else None
+    shards = [client] if sharded is None else sharded.shards
+    metric = "ip" if args.normalize else "cosine"
+
+    if args.reset:
+        for shard in shards:
+            with shard.cursor() as cursor:
+                ensure_checkpoint_table(cursor)
+                reset_checkpoint(cursor, args.run_name)
+        if sharded is None:
+            from demo_2vec_2txt import setup_database
+
+            setup_database(args.table, indexes=False)
+        else:
+            setup_shards(sharded, args.table, indexes=False)
+
+    embedder = SentenceTransformerEmbedder(args.model) if args.model else HashEmbedder(args.dim)
+    documents = read_jsonl(args.jsonl) if args.jsonl else synthetic_source(args.rows)
+    report = ingest(documents, embedder, args.table, args.run_name, batch_size=args.batch_size,
+                    embed_workers=args.embed_workers, writers=args.writers, queue_size=args.queue_size,
+                    normalize=args.normalize, sharded=sharded)
+    print_report(report)
+
+    if args.reset:
+        if sharded is None:
+            from demo_2vec_2txt import build_vector_indexes, index_statements
+
+            with client.cursor() as cursor:
+                for statement in index_statements(args.table):
+                    cursor.execute(statement)
+            build_vector_indexes(args.table, metric=metric)
+        else:
+            build_shard_indexes(sharded, args.table, metric=metric)
+    if sharded is not None:
+        sharded.close()
+
+
+if __name__ == "__main__":
+    main()
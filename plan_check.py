@@ -0,0 +1,171 @@
+# 执行计划回归检查
+#
+# 把有代表性的合成语料导入本地 PostgreSQL (与 setup_database 相同的表结构和索引), 对每一种查询形态执行 EXPLAIN,
+# 检查计划使用了预期的索引 (hnsw / ivfflat、GIN、bm25), 没有对表做 Seq Scan, 也没有对整表排序。
+# 修改 hybrid_search 等处的 SQL 后运行一次, 索引扫描被悄悄改成顺序扫描时会失败 (退出码 1):
+#   python plan_check.py                 导入语料并检查
+#   python plan_check.py --skip-load     使用上次导入的表
+#
+# 查询形态:
+#   vector             单个向量列的 top-k                    向量索引
+#   text               单个文本列的候选召回                  GIN
+#   bm25_hybrid        demo_bm25 的 bm25 + 向量融合           bm25 + 向量索引
+#   hybrid             summary 向量 + summary 文本融合        向量索引 + GIN
+#   filtered_hybrid    四字段融合 + ecosystem 过滤            两个向量索引 + 两个 GIN
+#   two_vector_hybrid  四字段融合 (两个向量 + 两个文本)       两个向量索引 + 两个 GIN
+# demo_2vec_2txt.hybrid_search 在 fusion=None 时按设计对全表打分, 不在检查范围内。
+# 四字段融合的两种形态与 hybrid_search 一样以预备语句执行, 在 plan_cache_mode = force_generic_plan 下
+# EXPLAIN EXECUTE, 检查的是连接上复用预备语句之后的通用计划, 而不是按具体参数值生成的定制计划。
+import argparse
+import sys
+
+import demo_bm25
+from binary_copy import copy_documents
+from demo_2vec_2txt import SEARCH_PARAM_TYPES, client, search_sql, vector_index_columns
+from hybrid_query import build_fused_query, candidate_sql, text_field, vector_field
+from search_filter import build_filter
+from search_metrics import plan_nodes, seq_scans
+from synthetic_data import generate_packages
+from vector_index import set_search_params
+
+# 检查使用的表, 与线上表分开
+TABLE_NAME = "plan_check_packages"
+BM25_TABLE = "plan_check_documents"
+BM25_DIM = 384
+
+
+def load_packages(rows, metric="cosine", method="hnsw"):
+    """按 setup_database 的表结构导入语料并建全部索引"""
+    from benchmark import build_indexes, load_corpus
+
+    load_corpus(rows, TABLE_NAME, normalize=metric == "ip")
+    build_indexes(TABLE_NAME, metric=metric, method=method)
+
+
+def load_documents(rows, metric="cosine", method="hnsw"):
+    """按 demo_bm25.setup_database 的表结构重建 BM25_TABLE 并导入语料"""
+    with client.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {BM25_TABLE}")
+    demo_bm25.setup_database(BM25_TABLE)
+    documents = ({
+        "title": doc["package_name"],
+        "content": doc["summary"],
+        "metadata": {"ecosystem": doc["ecosystem"]},
+        "embedding": doc["summary_embedding"],
+    } for doc in generate_packages(rows, dim=BM25_DIM))
+    with client.connection() as conn:
+        copy_documents(conn, documents, BM25_TABLE,
+                       columns=[("title", "text"), ("content", "text"), ("metadata", "jsonb"),
+                                ("embedding", "vector")],
+                       normalize=metric == "ip")
+    demo_bm25.build_vector_indexes(metric, method, table_name=BM25_TABLE)
+    with client.cursor() as cursor:
+        cursor.execute(f"ANALYZE {BM25_TABLE}")
+
+
+def full_table_sorts(plan, tables):
+    """输入中包含对 tables 的 Seq Scan 的 Sort 节点 (即对整表排序)"""
+    return [node for node in plan_nodes(plan)
+            if node.get("Node Type") in ("Sort", "Incremental Sort") and seq_scans(node, tables)]
+
+
+def uses_index(plan, index_name):
+    """计划中是否有节点引用了该索引 (包括分区上的同名前缀索引和 pg_search 的自定义扫描)"""
+    for node in plan_nodes(plan):
+        for key, value in node.items():
+            if key != "Plans" and isinstance(value, str) and value.startswith(index_name):
+                return True
+    return False
+
+
+def query_shapes(metric="cosine"):
+    """返回各查询形态: [(名称, 表名, SQL, 参数, 预备语句的参数类型 (None 表示不用预备语句), 预期使用的索引)]"""
+    doc = next(generate_packages(1, seed=1))
+    small = next(generate_packages(1, dim=BM25_DIM, seed=1))
+    summary_index, keywords_index = [name for name, _ in vector_index_columns(TABLE_NAME)]
+    summary_tsv, keywords_tsv = f"idx_{TABLE_NAME}_summary_tsv", f"idx_{TABLE_NAME}_keywords_tsv"
+    params = {
+        "weight_summary_vector": 0.25,
+        "query_summary_vector": doc["summary_embedding"],
+        "weight_keywords_vector": 0.25,
+        "query_keywords_vector": doc["keywords_embedding"],
+        "weight_summary_text": 0.25,
+        "query_summary_text": doc["summary"][:200],
+        "weight_keywords_text": 0.25,
+        "query_keywords_text": doc["augmented_keywords"],
+        "candidate_k": 100,
+        "top_k": 10,
+    }
+
+    summary_vector = vector_field("summary_vector", "summary_embedding", "%(query_summary_vector)s",
+                                  "%(weight_summary_vector)s", metric)
+    summary_text = text_field("summary_text", "summary_tsv", "plainto_tsquery('english', %(query_summary_text)s)",
+                              "%(weight_summary_text)s")
+    where, filter_params, filter_types = build_filter({"ecosystem": "npm"})
+    filtered_params = {**params, **filter_params}
+    bm25_params = {"query_text": small["summary"][:200], "query_vector": small["summary_embedding"],
+                   "vector_weight": 0.6, "bm25_weight": 0.4, "candidate_k": 100, "top_k": 10}
+
+    return [
+        ("vector", TABLE_NAME, candidate_sql(summary_vector, TABLE_NAME), params, None, [summary_index]),
+        ("text", TABLE_NAME, candidate_sql(summary_text, TABLE_NAME), params, None, [summary_tsv]),
+        ("bm25_hybrid", BM25_TABLE, demo_bm25.fused_search_sql("rrf", "bm25", metric, table_name=BM25_TABLE),
+         bm25_params, None, [f"idx_{BM25_TABLE}_bm25_icu", f"idx_{BM25_TABLE}_embedding"]),
+        ("hybrid", TABLE_NAME,
+         build_fused_query(TABLE_NAME, ["id", "package_id"], [summary_vector, summary_text]),
+         params, None, [summary_index, summary_tsv]),
+        # 与 hybrid_search 相同的 SQL 构造和参数类型
+        ("filtered_hybrid", TABLE_NAME, search_sql(TABLE_NAME, "rrf", metric, where=where, weights=filtered_params),
+         filtered_params, {**SEARCH_PARAM_TYPES, **filter_types},
+         [summary_index, keywords_index, summary_tsv, keywords_tsv]),
+        ("two_vector_hybrid", TABLE_NAME, search_sql(TABLE_NAME, "rrf", metric, weights=params), params,
+         SEARCH_PARAM_TYPES, [summary_index, keywords_index, summary_tsv, keywords_tsv]),
+    ]
+
+
+def check_shape(name, table_name, sql, params, types, expected_indexes):
+    """EXPLAIN 一个查询, 返回发现的问题列表 (为空表示通过); types 不为 None 时解释预备语句的通用计划"""
+    with client.cursor() as cursor:
+        set_search_params(cursor, iterative_scan="relaxed_order")
+        if types is not None:
+            cursor.execute("SELECT set_config('plan_cache_mode', 'force_generic_plan', true)")
+        plan = client.explain(cursor, sql, params, types, analyze=False)
+
+    problems = [f"未使用索引 {index_name}" for index_name in expected_indexes if not uses_index(plan, index_name)]
+    problems += [f"对 {relation} 做了 Seq Scan" for relation in seq_scans(plan, [table_name])]
+    if full_table_sorts(plan, [table_name]):
+        problems.append("对整表排序")
+    return problems
+
+
+def run_checks(metric="cosine"):
+    """检查全部查询形态, 返回失败的形态数"""
+    failures = 0
+    for name, table_name, sql, params, types, expected_indexes in query_shapes(metric):
+        problems = check_shape(name, table_name, sql, params, types, expected_indexes)
+        if problems:
+            failures += 1
+            print(f"FAIL {name}: {'; '.join(problems)}")
+        else:
+            print(f"PASS {name}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检查各查询形态的执行计划是否使用了索引")
+    parser.add_argument("--rows", type=int, default=20000, help="语料行数, 太小时规划器会倾向于顺序扫描")
+    parser.add_argument("--metric", default="cosine", choices=["cosine", "l2", "ip"])
+    parser.add_argument("--method", default="hnsw", choices=["hnsw", "ivfflat"])
+    parser.add_argument("--skip-load", action="store_true", help="使用上次导入的表")
+    args = parser.parse_args()
+
+    if not args.skip_load:
+        load_packages(args.rows, args.metric, args.method)
+        load_documents(args.rows, args.metric, args.method)
+    failures = run_checks(args.metric)
+    print(f"\n{failures} 个查询形态未通过" if failures else "\n全部查询形态通过")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
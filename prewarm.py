@@ -0,0 +1,242 @@
+# 重启后的冷启动预热
+#
+# pg_test 容器重启后 shared_buffers 是空的, 最初几千次检索的 ivfflat / hnsw / GIN 页面都要从
+# /mnt/ssd/postgresql-data 读入, 延迟比稳定状态高很多。两种预热方式:
+#   autoprewarm      镜像和 docker-compose 把 pg_prewarm 加入 shared_preload_libraries,
+#                    pg_prewarm.autoprewarm 默认开启: 后台进程每 autoprewarm_interval 把 shared_buffers
+#                    中的块列表写入 autoprewarm.blocks, 重启后自动按列表重新读入, 不需要任何操作
+#   prewarm_indexes  显式把向量索引、GIN 和 bm25 索引 (可选还有表本身) 读入缓存,
+#                    适合 autoprewarm.blocks 还不存在 (新建的库、刚重建的索引) 的情况
+# shared_buffers 小于这些索引的总大小时, 用 mode="prefetch" 预热到操作系统页缓存。
+#
+# benchmark_cold_start 重启容器后测量达到稳定延迟所需的查询数和时间, 对比不预热、autoprewarm 和显式预热:
+#   python prewarm.py --benchmark
+import argparse
+import subprocess
+import time
+
+import numpy as np
+import psycopg2
+
+from demo_2vec_2txt import client, hybrid_search
+
+# 检索使用的索引访问方法
+INDEX_METHODS = ("hnsw", "ivfflat", "gin", "bm25")
+
+PREWARM_MODES = ("cold", "autoprewarm", "explicit")
+
+
+def index_relations(cursor, table_name, methods=INDEX_METHODS):
+    """
+    表 (含其分区) 上指定访问方法的索引
+
+    返回 [(索引名, 访问方法, 字节数)]
+    """
+    cursor.execute("""
+    WITH RECURSIVE tables AS (
+        SELECT %s::regclass::oid AS oid
+        UNION ALL
+        SELECT i.inhrelid FROM pg_inherits i JOIN tables t ON i.inhparent = t.oid
+    )
+    SELECT c.relname, am.amname, pg_relation_size(c.oid)
+    FROM pg_index x
+    JOIN tables t ON x.indrelid = t.oid
+    JOIN pg_class c ON c.oid = x.indexrelid
+    JOIN pg_am am ON am.oid = c.relam
+    WHERE am.amname = ANY(%s) AND c.relkind = 'i'
+    ORDER BY c.relname
+    """, (table_name, list(methods)))
+    return cursor.fetchall()
+
+
+def prewarm_indexes(cursor, table_name="summary_aug_keywords", methods=INDEX_METHODS, include_table=False,
+                    mode="buffer"):
+    """
+    用 pg_prewarm 读入检索使用的索引
+
+    参数:
+        cursor: 游标
+        table_name: 表名
+        methods: 预热哪些访问方法的索引
+        include_table: 是否同时预热表 (结果回表读取的列)
+        mode: buffer 读入 shared_buffers; prefetch 异步读入操作系统页缓存, 用于 shared_buffers 放不下的情况
+
+    返回 {关系名: 块数}
+    """
+    from table_swap import owned_relations
+
+    cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_prewarm")
+    relations = [relname for relname, _, _ in index_relations(cursor, table_name, methods)]
+    if include_table:
+        relations += [relname for relname, relkind in owned_relations(cursor, table_name) if relkind == "r"]
+    blocks = {}
+    for relname in relations:
+        cursor.execute("SELECT pg_prewarm(%s::regclass, %s)", (relname, mode))
+        blocks[relname] = cursor.fetchone()[0]
+    return blocks
+
+
+def set_autoprewarm(cursor, enabled):
+    """开启或关闭 autoprewarm, 重启后生效 (ALTER SYSTEM 需要超级用户, 不能在事务块中执行)"""
+    cursor.execute(f"ALTER SYSTEM SET pg_prewarm.autoprewarm = {'on' if enabled else 'off'}")
+
+
+def dump_autoprewarm(cursor):
+    """立即把 shared_buffers 中的块列表写入 autoprewarm.blocks, 返回记录的块数"""
+    cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_prewarm")
+    cursor.execute("SELECT autoprewarm_dump_now()")
+    return cursor.fetchone()[0]
+
+
+def restart_container(container="pg_test", drop_os_cache=False, timeout=120):
+    """
+    重启数据库容器并等待可以连接, 返回重启耗时 (秒)
+
+    参数:
+        container: 容器名
+        drop_os_cache: 是否同时清空宿主机的页缓存 (需要 root), 否则数据文件可能仍在页缓存中, 冷启动不够"冷"
+        timeout: 等待可以连接的最长时间 (秒)
+    """
+    client.close()
+    start = time.perf_counter()
+    if drop_os_cache:
+        # 在数据库停止期间清空, autoprewarm 在启动后才开始读入
+        subprocess.run(["docker", "stop", container], check=True, capture_output=True)
+        subprocess.run("sync && echo 3 > /proc/sys/vm/drop_caches", shell=True, check=True)
+        subprocess.run(["docker", "start", container], check=True, capture_output=True)
+    else:
+        subprocess.run(["docker", "restart", container], check=True, capture_output=True)
+    while True:
+        try:
+            with client.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            return time.perf_counter() - start
+        except psycopg2.Error:
+            if time.perf_counter() - start > timeout:
+                raise
+            client.close()
+            time.sleep(0.5)
+
+
+def time_to_steady_state(latencies, window=50, tolerance=1.2, tail=0.2):
+    """
+    达到稳定状态所需的查询数
+
+    稳定延迟取最后 tail 比例查询的中位数; 从头开始的滑动窗口中位数第一次不超过稳定延迟的 tolerance 倍时即为稳定。
+    返回 (查询数, 稳定延迟 ms), 始终没有达到时查询数为 None
+    """
+    steady = float(np.median(latencies[-max(window, int(len(latencies) * tail)):]))
+    for i in range(len(latencies) - window + 1):
+        if np.median(latencies[i:i + window]) <= tolerance * steady:
+            return i, steady
+    return None, steady
+
+
+def run_queries(queries, table_name="summary_aug_keywords", fusion="rrf"):
+    """依次执行查询, 返回 (每个查询的延迟 ms, 每个查询完成时距开始的秒数)"""
+    latencies, elapsed = [], []
+    start = time.perf_counter()
+    for query in queries:
+        query_start = time.perf_counter()
+        hybrid_search(*query, table_name=table_name, fusion=fusion, verbose=False)
+        latencies.append((time.perf_counter() - query_start) * 1000)
+        elapsed.append(time.perf_counter() - start)
+    return latencies, elapsed
+
+
+def benchmark_cold_start(n_queries=3000, table_name="summary_aug_keywords", fusion="rrf", modes=PREWARM_MODES,
+                         container="pg_test", drop_os_cache=False, window=50):
+    """
+    重启容器后测量检索达到稳定延迟所需的时间, 对比不同的预热方式
+
+    参数:
+        n_queries: 每种方式重启后执行的查询数 (各不相同, 覆盖尽量多的索引页)
+        table_name: 表名, 需要已有数据和索引
+        fusion: 传给 hybrid_search 的融合方式
+        modes: cold (关闭 autoprewarm, 不预热) / autoprewarm (重启前写入块列表, 重启后自动读入) /
+               explicit (关闭 autoprewarm, 重启后先执行 prewarm_indexes)
+        container: 数据库容器名
+        drop_os_cache: 重启时是否清空宿主机页缓存 (需要 root)
+        window: 判断稳定状态的滑动窗口大小
+    """
+    from benchmark import make_queries
+
+    queries = make_queries(n_queries)
+    # 先执行一遍, 让缓存中有检索用到的页面, autoprewarm 才有内容可记录
+    run_queries(queries, table_name, fusion)
+
+    report = {}
+    for mode in modes:
+        with client.connection() as conn:
+            conn.autocommit = True
+            try:
+                with conn.cursor() as cursor:
+                    set_autoprewarm(cursor, mode == "autoprewarm")
+                    if mode == "autoprewarm":
+                        dump_autoprewarm(cursor)
+            finally:
+                conn.autocommit = False
+        restart_seconds = restart_container(container, drop_os_cache)
+
+        prewarm_seconds = 0.0
+        if mode == "explicit":
+            start = time.perf_counter()
+            with client.cursor() as cursor:
+                prewarm_indexes(cursor, table_name)
+            prewarm_seconds = time.perf_counter() - start
+
+        latencies, elapsed = run_queries(queries, table_name, fusion)
+        steady_index, steady_ms = time_to_steady_state(latencies, window)
+        report[mode] = {
+            "restart_seconds": restart_seconds,
+            "prewarm_seconds": prewarm_seconds,
+            "first_window_p50_ms": float(np.median(latencies[:window])),
+            "steady_p50_ms": steady_ms,
+            "queries_to_steady": steady_index,
+            # 从可以连接开始计时, 显式预热的耗时也算在内
+            "seconds_to_steady": None if steady_index is None else prewarm_seconds + elapsed[steady_index],
+        }
+
+    # 恢复默认配置
+    with client.connection() as conn:
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cursor:
+                set_autoprewarm(cursor, True)
+        finally:
+            conn.autocommit = False
+
+    print(f"\n重启后达到稳定延迟 ({n_queries} 个查询, 窗口 {window}, {table_name}):")
+    print("=" * 80)
+    for mode, stats in report.items():
+        steady = "未达到" if stats["queries_to_steady"] is None else \
+            f"{stats['queries_to_steady']} 个查询 / {stats['seconds_to_steady']:.1f} 秒"
+        print(f"{mode:>12}: 首个窗口 p50 {stats['first_window_p50_ms']:.2f} ms, "
+              f"稳定 p50 {stats['steady_p50_ms']:.2f} ms, 达到稳定 {steady}, 预热 {stats['prewarm_seconds']:.1f} 秒")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检索索引预热")
+    parser.add_argument("--table", default="summary_aug_keywords")
+    parser.add_argument("--include-table", action="store_true", help="同时预热表本身")
+    parser.add_argument("--mode", default="buffer", choices=["buffer", "prefetch"])
+    parser.add_argument("--benchmark", action="store_true", help="重启容器, 对比各预热方式达到稳定延迟的时间")
+    parser.add_argument("--queries", type=int, default=3000)
+    parser.add_argument("--container", default="pg_test")
+    parser.add_argument("--drop-os-cache", action="store_true", help="重启时清空宿主机页缓存 (需要 root)")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark_cold_start(args.queries, args.table, container=args.container, drop_os_cache=args.drop_os_cache)
+        return
+    start = time.perf_counter()
+    with client.cursor() as cursor:
+        blocks = prewarm_indexes(cursor, args.table, include_table=args.include_table, mode=args.mode)
+    for relname, count in blocks.items():
+        print(f"{relname}: {count} 块")
+    print(f"预热完成, 共 {sum(blocks.values())} 块, {time.perf_counter() - start:.2f} 秒")
+
+
+if __name__ == "__main__":
+    main()
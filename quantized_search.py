@@ -0,0 +1,160 @@
+# 量化向量粗排 + 全精度重排
+#
+# 粗排在 halfvec / bit 表达式索引上召回 candidate_k 个候选, 重排只对这些候选读取全精度向量计算距离。
+# benchmark_quantization() 对比全精度索引与各量化索引的索引体积、构建耗时、延迟和 recall@k,
+# recall 以关闭索引扫描后的精确 (顺序扫描) 结果为准。
+import time
+
+import numpy as np
+
+from vector_index import (QUANTIZATIONS, build_vector_index, distance_sql, quantized_distance_sql, score_sql,
+                          set_search_params)
+
+
+def rerank_sql(table_name, column, columns, quantization=None, metric="cosine", dim=768):
+    """
+    单个向量列的 top-k 检索 SQL, 参数为 %(query_vector)s, %(candidate_k)s, %(top_k)s
+
+    参数:
+        table_name: 表名
+        column: 向量列
+        columns: 结果中返回的列
+        quantization: None 表示直接在全精度索引上检索; halfvec / bit 表示量化粗排 + 全精度重排
+        metric: 距离度量
+        dim: 向量维度
+    """
+    query = "%(query_vector)s"
+    select = ", ".join(columns)
+    if quantization is None:
+        return f"""
+        SELECT {select}, {score_sql(column, query, metric)} AS score
+        FROM {table_name}
+        ORDER BY {distance_sql(column, query, metric)}
+        LIMIT %(top_k)s
+        """
+    return f"""
+    SELECT {select}, {score_sql(column, query, metric)} AS score
+    FROM (
+        SELECT *
+        FROM {table_name}
+        ORDER BY {quantized_distance_sql(column, query, quantization, dim, metric)}
+        LIMIT %(candidate_k)s
+    ) candidates
+    ORDER BY {distance_sql(column, query, metric)}
+    LIMIT %(top_k)s
+    """
+
+
+def quantized_search(client, query_vector, table_name="summary_aug_keywords", column="summary_embedding",
+                     columns=("package_id", "summary"), quantization="halfvec", metric="cosine", dim=768,
+                     top_k=10, candidate_k=100, ef_search=None, probes=None):
+    """
+    量化粗排 + 全精度重排检索
+
+    参数:
+        client: SearchClient
+        query_vector: 查询向量
+        quantization: halfvec / bit, None 表示全精度检索
+        candidate_k: 粗排召回的候选数量, 越大重排后的召回率越高
+        ef_search: hnsw.ef_search, None 表示取 candidate_k (hnsw 一次最多返回 ef_search 个结果)
+        probes: ivfflat.probes
+
+    返回 [(columns..., score)]
+    """
+    if ef_search is None and quantization is not None:
+        ef_search = candidate_k
+    sql = rerank_sql(table_name, column, columns, quantization, metric, dim)
+    with client.cursor() as cursor:
+        set_search_params(cursor, ef_search, probes)
+        cursor.execute(sql, {"query_vector": query_vector, "candidate_k": candidate_k, "top_k": top_k})
+        return cursor.fetchall()
+
+
+def _exact_ids(client, sql, params):
+    """关闭索引扫描, 以顺序扫描的精确结果作为 recall 的基准"""
+    with client.cursor() as cursor:
+        cursor.execute("SELECT set_config('enable_indexscan', 'off', true)")
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _relation_size(cursor, name):
+    cursor.execute("SELECT pg_relation_size(%s::regclass)", (name,))
+    return cursor.fetchone()[0]
+
+
+def benchmark_quantization(n=100000, n_queries=100, top_k=10, candidate_k=100, table_name="summary_aug_keywords",
+                           column="summary_embedding", metric="cosine", method="hnsw", dim=768):
+    """
+    对比全精度索引与 halfvec / bit 量化索引: 索引体积 (及占 shared_buffers 的比例)、构建耗时、
+    p50 / p95 延迟和 recall@k
+
+    参数:
+        n: 合成数据行数
+        n_queries: 查询次数
+        top_k: 返回结果数量, recall@k 中的 k
+        candidate_k: 量化粗排召回的候选数量
+        table_name: 表名, 会被重建
+        column: 参与对比的向量列
+        metric: 距离度量
+        method: hnsw 或 ivfflat
+        dim: 向量维度
+    """
+    from binary_copy import copy_documents
+    from demo_2vec_2txt import client, setup_database
+    from synthetic_data import generate_packages
+
+    setup_database(table_name)
+    with client.connection() as conn:
+        copy_documents(conn, generate_packages(n, dim), table_name)
+
+    variants = (None,) + QUANTIZATIONS
+    report = {}
+    with client.connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_size_bytes(current_setting('shared_buffers')), "
+                           "pg_total_relation_size(%s::regclass)", (table_name,))
+            shared_buffers, table_bytes = cursor.fetchone()
+            for quantization in variants:
+                index_name = f"idx_{column}_{quantization or 'full'}"
+                elapsed = build_vector_index(cursor, index_name, table_name, column, metric, method,
+                                             quantization=quantization, dim=dim)
+                conn.commit()
+                index_bytes = _relation_size(cursor, index_name)
+                report[quantization or "full"] = {
+                    "index_mb": index_bytes / 1024 / 1024,
+                    "shared_buffers_ratio": index_bytes / shared_buffers,
+                    "build_s": elapsed,
+                }
+
+    queries = [doc[column] for doc in generate_packages(n_queries, dim, seed=1)]
+    exact_sql = rerank_sql(table_name, column, ["id"], None, metric, dim)
+    exact = [set(_exact_ids(client, exact_sql, {"query_vector": q, "top_k": top_k})) for q in queries]
+
+    for quantization in variants:
+        latencies = []
+        hits = 0
+        for query_vector, truth in zip(queries, exact):
+            start = time.perf_counter()
+            rows = quantized_search(client, query_vector, table_name, column, ["id"], quantization, metric, dim,
+                                    top_k, candidate_k, ef_search=max(40, candidate_k))
+            latencies.append((time.perf_counter() - start) * 1000)
+            hits += len(truth.intersection(row[0] for row in rows))
+        stats = report[quantization or "full"]
+        stats["p50_ms"] = float(np.percentile(latencies, 50))
+        stats["p95_ms"] = float(np.percentile(latencies, 95))
+        stats[f"recall@{top_k}"] = hits / (top_k * len(queries))
+
+    print(f"\n量化索引对比 ({n} 行, {table_name}.{column}, {method}, candidate_k={candidate_k}):")
+    print(f"表总大小 (含 TOAST 和其他索引): {table_bytes / 1024 / 1024:.1f} MB, "
+          f"shared_buffers: {shared_buffers / 1024 / 1024:.0f} MB")
+    print("=" * 80)
+    for name, stats in report.items():
+        print(f"{name:>8}: 索引 {stats['index_mb']:.1f} MB ({stats['shared_buffers_ratio']:.0%} shared_buffers), "
+              f"构建 {stats['build_s']:.1f} 秒, p50 {stats['p50_ms']:.2f} ms, p95 {stats['p95_ms']:.2f} ms, "
+              f"recall@{top_k} {stats[f'recall@{top_k}']:.3f}")
+    return report
+
+
+if __name__ == "__main__":
+    benchmark_quantization()
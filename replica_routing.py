@@ -0,0 +1,201 @@
+# 只读检索分流到流复制备库
+#
+# hybrid_search 是只读的, 可以由任意一个流复制备库执行, 主库只承担导入和更新。
+# ReplicaRouter 为每次检索选择执行的 SearchClient:
+#   replicas  在健康且延迟不超过 max_lag_bytes 的备库之间轮询, 没有可用备库时回退到主库
+#   primary   所有检索都在主库执行
+# 备库的回放有延迟, 导入之后立即检索可能看不到刚写入的数据 (read-your-writes)。两种处理方式:
+#   with router.primary_only():   块内当前线程的检索都走主库, 适合导入之后紧接着的校验查询
+#   lsn = router.write_lsn()      导入提交后记录主库的 WAL 位置, 之后 router.read_client(min_lsn=lsn)
+#                                 只选择已回放到该位置的备库, 都没有回放到时走主库
+# 备库的状态 (是否可连接、pg_last_wal_replay_lsn) 每隔 status_interval 秒刷新一次, 不在每次检索时查询。
+# 检索结果缓存在主库的 client 上, 备库执行的检索只查找缓存, 不把结果写入缓存 (见 hybrid_search)。
+#
+# 本地测试: docker-compose --profile replicas up -d 在 pg_test 之外启动两个备库 (端口 5436、5437)。
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+
+from demo_2vec_2txt import DB_CONFIG, client as primary_client, hybrid_search
+from search_client import SearchClient
+
+# docker-compose.yml 中 replicas profile 的两个备库
+REPLICA_CONFIGS = [{**DB_CONFIG, "port": port} for port in (5436, 5437)]
+
+ROUTING_MODES = ("replicas", "primary")
+
+
+def parse_lsn(lsn):
+    """PostgreSQL 的 LSN 文本 (例如 16/B374D848) 转换为可以比较大小的整数"""
+    high, low = lsn.split("/")
+    return (int(high, 16) << 32) + int(low, 16)
+
+
+class ReplicaRouter:
+    """
+    为只读检索选择主库或备库
+
+    参数:
+        primary: 主库的 SearchClient
+        replicas: 各备库的 SearchClient
+        mode: replicas 或 primary (见 ROUTING_MODES)
+        max_lag_bytes: 备库回放落后主库超过该字节数时不再分配检索, None 表示不限制
+        status_interval: 刷新备库状态的间隔 (秒)
+    """
+
+    def __init__(self, primary=primary_client, replicas=(), mode="replicas", max_lag_bytes=None, status_interval=1.0):
+        if mode not in ROUTING_MODES:
+            raise ValueError(f"未知的路由方式: {mode}, 可选: {ROUTING_MODES}")
+        self.primary = primary
+        self.replicas = list(replicas)
+        self.mode = mode
+        self.max_lag_bytes = max_lag_bytes
+        self.status_interval = status_interval
+        # 备库下标 -> 已回放到的 LSN (整数), 不可用的备库不在其中
+        self._replay_lsn = {}
+        self._primary_lsn = 0
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._round_robin = itertools.count()
+        self._local = threading.local()
+
+    @classmethod
+    def from_configs(cls, replica_configs=REPLICA_CONFIGS, **options):
+        """主库使用 demo_2vec_2txt.client, 为每个备库配置创建 SearchClient"""
+        return cls(primary_client, [SearchClient(config) for config in replica_configs], **options)
+
+    @contextmanager
+    def primary_only(self):
+        """块内当前线程的检索都走主库 (可以嵌套)"""
+        self._local.depth = getattr(self._local, "depth", 0) + 1
+        try:
+            yield self
+        finally:
+            self._local.depth -= 1
+
+    def write_lsn(self):
+        """主库当前的 WAL 位置, 在写入提交之后调用, 作为 read_client 的 min_lsn"""
+        with self.primary.cursor() as cursor:
+            cursor.execute("SELECT pg_current_wal_lsn()::text")
+            return parse_lsn(cursor.fetchone()[0])
+
+    def refresh(self):
+        """查询主库的 WAL 位置和每个备库的回放位置"""
+        replay_lsn = {}
+        for i, replica in enumerate(self.replicas):
+            try:
+                with replica.cursor() as cursor:
+                    cursor.execute("SELECT pg_is_in_recovery(), pg_last_wal_replay_lsn()::text")
+                    in_recovery, lsn = cursor.fetchone()
+            except psycopg2.Error:
+                continue
+            # 已被提升为主库的实例不再是这个主库的备库
+            if in_recovery and lsn is not None:
+                replay_lsn[i] = parse_lsn(lsn)
+        try:
+            primary_lsn = self.write_lsn()
+        except psycopg2.Error:
+            primary_lsn = max(replay_lsn.values(), default=0)
+        with self._lock:
+            self._replay_lsn = replay_lsn
+            self._primary_lsn = primary_lsn
+            self._checked_at = time.monotonic()
+
+    def status(self):
+        """各备库的回放位置和落后主库的字节数, 不可用的备库为 None"""
+        self._maybe_refresh()
+        with self._lock:
+            return [
+                None if i not in self._replay_lsn
+                else {"replay_lsn": self._replay_lsn[i], "lag_bytes": max(0, self._primary_lsn - self._replay_lsn[i])}
+                for i in range(len(self.replicas))
+            ]
+
+    def _maybe_refresh(self):
+        if not self.replicas:
+            return
+        # 只由一个线程刷新, 其余线程继续使用上一次的状态
+        with self._lock:
+            now = time.monotonic()
+            if now - self._checked_at < self.status_interval:
+                return
+            self._checked_at = now
+        self.refresh()
+
+    def read_client(self, min_lsn=None):
+        """
+        选择执行只读检索的 SearchClient
+
+        参数:
+            min_lsn: write_lsn() 返回的位置, 只选择已回放到该位置的备库; None 表示不要求
+        """
+        if self.mode == "primary" or getattr(self._local, "depth", 0) or not self.replicas:
+            return self.primary
+        self._maybe_refresh()
+        with self._lock:
+            candidates = [
+                i for i, lsn in self._replay_lsn.items()
+                if (min_lsn is None or lsn >= min_lsn)
+                and (self.max_lag_bytes is None or self._primary_lsn - lsn <= self.max_lag_bytes)
+            ]
+        if not candidates:
+            return self.primary
+        return self.replicas[sorted(candidates)[next(self._round_robin) % len(candidates)]]
+
+    def hybrid_search(self, *args, min_lsn=None, **kwargs):
+        """demo_2vec_2txt.hybrid_search, 由 read_client 选择执行的数据库"""
+        return hybrid_search(*args, search_client=self.read_client(min_lsn), **kwargs)
+
+    def close(self):
+        """关闭备库的连接池 (主库的 client 由 demo_2vec_2txt 管理)"""
+        for replica in self.replicas:
+            replica.close()
+
+
+def benchmark_routing(n_queries=500, concurrency=8, table_name="summary_aug_keywords", fusion="rrf",
+                      replica_configs=REPLICA_CONFIGS):
+    """
+    对比检索全部走主库与分流到备库时的并发吞吐量和延迟
+
+    参数:
+        n_queries: 每种方式执行的查询数
+        concurrency: 并发线程数
+        table_name: 表名, 主库上需要已有数据 (备库通过流复制得到同样的数据)
+        fusion: 传给 hybrid_search 的融合方式
+        replica_configs: 备库的连接配置
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    from benchmark import latency_stats, make_queries
+
+    queries = make_queries(n_queries)
+    report = {}
+    for mode in ROUTING_MODES:
+        router = ReplicaRouter.from_configs(replica_configs, mode=mode)
+
+        def run(query):
+            start = time.perf_counter()
+            router.hybrid_search(*query, table_name=table_name, fusion=fusion, verbose=False)
+            return (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as executor:
+            latencies = list(executor.map(run, queries))
+        elapsed = time.perf_counter() - start
+        report[mode] = {"qps": len(queries) / elapsed, **latency_stats(latencies)}
+        report[mode]["replicas"] = sum(1 for state in router.status() if state is not None)
+        router.close()
+
+    print(f"\n读写分离对比 ({n_queries} 个查询, 并发 {concurrency}):")
+    print("=" * 80)
+    for mode, stats in report.items():
+        print(f"{mode:>9}: {stats['qps']:,.1f} QPS, p50 {stats['p50_ms']:.2f} ms, p99 {stats['p99_ms']:.2f} ms "
+              f"(可用备库 {stats['replicas']})")
+    return report
+
+
+if __name__ == "__main__":
+    benchmark_routing()
@@ -0,0 +1,201 @@
+# 客户端检索结果缓存
+#
+# 热门查询会被反复执行, 每次都要重新序列化 768 维的查询向量并完整执行一遍混合检索。
+# ResultCache 是可选的 LRU + TTL 缓存, 键由规范化的查询文本、查询向量的哈希、权重、过滤条件、top_k
+# 以及其他影响结果的检索参数组成; 按条目数和估算的内存占用两个上限淘汰最久未使用的条目。
+# 检索统一经过 SearchClient.cached_search 查找和写入缓存, 键由检索 SQL 和参数构造 (query_cache_key)。
+#
+# 导入路径 (binary_copy.copy_documents / upsert.upsert_documents / table_swap.swap_tables /
+# AsyncSearchClient.copy_documents) 提交后调用 invalidate_table, 清空本进程内所有缓存中该表的结果。
+# 每张表有一个代数, 查询开始前记录代数, 写入缓存时代数已经变化 (期间有数据更新) 则不写入,
+# 避免更新前开始的查询把旧结果放回缓存。其他进程导入的数据无法通知到这里, 由 ttl 兜底。
+import hashlib
+import json
+import numbers
+import sys
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+
+# 本进程内创建的全部缓存, 导入数据后逐个失效
+_caches = weakref.WeakSet()
+
+
+def normalize_text(text):
+    """查询文本规范化: 去掉首尾空白, 合并连续空白, 转小写"""
+    return " ".join(text.split()).lower() if isinstance(text, str) else text
+
+
+def vector_digest(vector):
+    """查询向量的哈希, 按 float32 字节计算"""
+    if vector is None:
+        return None
+    return hashlib.sha1(np.asarray(vector, dtype="<f4").tobytes()).hexdigest()
+
+
+def cache_key(table_name, texts=(), vectors=(), **params):
+    """
+    构造缓存键
+
+    参数:
+        table_name: 表名, 失效按表进行
+        texts: 查询文本, 规范化后参与比较
+        vectors: 查询向量, 以哈希参与比较
+        params: 其余影响结果的参数 (权重、top_k、过滤条件等), 需要可以 JSON 序列化
+    """
+    return (
+        table_name,
+        tuple(normalize_text(text) for text in texts),
+        tuple(vector_digest(vector) for vector in vectors),
+        json.dumps(params, sort_keys=True, ensure_ascii=False, default=str),
+    )
+
+
+def _is_vector(value):
+    """与 search_client.adapt_list 一致: 一维数组和数值列表按向量处理"""
+    if isinstance(value, np.ndarray):
+        return value.ndim == 1
+    return isinstance(value, (list, tuple)) and bool(value) and all(
+        isinstance(x, numbers.Real) and not isinstance(x, bool) for x in value)
+
+
+def query_cache_key(table_name, sql, params, text_params=(), **settings):
+    """
+    按检索 SQL 和命名参数构造缓存键 (SearchClient.cached_search 使用)
+
+    参数:
+        table_name: 表名
+        sql: 检索 SQL, 融合方式、距离度量、投影等都体现在 SQL 中
+        params: 命名参数字典; 向量参数以哈希参与比较
+        text_params: 查询文本参数名, 规范化后参与比较
+        settings: 不在 SQL 和参数中、但影响结果的检索设置 (ef_search、probes 等)
+    """
+    names = sorted(params)
+    texts = [name for name in names if name in text_params]
+    vectors = [name for name in names if name not in text_params and _is_vector(params[name])]
+    return cache_key(
+        table_name,
+        texts=[params[name] for name in texts],
+        vectors=[params[name] for name in vectors],
+        sql=hashlib.sha1(sql.encode("utf-8")).hexdigest(),
+        values={name: params[name] for name in names if name not in texts and name not in vectors},
+        **settings,
+    )
+
+
+def estimate_size(value):
+    """粗略估算结果占用的内存 (字节)"""
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_size(item) for item in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    if isinstance(value, np.ndarray):
+        return sys.getsizeof(value) + value.nbytes
+    return sys.getsizeof(value)
+
+
+def invalidate_table(table_name):
+    """数据导入的失效钩子: 清空本进程内所有缓存中该表的结果"""
+    for cache in list(_caches):
+        cache.invalidate(table_name)
+
+
+class ResultCache:
+    """
+    LRU + TTL 检索结果缓存, 线程安全
+
+    参数:
+        max_entries: 最多缓存的查询数
+        max_bytes: 缓存结果估算内存占用的上限
+        ttl: 条目的有效期 (秒), None 表示只在导入数据或被淘汰时失效
+    """
+
+    def __init__(self, max_entries=10000, max_bytes=64 * 2 ** 20, ttl=300):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()  # 键 -> (结果, 大小, 过期时间)
+        self._bytes = 0
+        self._generations = {}  # 表名 -> 代数
+        self._epoch = 0  # invalidate() 清空全部表的次数
+        self._lock = threading.Lock()
+        _caches.add(self)
+
+    def generation(self, table_name):
+        """表当前的代数, 查询开始前记录, 写入缓存时传给 put"""
+        with self._lock:
+            return self._epoch, self._generations.get(table_name, 0)
+
+    def get(self, key):
+        """取缓存的结果, 未命中或已过期返回 None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] is not None and entry[2] < time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return list(entry[0])
+
+    def put(self, key, results, generation=None):
+        """
+        写入查询结果
+
+        参数:
+            key: cache_key 构造的键
+            results: 结果行列表
+            generation: 查询开始前由 generation() 取得的代数, 与当前代数不一致时不写入
+        """
+        size = estimate_size(results)
+        if size > self.max_bytes:
+            return
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            if generation is not None and generation != (self._epoch, self._generations.get(key[0], 0)):
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (list(results), size, expires)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, table_name=None):
+        """删除某张表 (None 表示全部表) 的缓存结果"""
+        with self._lock:
+            if table_name is None:
+                self._epoch += 1
+            else:
+                self._generations[table_name] = self._generations.get(table_name, 0) + 1
+            for key in [key for key in self._entries if table_name is None or key[0] == table_name]:
+                self._remove(key)
+            self.invalidations += 1
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def stats(self):
+        """命中/未命中计数、命中率和当前占用"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
@@ -0,0 +1,328 @@
+# 带连接池的检索客户端
+#
+# 每次 psycopg2.connect 都要经历 TCP 建连和认证, 小查询的耗时主要花在这里。
+# SearchClient 持有一个线程安全、有上限的连接池, 每个连接只在创建时做一次初始化
+# (会话参数: ivfflat.probes / hnsw.ef_search / statement_timeout), 借出前做健康检查。
+# 向量类型适配器在导入本模块时全局注册一次。
+#
+# execute_prepared() 把 %(name)s 形式的查询在每个连接上 PREPARE 一次, 之后只发送 EXECUTE 和参数,
+# 服务端跳过解析和规划。psycopg2 不支持二进制参数, 参数仍以文本字面量发送,
+# 但每个向量只发送一次, 且不再与 SQL 拼接。
+#
+# 配置 result_cache (result_cache.ResultCache) 后, 经过 cached_search() 的检索按 SQL 和参数缓存结果。
+#
+# 配置 instrumentation (search_metrics.Instrumentation) 后, trace() 返回的记录对象收集各阶段耗时,
+# 并按比例对查询执行 EXPLAIN (ANALYZE, BUFFERS), 结果交给配置的 sink。
+import hashlib
+import json
+import numbers
+import re
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+import numpy as np
+import psycopg2
+from psycopg2 import extensions, pool
+
+from result_cache import query_cache_key
+from search_metrics import NULL_TRACE
+
+# 数据库连接配置
+DB_CONFIG = {
+    "host": "localhost",
+    "database": "compass",
+    "user": "nju_common",
+    "password": "opensource"
+}
+
+_default_list_adapter = extensions.adapters[(list, extensions.ISQLQuote)]
+
+
+def vector_literal(vector):
+    """pgvector 的文本格式 [x1,x2,...]"""
+    return f"[{','.join(map(str, vector))}]"
+
+
+def array_literal(values):
+    """
+    PostgreSQL 数组的文本格式 {"v1","v2",...}, 作为一个字符串参数传入, 在 SQL 中用 ::vector[] / ::text[] 等转换
+
+    数值列表会被 adapt_list 当作向量, 向量列表也无法直接适配为 vector[], 批量参数统一走这里
+    """
+    elements = []
+    for value in values:
+        if value is None:
+            elements.append("NULL")
+            continue
+        if not isinstance(value, str):
+            value = vector_literal(value) if np.ndim(value) else str(value)
+        elements.append('"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"')
+    return "{" + ",".join(elements) + "}"
+
+
+# 注册向量类型适配器
+def adapt_vector(vector):
+    return extensions.QuotedString(vector_literal(vector))
+
+
+def adapt_list(value):
+    """数值列表按向量处理, 其他列表 (例如字符串数组) 仍按 PostgreSQL 数组处理"""
+    if value and all(isinstance(x, numbers.Real) and not isinstance(x, bool) for x in value):
+        return adapt_vector(value)
+    return _default_list_adapter(value)
+
+
+extensions.register_adapter(np.ndarray, adapt_vector)
+extensions.register_adapter(list, adapt_list)
+
+_NAMED_PARAM = re.compile(r"%\((\w+)\)s")
+
+
+def to_positional(sql):
+    """
+    把 %(name)s 形式的命名参数改写为 $1, $2 ... 形式的位置参数
+
+    返回 (改写后的 SQL, 按位置排列的参数名列表), 同名参数共用同一个位置
+    """
+    names = []
+
+    def replace(match):
+        name = match.group(1)
+        if name not in names:
+            names.append(name)
+        return f"${names.index(name) + 1}"
+
+    return _NAMED_PARAM.sub(replace, sql).replace("%%", "%"), names
+
+
+class SearchClient:
+    """
+    检索客户端, 管理连接池
+
+    参数:
+        db_config: 数据库连接配置
+        minconn: 连接池创建时预先建立的连接数
+        maxconn: 连接池的最大连接数, 连接全部借出时 connection() 会阻塞等待; 归还的连接最多保留 maxconn 个空闲
+        acquire_timeout: 等待空闲连接的最长时间 (秒), 超时抛出 PoolError
+        statement_timeout_ms: 语句超时 (毫秒), None 表示不设置
+        ivfflat_probes: 会话级 ivfflat.probes, None 表示使用服务端默认值
+        hnsw_ef_search: 会话级 hnsw.ef_search, None 表示使用服务端默认值
+        health_check_interval: 连接空闲超过该时间 (秒) 后, 借出前先执行 SELECT 1 检查
+        result_cache: 检索结果缓存 (result_cache.ResultCache), None 表示不缓存
+        instrumentation: 耗时和执行计划监控 (search_metrics.Instrumentation), None 表示不记录
+    """
+
+    def __init__(self, db_config=None, minconn=1, maxconn=10, acquire_timeout=30,
+                 statement_timeout_ms=None, ivfflat_probes=None, hnsw_ef_search=None,
+                 health_check_interval=30, result_cache=None, instrumentation=None):
+        self.db_config = dict(db_config or DB_CONFIG)
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.acquire_timeout = acquire_timeout
+        self.health_check_interval = health_check_interval
+        self.result_cache = result_cache
+        self.instrumentation = instrumentation
+        self.session_settings = {
+            "statement_timeout": statement_timeout_ms,
+            "ivfflat.probes": ivfflat_probes,
+            "hnsw.ef_search": hnsw_ef_search,
+        }
+        self._pool = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(maxconn)
+        # 以连接对象本身为键: 连接池关闭并丢弃的连接随之被回收, 新连接即使复用了同一个 id 也不会继承这些状态
+        # 已初始化连接 -> 最近一次归还的时间
+        self._last_used = weakref.WeakKeyDictionary()
+        # 连接 -> 已在该连接上 PREPARE 过的语句名
+        self._prepared = weakref.WeakKeyDictionary()
+
+    def _get_pool(self):
+        # 连接池在第一次使用时创建, 导入模块时不连接数据库
+        with self._lock:
+            if self._pool is None:
+                self._pool = pool.ThreadedConnectionPool(self.minconn, self.maxconn, **self.db_config)
+                # psycopg2 的连接池在空闲连接达到 minconn 后会关闭归还的连接, 下次借出时重新连接、
+                # 重新初始化并重新 PREPARE; 创建后把保留上限提高到 maxconn, 借出过的连接都保持空闲可复用
+                self._pool.minconn = self.maxconn
+            return self._pool
+
+    def _setup_connection(self, conn):
+        """每个连接只初始化一次"""
+        with conn.cursor() as cursor:
+            for name, value in self.session_settings.items():
+                if value is not None:
+                    cursor.execute(f"SET {name} = %s", (str(value),))
+        conn.commit()
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+        last_used = self._last_used.get(conn)
+        if last_used is not None and time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _acquire(self):
+        conn_pool = self._get_pool()
+        # 最多尝试 maxconn + 1 次, 把失效的连接全部换掉
+        for _ in range(self.maxconn + 1):
+            conn = conn_pool.getconn()
+            if conn not in self._last_used:
+                try:
+                    self._setup_connection(conn)
+                except psycopg2.Error:
+                    conn_pool.putconn(conn, close=True)
+                    continue
+                self._last_used[conn] = time.monotonic()
+                self._prepared[conn] = set()
+                return conn
+            if self._is_healthy(conn):
+                return conn
+            self._discard(conn)
+        raise pool.PoolError("无法从连接池获取可用连接")
+
+    def _forget(self, conn):
+        self._last_used.pop(conn, None)
+        self._prepared.pop(conn, None)
+
+    def _discard(self, conn):
+        self._forget(conn)
+        self._get_pool().putconn(conn, close=True)
+
+    def _release(self, conn):
+        if conn.closed or conn.get_transaction_status() == extensions.TRANSACTION_STATUS_UNKNOWN:
+            self._discard(conn)
+            return
+        if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                self._discard(conn)
+                return
+        self._last_used[conn] = time.monotonic()
+        self._get_pool().putconn(conn)
+
+    @contextmanager
+    def connection(self):
+        """借出一个连接, 正常结束时提交, 发生异常时回滚, 最后归还连接池"""
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            raise pool.PoolError(f"等待空闲连接超时 ({self.acquire_timeout} 秒)")
+        try:
+            conn = self._acquire()
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                if not conn.closed:
+                    try:
+                        conn.rollback()
+                    except psycopg2.Error:
+                        pass
+                raise
+            finally:
+                self._release(conn)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def cursor(self):
+        """借出一个连接上的游标"""
+        with self.connection() as conn:
+            with conn.cursor() as cursor:
+                yield cursor
+
+    def _prepare(self, cursor, sql, types):
+        """在游标所在连接上 PREPARE 查询 (已 PREPARE 过则跳过), 返回 (语句名, 参数名列表)"""
+        positional_sql, names = to_positional(sql)
+        signature = ", ".join(types[name] for name in names)
+        statement = "q_" + hashlib.sha1(f"{signature}\n{positional_sql}".encode("utf-8")).hexdigest()[:16]
+
+        prepared = self._prepared.setdefault(cursor.connection, set())
+        if statement not in prepared:
+            cursor.execute(f"PREPARE {statement} ({signature}) AS {positional_sql}")
+            prepared.add(statement)
+        return statement, names
+
+    def execute_prepared(self, cursor, sql, params, types):
+        """
+        以服务端预备语句执行查询, 同一连接上相同的 SQL 只 PREPARE 一次
+
+        参数:
+            cursor: 从本客户端借出的连接上的游标
+            sql: 使用 %(name)s 命名参数的查询
+            params: 参数字典
+            types: 参数名 -> PostgreSQL 类型 (例如 vector, text, float8, int)
+        """
+        statement, names = self._prepare(cursor, sql, types)
+        cursor.execute(f"EXECUTE {statement} ({', '.join(['%s'] * len(names))})",
+                       [params[name] for name in names])
+
+    def explain(self, cursor, sql, params, types=None, analyze=True):
+        """
+        返回查询的 JSON 执行计划
+
+        参数:
+            cursor: 游标, 与查询在同一事务中, 会话参数 (ef_search 等) 相同
+            sql, params: 查询和参数
+            types: 不为 None 时解释预备语句的 EXECUTE, 与 execute_prepared 实际使用的计划 (可能是通用计划) 一致
+            analyze: 是否实际执行 (ANALYZE, BUFFERS)
+        """
+        options = "ANALYZE, BUFFERS, FORMAT JSON" if analyze else "FORMAT JSON"
+        if types is None:
+            cursor.execute(f"EXPLAIN ({options}) {sql}", params)
+        else:
+            statement, names = self._prepare(cursor, sql, types)
+            cursor.execute(f"EXPLAIN ({options}) EXECUTE {statement} ({', '.join(['%s'] * len(names))})",
+                           [params[name] for name in names])
+        plan = cursor.fetchone()[0]
+        return json.loads(plan) if isinstance(plan, str) else plan
+
+    def cached_search(self, table_name, sql, params, search, text_params=(), store=True, **settings):
+        """
+        检索的缓存入口: 配置了 result_cache 时先按查询查找缓存, 未命中时调用 search() 执行并写入缓存
+
+        参数:
+            table_name: 检索的表, 导入该表后缓存失效 (见 result_cache.invalidate_table)
+            sql, params: 检索 SQL 和命名参数, 一起构成缓存键 (见 result_cache.query_cache_key)
+            search: 无参数的函数, 执行检索并返回结果行列表
+            text_params: 查询文本参数名, 规范化 (合并空白、转小写) 后比较
+            store: 未命中时是否把结果写入缓存; 由可能落后于主库的备库执行时传 False,
+                回放延迟内的旧结果会带着导入之后的代数写入, 代数检查拦不住
+            settings: 不在 SQL 和参数中、但影响结果的检索设置 (ef_search、probes 等)
+        """
+        cache = self.result_cache
+        if cache is None:
+            return search()
+        key = query_cache_key(table_name, sql, params, text_params, **settings)
+        results = cache.get(key)
+        if results is not None:
+            return results
+        # 查询开始前记录代数, 期间有数据导入时不把结果写入缓存
+        generation = cache.generation(table_name)
+        results = search()
+        if store:
+            cache.put(key, results, generation)
+        return results
+
+    def trace(self, name, table_name=None):
+        """开始记录一次检索, 没有配置 instrumentation 时返回不做任何事的记录对象"""
+        if self.instrumentation is None:
+            return NULL_TRACE
+        return self.instrumentation.trace(name, table_name)
+
+    def close(self):
+        """关闭连接池中的所有连接"""
+        with self._lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+            self._last_used.clear()
+            self._prepared.clear()
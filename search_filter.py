@@ -0,0 +1,138 @@
+# 结构化过滤条件
+#
+# filters 是 {字段: 条件} 字典, 多个字段之间为 AND:
+#   {"ecosystem": "npm"}                        等值
+#   {"ecosystem": ["npm", "pypi"]}              IN
+#   {"id": {"gte": 100, "lt": 1000}}            范围 (eq / in / gt / gte / lt / lte)
+#   {"metadata.category": "database"}           JSONB 列中的键, 写作 "列名.键"
+# 每种条件都生成能使用索引的写法:
+#   普通列        col = v / col = ANY(...) / col >= v                      B-tree
+#   JSONB 等值    metadata @> '{"k": v}'                                    GIN (jsonb_path_ops)
+#   JSONB IN      metadata @@ '$."k" == v1 || $."k" == v2'                  GIN (jsonb_path_ops)
+#   JSONB 范围    ((metadata->>'k')::numeric) >= v                          表达式 B-tree (create_json_range_index)
+# 条件值全部以参数传入并显式标注类型 (服务端预备语句也可以使用), 列名和键只允许标识符字符。
+import json
+import numbers
+import re
+
+from search_client import array_literal
+
+RANGE_OPERATORS = {"gt": ">", "gte": ">=", "lt": "<", "lte": "<="}
+
+_IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+def _check_identifier(name):
+    if not _IDENTIFIER.match(name):
+        raise ValueError(f"非法的过滤字段: {name}")
+    return name
+
+
+def _column_type(value):
+    # 整数用 bigint 而不是 numeric, 与 integer 列比较时仍然可以使用 B-tree 索引
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, numbers.Integral):
+        return "bigint"
+    if isinstance(value, numbers.Real):
+        return "float8"
+    if isinstance(value, str):
+        return "text"
+    raise ValueError(f"不支持的过滤值类型: {type(value).__name__}")
+
+
+def _json_type(value):
+    # JSONB 中的数字统一按 numeric 比较, 与 create_json_range_index 的默认类型一致
+    return "numeric" if _column_type(value) in ("bigint", "float8") else _column_type(value)
+
+
+def json_key_sql(column, key, value_type="text"):
+    """JSONB 键的取值表达式, 范围过滤和表达式索引必须使用同一个表达式"""
+    expression = f"({column}->>'{key}')"
+    return expression if value_type == "text" else f"({expression}::{value_type})"
+
+
+def build_filter(filters, prefix="filter"):
+    """
+    把结构化过滤条件转换为 SQL
+
+    参数:
+        filters: {字段: 条件} 字典, None 或空字典表示不过滤
+        prefix: 参数名前缀, 避免与查询中的其他参数重名
+
+    返回 (SQL 条件, 参数字典, 参数类型字典), 没有过滤条件时 SQL 条件为 None
+    """
+    clauses, params, types = [], {}, {}
+
+    def bind(value, value_type):
+        name = f"{prefix}_{len(params)}"
+        params[name] = value
+        types[name] = value_type
+        return f"%({name})s::{value_type}"
+
+    for field, condition in (filters or {}).items():
+        column, _, key = field.partition(".")
+        _check_identifier(column)
+        if key:
+            _check_identifier(key)
+
+        if isinstance(condition, dict):
+            operations = condition
+        elif isinstance(condition, (list, tuple, set)):
+            operations = {"in": condition}
+        else:
+            operations = {"eq": condition}
+
+        for operation, value in operations.items():
+            if operation == "eq":
+                if key:
+                    clauses.append(f"{column} @> {bind(json.dumps({key: value}, ensure_ascii=False), 'jsonb')}")
+                else:
+                    clauses.append(f"{column} = {bind(value, _column_type(value))}")
+            elif operation == "in":
+                values = list(value)
+                if not values:
+                    clauses.append("false")
+                elif key:
+                    path = " || ".join(f'$."{key}" == {json.dumps(v, ensure_ascii=False)}' for v in values)
+                    clauses.append(f"{column} @@ {bind(path, 'jsonpath')}")
+                else:
+                    value_type = _column_type(values[0])
+                    clauses.append(f"{column} = ANY({bind(array_literal(values), value_type + '[]')})")
+            elif operation in RANGE_OPERATORS:
+                if key:
+                    value_type = _json_type(value)
+                    target = json_key_sql(column, key, value_type)
+                else:
+                    value_type = _column_type(value)
+                    target = column
+                clauses.append(f"{target} {RANGE_OPERATORS[operation]} {bind(value, value_type)}")
+            else:
+                raise ValueError(f"未知的过滤操作: {operation}, 可选: eq, in, {', '.join(RANGE_OPERATORS)}")
+
+    return (" AND ".join(clauses) if clauses else None), params, types
+
+
+def parse_metadata_filter(metadata_filter, column="metadata"):
+    """兼容旧的 "键:值" 形式的元数据过滤条件"""
+    key, value = metadata_filter.split(":", 1)
+    return {f"{column}.{key}": value}
+
+
+def create_json_range_index(cursor, table_name, column, key, value_type="numeric"):
+    """
+    为 JSONB 键上的范围过滤创建表达式 B-tree 索引
+
+    参数:
+        cursor: 数据库游标
+        table_name: 表名
+        column: JSONB 列
+        key: JSONB 中的键
+        value_type: 比较时使用的类型, 数字为 numeric, 字符串为 text
+    """
+    _check_identifier(column)
+    _check_identifier(key)
+    cursor.execute(f"""
+    CREATE INDEX IF NOT EXISTS idx_{table_name}_{column}_{key} ON {table_name}
+    ({json_key_sql(column, key, value_type)});
+    """)
@@ -0,0 +1,256 @@
+# 检索耗时与执行计划的监控
+#
+# 慢查询通常是因为没有用上索引 (度量与操作符类不一致、ORDER BY 写法无法走索引) 而退化为顺序扫描。
+# SearchClient(instrumentation=Instrumentation(...)) 打开后, 每次检索记录客户端各阶段的耗时:
+#   connect  从连接池借出连接 (含健康检查和首次初始化)
+#   execute  发送查询到收到全部结果 (psycopg2 在 execute 中接收结果)
+#   fetch    fetchall 把结果转换为 Python 对象
+#   decode   检索之后的后处理, 例如按 id 取回并解码向量
+# 并按 explain_sample_rate 的比例对查询执行 EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON),
+# 计划中出现对被监控表 (含其分区) 的 Seq Scan 时标记 seq_scan。ANALYZE 会把查询再执行一次, 比例不宜过高。
+#
+# 每次检索生成一个事件字典, 交给所有 sink 的 record(event); 内置两种 sink:
+#   PrometheusTextSink  汇总为计数器和直方图, 以 Prometheus 文本格式写入文件 (node_exporter textfile collector)
+#   JsonLogSink         每个事件一行 JSON
+# 任何实现了 record(event) 的对象都可以作为 sink。
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+# 各阶段耗时直方图的分桶上限 (秒)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def plan_nodes(plan):
+    """按深度优先顺序遍历 EXPLAIN (FORMAT JSON) 计划中的全部节点"""
+    if isinstance(plan, list):
+        for item in plan:
+            yield from plan_nodes(item)
+        return
+    node = plan.get("Plan", plan)
+    yield node
+    for child in node.get("Plans", []):
+        yield from plan_nodes(child)
+
+
+def _matches(relation, tables):
+    # 分区名为 {表名}_{后缀}
+    return any(relation == table or relation.startswith(f"{table}_") for table in tables)
+
+
+def seq_scans(plan, tables):
+    """计划中对 tables (含其分区) 做 Seq Scan 的关系名"""
+    return [node["Relation Name"] for node in plan_nodes(plan)
+            if node.get("Node Type") == "Seq Scan" and _matches(node.get("Relation Name", ""), tables)]
+
+
+def used_indexes(plan):
+    """计划中使用的索引名"""
+    return [node["Index Name"] for node in plan_nodes(plan) if "Index Name" in node]
+
+
+class Instrumentation:
+    """
+    检索监控配置
+
+    参数:
+        sinks: 接收事件的对象列表, 每个对象实现 record(event)
+        explain_sample_rate: 执行 EXPLAIN (ANALYZE, BUFFERS) 的查询比例, 0 表示不执行, 1 表示每个查询都执行
+        tables: 需要检查 Seq Scan 的表名, None 表示检查查询所针对的表
+        include_plan: 事件中是否附带完整的 JSON 计划
+    """
+
+    def __init__(self, sinks=(), explain_sample_rate=0.0, tables=None, include_plan=False):
+        self.sinks = list(sinks)
+        self.explain_sample_rate = explain_sample_rate
+        self.tables = tables
+        self.include_plan = include_plan
+
+    def trace(self, name, table_name=None):
+        """开始记录一次检索"""
+        return QueryTrace(self, name, table_name)
+
+    def emit(self, event):
+        for sink in self.sinks:
+            sink.record(event)
+
+
+class QueryTrace:
+    """
+    一次检索的记录, 依次调用 mark(阶段名) 记录从上一次 mark 到现在的耗时, 最后调用 finish()
+
+    参数:
+        instrumentation: Instrumentation, None 时所有方法都不做任何事
+        name: 检索名称, 作为指标的标签
+        table_name: 查询针对的表
+    """
+
+    def __init__(self, instrumentation, name, table_name=None):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.table_name = table_name
+        self.timings = {}
+        self.plan = None
+        self.explained = False
+        self._start = self._last = time.perf_counter()
+
+    def mark(self, phase):
+        if self.instrumentation is None:
+            return
+        now = time.perf_counter()
+        self.timings[phase] = self.timings.get(phase, 0.0) + now - self._last
+        self._last = now
+
+    def should_explain(self):
+        return (self.instrumentation is not None and not self.explained
+                and random.random() < self.instrumentation.explain_sample_rate)
+
+    def set_plan(self, plan):
+        if self.instrumentation is None:
+            return
+        self.plan = plan
+        self.explained = True
+        # EXPLAIN 的耗时不计入任何阶段
+        self._last = time.perf_counter()
+
+    def finish(self, rows=None, error=None):
+        """生成事件并交给所有 sink"""
+        if self.instrumentation is None:
+            return None
+        event = {
+            "name": self.name,
+            "table": self.table_name,
+            "timestamp": time.time(),
+            "total_seconds": time.perf_counter() - self._start,
+            "timings": self.timings,
+            "rows": rows,
+            "error": None if error is None else type(error).__name__,
+        }
+        if self.plan is not None:
+            tables = self.instrumentation.tables or [self.table_name]
+            top = self.plan[0] if isinstance(self.plan, list) else self.plan
+            event["explain"] = {
+                "execution_ms": top.get("Execution Time"),
+                "planning_ms": top.get("Planning Time"),
+                "seq_scans": seq_scans(self.plan, tables),
+                "indexes": used_indexes(self.plan),
+            }
+            event["seq_scan"] = bool(event["explain"]["seq_scans"])
+            if self.instrumentation.include_plan:
+                event["plan"] = self.plan
+        self.instrumentation.emit(event)
+        return event
+
+
+# 没有配置监控时使用, 所有方法都不做任何事
+NULL_TRACE = QueryTrace(None, None)
+
+
+class JsonLogSink:
+    """
+    每个事件写一行 JSON
+
+    参数:
+        path: 日志文件路径, None 表示写到标准错误
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def record(self, event):
+        line = json.dumps(event, ensure_ascii=False, default=str)
+        with self._lock:
+            if self.path is None:
+                print(line, file=sys.stderr)
+            else:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+
+
+class PrometheusTextSink:
+    """
+    把事件汇总为 Prometheus 指标, 以文本格式写入文件
+
+    指标:
+        search_queries_total{search}                   检索次数
+        search_errors_total{search}                    失败次数
+        search_phase_seconds{search,phase}             各阶段耗时直方图
+        search_explain_total{search}                   执行了 EXPLAIN 的次数
+        search_seq_scan_total{search}                  EXPLAIN 中出现 Seq Scan 的次数
+
+    参数:
+        path: 输出文件, 先写临时文件再改名, 采集方不会读到写了一半的文件
+        flush_interval: 两次写文件的最短间隔 (秒), 0 表示每个事件都写
+    """
+
+    def __init__(self, path, flush_interval=5.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._counters = {}  # (指标名, 标签元组) -> 值
+        self._histograms = {}  # (search, phase) -> [各分桶计数, 总和, 总数]
+        self._last_flush = 0.0
+        self._lock = threading.Lock()
+
+    def _increment(self, metric, labels, value=1):
+        key = (metric, labels)
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def record(self, event):
+        search = event["name"]
+        with self._lock:
+            self._increment("search_queries_total", (("search", search),))
+            if event.get("error"):
+                self._increment("search_errors_total", (("search", search),))
+            if "explain" in event:
+                self._increment("search_explain_total", (("search", search),))
+                if event["seq_scan"]:
+                    self._increment("search_seq_scan_total", (("search", search),))
+            for phase, seconds in list(event["timings"].items()) + [("total", event["total_seconds"])]:
+                histogram = self._histograms.setdefault((search, phase), [[0] * len(LATENCY_BUCKETS), 0.0, 0])
+                for i, bound in enumerate(LATENCY_BUCKETS):
+                    if seconds <= bound:
+                        histogram[0][i] += 1
+                histogram[1] += seconds
+                histogram[2] += 1
+            if time.monotonic() - self._last_flush >= self.flush_interval:
+                self._write()
+
+    def flush(self):
+        """立即写文件"""
+        with self._lock:
+            self._write()
+
+    def render(self):
+        """当前指标的 Prometheus 文本格式"""
+        lines = []
+        types = {}
+        for (metric, labels), value in sorted(self._counters.items()):
+            if metric not in types:
+                types[metric] = True
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{_labels(labels)} {value}")
+        if self._histograms:
+            lines.append("# TYPE search_phase_seconds histogram")
+        for (search, phase), (buckets, total, count) in sorted(self._histograms.items()):
+            labels = (("search", search), ("phase", phase))
+            for bound, bucket_count in zip(LATENCY_BUCKETS, buckets):
+                lines.append(f"search_phase_seconds_bucket{_labels(labels + (('le', bound),))} {bucket_count}")
+            lines.append(f"search_phase_seconds_bucket{_labels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"search_phase_seconds_sum{_labels(labels)} {total}")
+            lines.append(f"search_phase_seconds_count{_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def _write(self):
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(temporary, self.path)
+        self._last_flush = time.monotonic()
+
+
+def _labels(labels):
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
@@ -0,0 +1,327 @@
+# 多个 PostgreSQL 分片上的分散-汇总 (scatter-gather) 检索
+#
+# summary_aug_keywords 按 package_id 的哈希分布到 N 个 PostgreSQL 实例, 每个分片的表结构和索引与单机完全相同,
+# 单个实例只需容纳 1/N 的向量和索引。写入时按 shard_index(package_id) 路由到对应分片 (导入、增量更新、
+# ingest_pipeline 都支持); 检索时在所有分片上并行执行, 再由客户端合并:
+#   fusion=None       每个分片按综合得分返回自己的 top_k, 各分片的列表用堆归并取全局 top_k
+#   weighted / rrf    每个分片返回各字段召回的候选及其原始得分 (hybrid_query.build_candidate_query),
+#                     客户端按原始得分对每个字段做堆归并, 取全局前 candidate_k 个候选并计算全局名次,
+#                     再在全局候选上做融合, 用堆取 top_k
+# 各分片自己的名次不能直接比较 (分片 A 的第 1 名可能不如分片 B 的第 10 名), RRF 必须使用全局名次。
+# 原始得分可以跨分片比较: 向量得分只取决于两个向量, ts_rank 只取决于文档本身和查询, 都不使用全表统计;
+# 因此合并后的结果与把全部数据放在一个实例上检索相同 (近似索引本身的误差除外)。
+# pg_search 的 BM25 使用分片内的 IDF, 分片之间不可比较, 不在这里使用。
+#
+# 本地测试: docker-compose --profile shards up -d 启动三个分片容器 (端口 5433 ~ 5435), 然后运行
+#   python sharded_search.py
+# 对比单机与分片检索的结果重合度和延迟。
+import hashlib
+import heapq
+import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from binary_copy import PACKAGE_COLUMNS, copy_documents
+from demo_2vec_2txt import (DB_CONFIG, FIELD_WEIGHT_PARAMS, SEARCH_PARAM_TYPES, _execute_search,
+                            build_vector_indexes, fetch_documents, fetch_embeddings, index_statements, print_results,
+                            projection_columns, search_fields, search_sql, setup_database)
+from hybrid_query import RRF_K, build_candidate_query
+from search_client import SearchClient
+from search_filter import build_filter
+from upsert import upsert_documents
+from vector_index import l2_normalize
+
+# docker-compose.yml 中 shards profile 的三个分片
+SHARD_CONFIGS = [{**DB_CONFIG, "port": port} for port in (5433, 5434, 5435)]
+
+
+def shard_index(package_id, shard_count):
+    """
+    package_id 所在的分片
+
+    使用 blake2b 而不是受 PYTHONHASHSEED 影响的 hash(), 任何进程中结果都相同。
+    按取模分布, 改变分片数需要重新导入全部数据。
+    """
+    digest = hashlib.blake2b(package_id.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % shard_count
+
+
+class ShardedClient:
+    """
+    持有每个分片的 SearchClient, 以及在各分片上并行执行的线程池
+
+    参数:
+        shard_configs: 各分片的数据库连接配置, 顺序决定分片编号, 写入和检索时必须一致
+        client_options: 传给每个分片 SearchClient 的其余参数 (maxconn、statement_timeout_ms 等)
+    """
+
+    def __init__(self, shard_configs=SHARD_CONFIGS, **client_options):
+        self.shards = [SearchClient(config, **client_options) for config in shard_configs]
+        self._executor = ThreadPoolExecutor(len(self.shards), thread_name_prefix="shard")
+
+    def shard_for(self, package_id):
+        return shard_index(package_id, len(self.shards))
+
+    def map(self, function, *per_shard_args):
+        """
+        在所有分片上并行执行 function(分片的 SearchClient, *该分片的参数), 按分片顺序返回结果
+
+        per_shard_args 中每一项是长度等于分片数的列表; 任一分片失败时抛出该异常
+        """
+        futures = [self._executor.submit(function, shard, *(args[i] for args in per_shard_args))
+                   for i, shard in enumerate(self.shards)]
+        return [future.result() for future in futures]
+
+    def split(self, documents):
+        """把一批文档按 package_id 分到各分片"""
+        groups = [[] for _ in self.shards]
+        for doc in documents:
+            groups[self.shard_for(doc["package_id"])].append(doc)
+        return groups
+
+    def close(self):
+        self._executor.shutdown()
+        for shard in self.shards:
+            shard.close()
+
+
+def setup_shards(sharded, table_name="summary_aug_keywords", indexes=True):
+    """在每个分片上建表, 参数与 setup_database 相同"""
+    sharded.map(lambda shard: setup_database(table_name, indexes=indexes, search_client=shard))
+
+
+def build_shard_indexes(sharded, table_name="summary_aug_keywords", metric="cosine", method="hnsw"):
+    """导入之后在每个分片上并行创建全部索引并 ANALYZE"""
+    def build(shard):
+        with shard.cursor() as cursor:
+            for statement in index_statements(table_name):
+                cursor.execute(statement)
+        build_vector_indexes(table_name, metric, method, search_client=shard)
+        with shard.cursor() as cursor:
+            cursor.execute(f"ANALYZE {table_name}")
+
+    sharded.map(build)
+
+
+def copy_sharded(sharded, documents, table_name="summary_aug_keywords", columns=PACKAGE_COLUMNS, batch_size=10000,
+                 normalize=False):
+    """
+    按 package_id 路由, 以二进制 COPY 导入各分片; 每次读取 batch_size * 分片数 个文档, 各分片并行写入
+
+    参数与 binary_copy.copy_documents 相同, 返回各分片导入的行数
+    """
+    def load(shard, group):
+        with shard.connection() as conn:
+            return copy_documents(conn, group, table_name, columns, normalize=normalize)
+
+    documents = iter(documents)
+    totals = [0] * len(sharded.shards)
+    while True:
+        chunk = list(itertools.islice(documents, batch_size * len(sharded.shards)))
+        if not chunk:
+            break
+        for i, count in enumerate(sharded.map(load, sharded.split(chunk))):
+            totals[i] += count
+    return totals
+
+
+def upsert_sharded(sharded, documents, table_name="summary_aug_keywords", batch_size=10000, normalize=False):
+    """
+    按 package_id 路由的增量更新 (见 upsert.upsert_documents), 返回合计的行数统计
+    """
+    def upsert(shard, group):
+        with shard.connection() as conn:
+            return upsert_documents(conn, group, table_name, batch_size=batch_size, normalize=normalize)
+
+    documents = iter(documents)
+    stats = {"staged": 0, "inserted": 0, "updated": 0, "unchanged": 0}
+    while True:
+        chunk = list(itertools.islice(documents, batch_size * len(sharded.shards)))
+        if not chunk:
+            break
+        for shard_stats in sharded.map(upsert, sharded.split(chunk)):
+            for name, count in shard_stats.items():
+                stats[name] += count
+    return stats
+
+
+def _merge_fused(shard_rows, weights, fusion, candidate_k, top_k):
+    """
+    按全局名次融合各分片的候选
+
+    shard_rows[i] 为分片 i 上 build_candidate_query 的结果: id, package_id, 各字段名次, 各字段原始得分。
+    返回 [(分片编号, 结果行)], 结果行为 id, package_id, combined_score, 各字段得分 (与 hybrid_search 一致)
+    """
+    n_fields = len(weights)
+    global_ranks = {}  # (分片编号, id) -> 各字段的全局名次
+    rows = {}
+    for j in range(n_fields):
+        rank_column, score_column = 2 + j, 2 + n_fields + j
+        # 每个分片内按名次排序, 即按原始得分从高到低; 多路归并后取全局前 candidate_k 个
+        per_shard = [
+            sorted(((shard, row) for row in shard_result if row[rank_column] is not None),
+                   key=lambda item: item[1][rank_column])
+            for shard, shard_result in enumerate(shard_rows)
+        ]
+        merged = heapq.merge(*per_shard, key=lambda item: item[1][score_column], reverse=True)
+        for rank, (shard, row) in enumerate(itertools.islice(merged, candidate_k), start=1):
+            key = (shard, row[0])
+            global_ranks.setdefault(key, [None] * n_fields)[j] = rank
+            rows[key] = row
+
+    def combined(key):
+        if fusion == "rrf":
+            return sum(weight / (RRF_K + rank) for weight, rank in zip(weights, global_ranks[key]) if rank is not None)
+        scores = rows[key][2 + n_fields:]
+        return sum(weight * (score or 0.0) for weight, score in zip(weights, scores))
+
+    top = heapq.nlargest(top_k, ((combined(key), key) for key in global_ranks))
+    return [(key[0], (rows[key][0], rows[key][1], score, *rows[key][2 + n_fields:])) for score, key in top]
+
+
+def _merge_scored(shard_rows, top_k):
+    """各分片按综合得分排好序的 top_k 做多路归并, 取全局 top_k"""
+    merged = heapq.merge(*([(shard, row) for row in rows] for shard, rows in enumerate(shard_rows)),
+                         key=lambda item: item[1][2], reverse=True)
+    return list(itertools.islice(merged, top_k))
+
+
+def sharded_hybrid_search(sharded, weight_summary_vector, query_summary_vector,
+                          weight_keywords_vector, query_keywords_vector,
+                          weight_summary_text, query_summary_text,
+                          weight_keywords_text, query_keywords_text, top_k=5, table_name="summary_aug_keywords",
+                          fusion="weighted", candidate_k=100, metric="cosine", ef_search=None, probes=None,
+                          quantization=None, filters=None, iterative_scan="relaxed_order", projection="ids",
+                          verbose=True):
+    """
+    在所有分片上并行执行混合检索并合并结果
+
+    参数与 demo_2vec_2txt.hybrid_search 相同; 结果行格式也相同, 其中 id 是所在分片内的 id,
+    跨分片唯一的是 package_id (所在分片为 sharded.shard_for(package_id))
+    """
+    if metric == "ip":
+        query_summary_vector = l2_normalize(query_summary_vector)
+        query_keywords_vector = l2_normalize(query_keywords_vector)
+    params = {
+        "weight_summary_vector": weight_summary_vector,
+        "query_summary_vector": query_summary_vector,
+        "weight_keywords_vector": weight_keywords_vector,
+        "query_keywords_vector": query_keywords_vector,
+        "weight_summary_text": weight_summary_text,
+        "query_summary_text": query_summary_text,
+        "weight_keywords_text": weight_keywords_text,
+        "query_keywords_text": query_keywords_text,
+        "candidate_k": candidate_k,
+        "top_k": top_k,
+    }
+    where, filter_params, filter_types = build_filter(filters)
+    params.update(filter_params)
+    # 权重为 0 的字段不召回也不打分
+    fields = search_fields(metric, quantization, params)
+    if fusion is None:
+        sql = search_sql(table_name, None, metric, where=where)
+    else:
+        sql = build_candidate_query(table_name, ["id", "package_id"], fields, where=where)
+
+    def search(shard):
+        return _execute_search(sql, params, True, table_name=table_name, metric=metric, ef_search=ef_search,
+                               probes=probes, quantization=quantization,
+                               types={**SEARCH_PARAM_TYPES, **filter_types},
+                               iterative_scan=iterative_scan if where else None, search_client=shard)
+
+    shard_rows = sharded.map(search)
+    if fusion is None:
+        merged = _merge_scored(shard_rows, top_k)
+    else:
+        merged = _merge_fused(shard_rows, [params[FIELD_WEIGHT_PARAMS[field["name"]]] for field in fields], fusion,
+                              candidate_k, top_k)
+        # 与 hybrid_search 一致, 没有参与的字段得分为 None
+        active = [field["name"] for field in fields]
+        merged = [
+            (shard, row[:3] + tuple(dict(zip(active, row[3:])).get(name) for name in FIELD_WEIGHT_PARAMS))
+            for shard, row in merged
+        ]
+
+    results = _attach_columns(sharded, merged, table_name, projection)
+    if verbose:
+        print_results(results)
+    return results
+
+
+def _attach_columns(sharded, merged, table_name, projection):
+    """从各结果所在的分片取回投影中的文本列和向量列"""
+    text_columns, embedding_columns = projection_columns(projection)
+    if not text_columns and not embedding_columns:
+        return [row for _, row in merged]
+
+    def fetch(shard, ids):
+        texts = fetch_documents(ids, text_columns, table_name, search_client=shard) if text_columns else {}
+        embeddings = fetch_embeddings(ids, embedding_columns, table_name, search_client=shard) \
+            if embedding_columns else {}
+        return texts, embeddings
+
+    ids = [[row[0] for shard, row in merged if shard == i] for i in range(len(sharded.shards))]
+    fetched = sharded.map(fetch, ids)
+    missing_texts, missing_embeddings = (None,) * len(text_columns), (None,) * len(embedding_columns)
+    results = []
+    for shard, row in merged:
+        texts, embeddings = fetched[shard]
+        results.append(tuple(row) + (tuple(texts.get(row[0], missing_texts)) if text_columns else ())
+                       + (tuple(embeddings.get(row[0], missing_embeddings)) if embedding_columns else ()))
+    return results
+
+
+def benchmark_sharded(n=100000, n_queries=50, top_k=10, fusion="rrf", shard_configs=SHARD_CONFIGS,
+                      table_name="summary_aug_keywords"):
+    """
+    同一语料分别导入单机和各分片, 对比检索结果的重合度 (overlap@k) 和延迟
+
+    近似向量索引在不同数据量上的召回略有差异, 重合度接近但不一定为 100%;
+    精确检索 (fusion=None 的全表打分) 时两者应完全一致。
+    """
+    from benchmark import build_indexes, latency_stats, load_corpus, make_queries
+    from demo_2vec_2txt import hybrid_search
+    from synthetic_data import generate_packages
+    from upsert import UPSERT_COLUMNS, with_content_hash
+
+    load_corpus(n, table_name)
+    build_indexes(table_name)
+
+    sharded = ShardedClient(shard_configs)
+    setup_shards(sharded, table_name, indexes=False)
+    counts = copy_sharded(sharded, with_content_hash(generate_packages(n)), table_name, columns=UPSERT_COLUMNS)
+    build_shard_indexes(sharded, table_name)
+
+    queries = make_queries(n_queries)
+    single_latencies, sharded_latencies, overlaps = [], [], []
+    for query in queries:
+        start = time.perf_counter()
+        single = hybrid_search(*query, top_k=top_k, table_name=table_name, fusion=fusion, verbose=False)
+        single_latencies.append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        merged = sharded_hybrid_search(sharded, *query, top_k=top_k, table_name=table_name, fusion=fusion,
+                                       verbose=False)
+        sharded_latencies.append((time.perf_counter() - start) * 1000)
+        expected = {row[1] for row in single}
+        overlaps.append(len(expected & {row[1] for row in merged}) / max(1, len(expected)))
+    sharded.close()
+
+    report = {
+        "shard_rows": counts,
+        "single": latency_stats(single_latencies),
+        "sharded": latency_stats(sharded_latencies),
+        "overlap": float(np.mean(overlaps)),
+    }
+    print(f"\n单机与 {len(counts)} 个分片的检索对比 ({n} 行, 各分片 {counts}, {n_queries} 个查询, fusion={fusion}):")
+    print("=" * 80)
+    for name in ("single", "sharded"):
+        stats = report[name]
+        print(f"{name:>8}: p50 {stats['p50_ms']:.2f} ms, p95 {stats['p95_ms']:.2f} ms, p99 {stats['p99_ms']:.2f} ms")
+    print(f"结果重合度 overlap@{top_k}: {report['overlap']:.1%}")
+    return report
+
+
+if __name__ == "__main__":
+    benchmark_sharded()
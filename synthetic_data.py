@@ -0,0 +1,118 @@
+# 合成数据生成器, 生成与 summary_aug_keywords 表结构一致的软件包数据, 用于导入和检索的性能测试
+import numpy as np
+
+ECOSYSTEMS = ["npm", "pypi", "maven", "cargo", "go", "nuget", "rubygems", "packagist"]
+
+# 摘要和关键词的词表
+VOCABULARY = (
+    "array async buffer cache client cli clone color config convert copy date debug deep decode "
+    "docker domain emoji encode event express file flatten format http image json lint log markdown "
+    "math merge middleware mock network object parse parser path plugin promise proxy queue react "
+    "render request retry router schema server shell sort stream string template test time token "
+    "type unicode url util validate version watch web worker yaml zip"
+).split()
+
+
+# 中文文档的词表, 与英文词表一起构成中英混合语料
+CJK_VOCABULARY = (
+    "人工智能 机器学习 深度学习 神经网络 数据库 索引 向量 检索 全文 分词 查询 优化 缓存 并发 事务 "
+    "分布式 存储 压缩 加密 网络 协议 服务器 客户端 框架 组件 插件 配置 日志 监控 测试 部署 容器 "
+    "编译器 解析器 序列化 异步 线程 进程 内存 性能 算法 排序 哈希 图像 语音 文本 翻译 推荐 搜索 "
+    "开源 社区 文档 接口 模型 训练 推理 数据 流处理 调度"
+).split()
+
+
+def generate_documents(n, dim=384, seed=0, cjk_ratio=0.5):
+    """
+    生成 n 条中英混合的合成文档, 与 demo.py / demo_bm25.py 的 documents 表结构一致 (生成器)
+
+    中文文档的正文和标题像真实中文一样词与词之间没有空格, 并夹杂少量英文词。
+
+    参数:
+        n: 数据条数
+        dim: 向量维度
+        seed: 随机种子
+        cjk_ratio: 中文文档所占比例
+    """
+    rng = np.random.default_rng(seed)
+    vocabulary = np.array(VOCABULARY)
+    cjk_vocabulary = np.array(CJK_VOCABULARY)
+    for i in range(n):
+        if rng.random() < cjk_ratio:
+            title = "".join(rng.choice(cjk_vocabulary, size=3))
+            content = "，".join("".join(rng.choice(cjk_vocabulary, size=6)) + " " + rng.choice(vocabulary)
+                               for _ in range(8)) + "。"
+            language = "zh"
+        else:
+            title = " ".join(rng.choice(vocabulary, size=3))
+            content = "The library " + " ".join(rng.choice(vocabulary, size=60)) + "."
+            language = "en"
+        yield {
+            "title": title,
+            "content": content,
+            "metadata": {"category": ECOSYSTEMS[i % len(ECOSYSTEMS)], "language": language},
+            "embedding": rng.standard_normal(dim, dtype=np.float32),
+        }
+
+
+# 主题中心的随机种子与数据的 seed 无关: 不同 seed 生成的数据 (例如查询) 与语料共享同一组主题
+TOPIC_SEED = 20240601
+
+
+def topic_model(topics=100, dim=768, words_per_topic=8):
+    """
+    生成主题: 每个主题有一个向量中心和一组常用词
+
+    返回 (中心矩阵 topics x dim, 每个主题的词下标矩阵 topics x words_per_topic)
+    """
+    rng = np.random.default_rng(TOPIC_SEED)
+    centers = rng.standard_normal((topics, dim), dtype=np.float32)
+    words = np.stack([rng.choice(len(VOCABULARY), size=words_per_topic, replace=False) for _ in range(topics)])
+    return centers, words
+
+
+def generate_packages(n, dim=768, seed=0, topics=100, spread=1.0):
+    """
+    按顺序生成 n 条合成软件包数据 (生成器, 内存占用与 n 无关)
+
+    每条数据属于一个主题: 摘要和关键词偏向该主题的常用词, 向量为主题中心加高斯噪声。
+    与各维独立的随机向量不同, 这样的数据有聚类结构, 近似索引的召回率和延迟更接近真实 embedding。
+
+    参数:
+        n: 数据条数
+        dim: 向量维度
+        seed: 随机种子, 相同的参数总是生成相同的数据
+        topics: 主题数, 0 表示不使用主题 (向量各维独立)
+        spread: 噪声相对于主题中心的标准差, 越大聚类越松散
+    """
+    rng = np.random.default_rng(seed)
+    vocabulary = np.array(VOCABULARY)
+    if topics:
+        centers, topic_words = topic_model(topics, dim)
+    for i in range(n):
+        ecosystem = ECOSYSTEMS[i % len(ECOSYSTEMS)]
+        if topics:
+            topic = rng.integers(topics)
+            common = vocabulary[topic_words[topic]]
+            # 摘要中约三分之一是主题词
+            words = np.where(rng.random(150) < 1 / 3, rng.choice(common, size=150), rng.choice(vocabulary, size=150))
+            keywords = sorted(set(rng.choice(common, size=5)) | set(rng.choice(vocabulary, size=3)))
+            summary_embedding = centers[topic] + spread * rng.standard_normal(dim, dtype=np.float32)
+            keywords_embedding = centers[topic] + spread * rng.standard_normal(dim, dtype=np.float32)
+        else:
+            words = rng.choice(vocabulary, size=150)
+            keywords = sorted(set(rng.choice(vocabulary, size=8)))
+            # 以 0 为中心的向量, 与真实 embedding 一样各维有正有负 (binary_quantize 按符号取位)
+            summary_embedding = rng.standard_normal(dim, dtype=np.float32)
+            keywords_embedding = rng.standard_normal(dim, dtype=np.float32)
+        package_name = f"{keywords[0]}-{keywords[-1]}-{i}"
+        yield {
+            "package_id": f"{package_name}@@@@$$@@@@{ecosystem}",
+            "package_name": package_name,
+            "ecosystem": ecosystem,
+            # 约 1KB 的摘要
+            "summary": "The library " + " ".join(words) + ".",
+            "augmented_keywords": " ".join(keywords) + f" {package_name}",
+            "summary_embedding": summary_embedding,
+            "keywords_embedding": keywords_embedding,
+        }
@@ -0,0 +1,104 @@
+# 影子表重新导入与原子切换
+#
+# setup_database 先 DROP TABLE 再重建, 导入和建索引期间线上没有数据可查。重新导入改为:
+#   1. 创建不带索引的影子表 {table}_shadow, 二进制 COPY 导入全部数据
+#   2. 在完整数据上一次性构建全部索引, 多个索引在不同连接上并行构建
+#   3. ANALYZE, 再用 pg_prewarm 把表和索引读入 shared_buffers, 切换后的第一批查询不用冷读磁盘
+#   4. 在一个事务中把线上表改名为 {table}_old、影子表改名为线上表 (分区、索引、序列一并改名), 提交后删除旧表
+# 改名只需要很短的 ACCESS EXCLUSIVE 锁, 查询看到的要么是旧表要么是新表, 没有空窗。
+# 设置 lock_timeout 后获取不到锁时放弃并重试, 避免排队的改名操作把后续查询也挡住。
+import time
+
+import psycopg2
+import psycopg2.errors
+
+from result_cache import invalidate_table
+from vector_index import forget_vector_indexes
+
+# 关系类型 -> 改名使用的 ALTER 语句
+_ALTER = {"r": "TABLE", "p": "TABLE", "i": "INDEX", "I": "INDEX", "S": "SEQUENCE"}
+
+
+def owned_relations(cursor, table_name):
+    """
+    表及其附属的全部关系: 分区、索引 (含各分区上的索引)、SERIAL 序列
+
+    返回 [(关系名, relkind)]
+    """
+    cursor.execute("""
+    WITH RECURSIVE tables AS (
+        SELECT %s::regclass::oid AS oid
+        UNION ALL
+        SELECT i.inhrelid FROM pg_inherits i JOIN tables t ON i.inhparent = t.oid
+    )
+    SELECT c.relname, c.relkind FROM tables t JOIN pg_class c ON c.oid = t.oid
+    UNION ALL
+    SELECT c.relname, c.relkind FROM pg_index x JOIN tables t ON x.indrelid = t.oid JOIN pg_class c ON c.oid = x.indexrelid
+    UNION ALL
+    SELECT c.relname, c.relkind FROM pg_depend d JOIN tables t ON d.refobjid = t.oid JOIN pg_class c ON c.oid = d.objid
+    WHERE d.classid = 'pg_class'::regclass AND c.relkind = 'S'
+    """, (table_name,))
+    return cursor.fetchall()
+
+
+def table_exists(cursor, table_name):
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (table_name,))
+    return cursor.fetchone()[0]
+
+
+def rename_table(cursor, table_name, new_name):
+    """把表及其附属关系名中的 table_name 替换为 new_name"""
+    for relname, relkind in owned_relations(cursor, table_name):
+        if table_name in relname:
+            cursor.execute(f"ALTER {_ALTER[relkind]} {relname} RENAME TO {relname.replace(table_name, new_name, 1)}")
+
+
+def prewarm(cursor, table_name):
+    """用 pg_prewarm 把表和索引读入 shared_buffers, 返回读入的块数"""
+    cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_prewarm")
+    blocks = 0
+    for relname, relkind in owned_relations(cursor, table_name):
+        # 分区表的父表和父索引没有存储
+        if relkind in ("r", "i"):
+            cursor.execute("SELECT pg_prewarm(%s::regclass)", (relname,))
+            blocks += cursor.fetchone()[0]
+    return blocks
+
+
+def swap_tables(conn, table_name, shadow_name, lock_timeout="5s", retries=10):
+    """
+    原子地用影子表替换线上表, 然后删除旧表
+
+    参数:
+        conn: 数据库连接, 调用前不能有未提交的事务
+        table_name: 线上表名
+        shadow_name: 影子表名
+        lock_timeout: 等待线上表锁的最长时间, 超时后回滚并重试
+        retries: 最多尝试次数
+    """
+    old_name = f"{table_name}_old"
+    for attempt in range(retries):
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT set_config('lock_timeout', %s, true)", (lock_timeout,))
+                if table_exists(cursor, old_name):
+                    cursor.execute(f"DROP TABLE {old_name}")
+                if table_exists(cursor, table_name):
+                    rename_table(cursor, table_name, old_name)
+                rename_table(cursor, shadow_name, table_name)
+            conn.commit()
+            invalidate_table(table_name)
+            # 表名现在指向影子表, 它的向量索引需要重新检查
+            with conn.cursor() as cursor:
+                forget_vector_indexes(cursor, table_name)
+            break
+        except psycopg2.errors.LockNotAvailable:
+            conn.rollback()
+            time.sleep(min(2 ** attempt * 0.1, 5))
+    else:
+        raise TimeoutError(f"{retries} 次尝试后仍无法获取 {table_name} 的锁, 影子表 {shadow_name} 保留未切换")
+
+    # 旧表已经不再被引用, 删除时等待仍在读旧表的查询结束即可
+    with conn.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {old_name}")
+    conn.commit()
@@ -0,0 +1,202 @@
+# 按 package_id 增量更新
+#
+# 每日刷新只有少量包的摘要/关键词/向量发生变化, 全量重新导入会重写整张表和全部索引。
+# 这里为每行计算内容哈希 (content_hash 列), 新数据先以二进制 COPY 写入临时表 (临时表不写 WAL),
+# 再用 INSERT ... SELECT ... ON CONFLICT DO UPDATE 合并到目标表。哈希与目标表相同的行在 SELECT 中
+# 就被 NOT EXISTS 过滤掉: ON CONFLICT 会先给冲突行加行锁 (写 xmax 并产生 WAL), DO UPDATE 的 WHERE
+# 条件只能避免新的元组版本, 不能避免加锁。内容未变化的行不加锁, 不插入索引项 (HNSW 插入代价很高),
+# 也不写 WAL, 刷新的 I/O 和 WAL 与变化的行数成正比, 而不是与表的大小成正比。
+import hashlib
+import itertools
+import struct
+import time
+
+import numpy as np
+
+from binary_copy import PACKAGE_COLUMNS, copy_rows, document_converter
+from result_cache import invalidate_table
+from vector_index import table_partitions
+
+# 参与内容哈希的字段
+HASHED_COLUMNS = ["package_name", "ecosystem", "summary", "augmented_keywords",
+                  "summary_embedding", "keywords_embedding"]
+
+# 增量更新导入的列: PACKAGE_COLUMNS 加上内容哈希
+UPSERT_COLUMNS = PACKAGE_COLUMNS + [("content_hash", "text")]
+
+STAGING_TABLE = "upsert_staging"
+
+
+def content_hash(doc):
+    """
+    文档内容的哈希, 文本按 UTF-8、向量按 float32 字节计算
+
+    每个字段前写入类型和长度, 不同字段的内容拼接后不会互相混淆。
+    """
+    digest = hashlib.sha1()
+    for name in HASHED_COLUMNS:
+        value = doc.get(name)
+        if value is None:
+            digest.update(b"N")
+            continue
+        if isinstance(value, str):
+            data = b"T" + value.encode("utf-8")
+        else:
+            data = b"V" + np.asarray(value, dtype="<f4").tobytes()
+        digest.update(struct.pack("<I", len(data)) + data)
+    return digest.hexdigest()
+
+
+def with_content_hash(documents):
+    """为每个文档字典补上 content_hash"""
+    for doc in documents:
+        yield {**doc, "content_hash": content_hash(doc)}
+
+
+def conflict_columns(cursor, table_name):
+    """ON CONFLICT 的目标列, 分区表的唯一索引必须包含分区键 ecosystem"""
+    return ["package_id", "ecosystem"] if table_partitions(cursor, table_name) else ["package_id"]
+
+
+def upsert_sql(table_name, columns, conflict):
+    """
+    把临时表中的一批行合并到目标表的语句
+
+    同一批中重复的 package_id 只保留最后一行 (ON CONFLICT 不允许一条语句两次更新同一行),
+    之后再过滤掉哈希与目标表相同的行; DO UPDATE 的 WHERE 条件保留, 防止并发写入在两步之间改变了目标行;
+    RETURNING 中 xmax = 0 表示新插入的行, 否则为更新的行, 哈希未变化而跳过的行不会返回。
+    """
+    column_list = ", ".join(columns)
+    key_list = ", ".join(conflict)
+    updates = ", ".join(f"{name} = EXCLUDED.{name}" for name in columns if name not in conflict)
+    matches = " AND ".join(f"t.{name} = s.{name}" for name in conflict)
+    return f"""
+    INSERT INTO {table_name} AS t ({column_list})
+    SELECT {column_list}
+    FROM (
+        SELECT DISTINCT ON ({key_list}) {column_list}
+        FROM {STAGING_TABLE}
+        ORDER BY {key_list}, ord DESC
+    ) s
+    WHERE NOT EXISTS (
+        SELECT 1 FROM {table_name} t
+        WHERE {matches} AND t.content_hash = s.content_hash
+    )
+    ON CONFLICT ({key_list}) DO UPDATE SET {updates}
+    WHERE t.content_hash IS DISTINCT FROM EXCLUDED.content_hash
+    RETURNING (t.xmax = 0) AS inserted
+    """
+
+
+def upsert_documents(conn, documents, table_name="summary_aug_keywords", batch_size=10000, normalize=False):
+    """
+    增量导入文档: 新的 package_id 插入, 内容变化的更新, 内容未变化的跳过
+
+    参数:
+        conn: 数据库连接
+        documents: 文档字典的迭代器/生成器
+        table_name: 表名
+        batch_size: 每批写入临时表并合并的行数, 每批提交一次事务
+        normalize: 是否对向量列做 L2 归一化, 需要与全量导入时一致 (哈希按归一化之前的向量计算)
+
+    返回 {"staged", "inserted", "updated", "unchanged"} 行数统计
+    """
+    names = [name for name, _ in UPSERT_COLUMNS]
+    types = [column_type for _, column_type in UPSERT_COLUMNS]
+    rows = map(document_converter(UPSERT_COLUMNS, normalize), with_content_hash(documents))
+
+    with conn.cursor() as cursor:
+        conflict = conflict_columns(cursor, table_name)
+    sql = upsert_sql(table_name, names, conflict)
+
+    stats = {"staged": 0, "inserted": 0, "updated": 0, "unchanged": 0}
+    while True:
+        with conn.cursor() as cursor:
+            # 临时表只有导入列, 不含生成列和索引; ord 记录行在输入中的顺序
+            cursor.execute(f"""
+            CREATE TEMP TABLE {STAGING_TABLE} ON COMMIT DROP AS
+            SELECT {', '.join(names)} FROM {table_name} WITH NO DATA;
+            ALTER TABLE {STAGING_TABLE} ADD COLUMN ord BIGSERIAL;
+            """)
+            count = copy_rows(cursor, STAGING_TABLE, names, types, itertools.islice(rows, batch_size))
+            if count:
+                cursor.execute(f"SELECT count(DISTINCT ({', '.join(conflict)})) FROM {STAGING_TABLE}")
+                distinct = cursor.fetchone()[0]
+                cursor.execute(sql)
+                results = cursor.fetchall()
+                inserted = sum(1 for (row_inserted,) in results if row_inserted)
+                stats["staged"] += distinct
+                stats["inserted"] += inserted
+                stats["updated"] += len(results) - inserted
+                stats["unchanged"] += distinct - len(results)
+        conn.commit()
+        if count and results:
+            invalidate_table(table_name)
+        if count < batch_size:
+            break
+    return stats
+
+
+def _wal_lsn(cursor):
+    cursor.execute("SELECT pg_current_wal_lsn()")
+    return cursor.fetchone()[0]
+
+
+def _wal_bytes(cursor, start_lsn):
+    cursor.execute("SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), %s)", (start_lsn,))
+    return int(cursor.fetchone()[0])
+
+
+def benchmark_upsert(n=100000, change_ratio=0.03, table_name="summary_aug_keywords"):
+    """
+    对比全量重新导入与增量更新的耗时和 WAL 写入量
+
+    先用 reload_table 全量导入 n 行, 再修改其中 change_ratio 比例的摘要, 把全部 n 行交给 upsert_documents。
+
+    参数:
+        n: 数据行数
+        change_ratio: 内容发生变化的行的比例
+        table_name: 表名
+    """
+    from demo_2vec_2txt import client, reload_table
+    from synthetic_data import generate_packages
+
+    step = max(1, round(1 / change_ratio)) if change_ratio else n + 1
+
+    def refreshed():
+        for i, doc in enumerate(generate_packages(n)):
+            if i % step == 0:
+                doc = {**doc, "summary": doc["summary"] + " (updated)"}
+            yield doc
+
+    report = {}
+    with client.cursor() as cursor:
+        start_lsn = _wal_lsn(cursor)
+    start = time.perf_counter()
+    reload_table(generate_packages(n), table_name, prewarm=False)
+    elapsed = time.perf_counter() - start
+    with client.cursor() as cursor:
+        report["full_reload"] = {"seconds": elapsed, "wal_bytes": _wal_bytes(cursor, start_lsn)}
+
+    with client.cursor() as cursor:
+        start_lsn = _wal_lsn(cursor)
+    start = time.perf_counter()
+    with client.connection() as conn:
+        stats = upsert_documents(conn, refreshed(), table_name)
+    elapsed = time.perf_counter() - start
+    with client.cursor() as cursor:
+        report["upsert"] = {"seconds": elapsed, "wal_bytes": _wal_bytes(cursor, start_lsn), **stats}
+
+    full, incremental = report["full_reload"], report["upsert"]
+    print(f"\n全量重新导入与增量更新对比 ({n} 行, 变化比例 {change_ratio:.1%}, {table_name}):")
+    print("=" * 80)
+    print(f"全量重新导入: {full['seconds']:.2f} 秒, WAL {full['wal_bytes'] / 2 ** 20:,.1f} MB")
+    print(f"    增量更新: {incremental['seconds']:.2f} 秒, WAL {incremental['wal_bytes'] / 2 ** 20:,.1f} MB "
+          f"(插入 {stats['inserted']}, 更新 {stats['updated']}, 跳过 {stats['unchanged']})")
+    print(f"增量更新 / 全量: 耗时 {incremental['seconds'] / full['seconds']:.1%}, "
+          f"WAL {incremental['wal_bytes'] / max(full['wal_bytes'], 1):.1%}")
+    return report
+
+
+if __name__ == "__main__":
+    benchmark_upsert()
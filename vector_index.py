@@ -0,0 +1,330 @@
+# 向量距离度量与向量索引
+#
+# pgvector 的索引只能服务于与其操作符类一致的距离操作符:
+#   vector_l2_ops     <->  (L2 距离)
+#   vector_cosine_ops <=>  (余弦距离)
+#   vector_ip_ops     <#>  (负内积)
+# 索引操作符类和查询操作符都从同一个 metric 推导, 二者不一致时查询只能顺序扫描。
+# 向量在写入时做 L2 归一化后, 余弦相似度等于内积, 可以改用计算更省的 <#>。
+#
+# 向量索引应当在批量导入完成之后再创建: ivfflat 的聚类中心由建索引时表中的数据训练得到,
+# 在空表上创建的索引召回率和速度都会随数据增长而下降; hnsw 在完整数据上一次性构建也远快于逐行维护。
+#
+# 量化索引: 在全精度列上建表达式索引, 索引中只保存 halfvec (每维 2 字节) 或 bit (每维 1 位),
+# 索引体积分别约为原来的 1/2 和 1/32, 更容易常驻 shared_buffers。量化后的距离只用于粗排召回候选,
+# 最终得分仍然用表中的全精度向量计算 (重排)。
+import math
+import re
+import time
+import warnings
+
+import numpy as np
+
+METRICS = {
+    "l2": {
+        "opclass": "vector_l2_ops",
+        "operator": "<->",
+        # 距离越小得分越高, 映射到 (0, 1]
+        "score": "(1 / (1 + ({distance})))",
+    },
+    "cosine": {
+        "opclass": "vector_cosine_ops",
+        "operator": "<=>",
+        "score": "(1 - ({distance}))",
+    },
+    "ip": {
+        "opclass": "vector_ip_ops",
+        "operator": "<#>",
+        # <#> 返回负内积
+        "score": "(-({distance}))",
+    },
+}
+
+QUANTIZATIONS = ("halfvec", "bit")
+
+# 数据库 (连接的 DSN) -> 已确认可以使用索引的 (表, 列, metric, 量化方式);
+# 重建/删除索引、删除或替换表之后由 forget_vector_indexes 清除该表的记录
+_checked = {}
+
+
+def metric_spec(metric):
+    if metric not in METRICS:
+        raise ValueError(f"未知的距离度量: {metric}, 可选: {tuple(METRICS)}")
+    return METRICS[metric]
+
+
+def distance_sql(column, query, metric="cosine"):
+    """ORDER BY 使用的距离表达式, 与索引操作符类一致时可以走索引"""
+    return f"{column} {metric_spec(metric)['operator']} {query}"
+
+
+def score_sql(column, query, metric="cosine"):
+    """相似度得分表达式, 越大越相似"""
+    return metric_spec(metric)["score"].format(distance=distance_sql(column, query, metric))
+
+
+def quantized_sql(expression, quantization, dim=768):
+    """向量表达式的量化形式, 建索引和查询必须使用同一个表达式才能走索引"""
+    if quantization == "halfvec":
+        return f"({expression})::halfvec({dim})"
+    if quantization == "bit":
+        # 每一维按正负取 1 位
+        return f"binary_quantize({expression})::bit({dim})"
+    raise ValueError(f"未知的量化方式: {quantization}, 可选: {QUANTIZATIONS}")
+
+
+def quantized_opclass(quantization, metric="cosine"):
+    """量化表达式索引的操作符类, bit 只支持汉明距离"""
+    if quantization == "bit":
+        return "bit_hamming_ops"
+    if quantization == "halfvec":
+        return metric_spec(metric)["opclass"].replace("vector_", "halfvec_", 1)
+    raise ValueError(f"未知的量化方式: {quantization}, 可选: {QUANTIZATIONS}")
+
+
+def quantized_distance_sql(column, query, quantization, dim=768, metric="cosine"):
+    """粗排使用的量化距离表达式"""
+    operator = "<~>" if quantization == "bit" else metric_spec(metric)["operator"]
+    # 查询参数是未定类型的字面量, 先转成 vector 再量化
+    return f"{quantized_sql(column, quantization, dim)} {operator} {quantized_sql(f'({query})::vector', quantization, dim)}"
+
+
+def l2_normalize(vector):
+    """L2 归一化, 归一化后余弦相似度等于内积"""
+    array = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(array)
+    return array / norm if norm > 0 else array
+
+
+def _expression_quantization(expression):
+    """按表达式索引的键 (pg_get_indexdef 反解析的文本) 判断量化方式, 与 quantized_sql 对应"""
+    if "binary_quantize(" in expression:
+        return "bit"
+    if "halfvec" in expression:
+        return "halfvec"
+    return None
+
+
+def vector_indexes(cursor, table_name, column):
+    """
+    返回列上的向量索引 [(索引名, 访问方法, 操作符类, 量化方式)]
+
+    直接建在列上的索引量化方式为 None; 量化表达式索引 (build_vector_index 的 quantization) 的键不是列,
+    indkey[0] 为 0, 按 pg_get_indexdef 反解析的表达式判断它引用的列和量化方式。
+    """
+    cursor.execute("""
+    SELECT i.relname, am.amname, opc.opcname, a.attname, pg_get_indexdef(x.indexrelid, 1, true)
+    FROM pg_index x
+    JOIN pg_class i ON i.oid = x.indexrelid
+    JOIN pg_am am ON am.oid = i.relam
+    JOIN pg_opclass opc ON opc.oid = x.indclass[0]
+    LEFT JOIN pg_attribute a ON a.attrelid = x.indrelid AND a.attnum = x.indkey[0] AND x.indkey[0] <> 0
+    WHERE x.indrelid = %s::regclass
+      AND am.amname IN ('ivfflat', 'hnsw')
+    """, (table_name,))
+    column_pattern = re.compile(rf'(?<![\w"]){re.escape(column)}(?![\w"])|"{re.escape(column)}"')
+    indexes = []
+    for name, method, opclass, attname, expression in cursor.fetchall():
+        if attname is not None:
+            if attname == column:
+                indexes.append((name, method, opclass, None))
+        elif column_pattern.search(expression):
+            indexes.append((name, method, opclass, _expression_quantization(expression)))
+    return indexes
+
+
+def _checked_indexes(cursor):
+    """游标所在数据库已确认可以使用索引的 (表, 列, metric, 量化方式), 不同的数据库 (主库、分片) 各自记录"""
+    return _checked.setdefault(cursor.connection.dsn, set())
+
+
+def forget_vector_indexes(cursor, table_name, column=None):
+    """
+    清除 check_vector_index 对该表的记录, 之后的检查重新查询系统表
+
+    参数:
+        cursor: 数据库游标, 只清除该游标所在数据库的记录
+        table_name: 表名
+        column: 向量列, None 表示该表的所有列
+    """
+    checked = _checked_indexes(cursor)
+    for key in [key for key in checked if key[0] == table_name and (column is None or key[1] == column)]:
+        checked.discard(key)
+
+
+def check_vector_index(cursor, table_name, column, metric="cosine", strict=False, quantization=None):
+    """
+    检查列上是否存在与 metric 一致的向量索引
+
+    参数:
+        cursor: 数据库游标
+        table_name: 表名
+        column: 向量列
+        metric: 查询使用的距离度量
+        strict: 为 True 时不一致直接抛出 ValueError, 否则发出警告
+        quantization: 粗排使用的量化方式, 检查对应的量化表达式索引; None 表示检查全精度索引
+    """
+    checked = _checked_indexes(cursor)
+    if (table_name, column, metric, quantization) in checked:
+        return True
+
+    if quantization is None:
+        opclass_needed, operator = metric_spec(metric)["opclass"], metric_spec(metric)["operator"]
+        target = column
+    else:
+        opclass_needed = quantized_opclass(quantization, metric)
+        operator = "<~>" if quantization == "bit" else metric_spec(metric)["operator"]
+        target = quantized_sql(column, quantization)
+    indexes = vector_indexes(cursor, table_name, column)
+    if any(opclass == opclass_needed and index_quantization == quantization
+           for _, _, opclass, index_quantization in indexes):
+        checked.add((table_name, column, metric, quantization))
+        return True
+
+    if indexes:
+        found = ", ".join(f"{name} ({opclass}{f', {q}' if q else ''})" for name, _, opclass, q in indexes)
+        message = (f"{table_name}.{column} 上的向量索引 {found} 与查询 {target} {operator} ({metric}) 不一致, "
+                   f"需要 {opclass_needed}, 查询将退化为顺序扫描")
+    else:
+        message = f"{table_name}.{column} 上没有向量索引, 查询将退化为顺序扫描"
+    if strict:
+        raise ValueError(message)
+    warnings.warn(message, RuntimeWarning, stacklevel=2)
+    return False
+
+
+INDEX_METHODS = ("hnsw", "ivfflat")
+
+
+def ivfflat_lists(row_count):
+    """按行数确定 ivfflat 的聚类中心数量: 100 万行以内取 rows / 1000, 以上取 sqrt(rows)"""
+    if row_count <= 1_000_000:
+        return max(1, row_count // 1000)
+    return int(math.sqrt(row_count))
+
+
+def ivfflat_probes(lists):
+    """ivfflat.probes 的建议起始值 sqrt(lists)"""
+    return max(1, int(math.sqrt(lists)))
+
+
+def table_row_count(cursor, table_name):
+    """ANALYZE 之后读取估计行数, 避免对大表做 count(*)"""
+    cursor.execute(f"ANALYZE {table_name}")
+    cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", (table_name,))
+    row_count = cursor.fetchone()[0]
+    if row_count < 0:
+        cursor.execute(f"SELECT count(*) FROM {table_name}")
+        row_count = cursor.fetchone()[0]
+    return row_count
+
+
+def table_partitions(cursor, table_name):
+    """分区表的各个分区名, 普通表返回空列表"""
+    cursor.execute("""
+    SELECT c.relname
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = %s::regclass
+    ORDER BY c.relname
+    """, (table_name,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def build_vector_index(cursor, index_name, table_name, column, metric="cosine", method="hnsw",
+                       m=16, ef_construction=64, lists=None,
+                       maintenance_work_mem="1GB", parallel_workers=None, quantization=None, dim=768):
+    """
+    在导入完成后 (重新) 构建向量索引
+
+    参数:
+        cursor: 数据库游标
+        index_name: 索引名, 已存在时先删除再重建
+        table_name: 表名
+        column: 向量列
+        metric: 距离度量, 决定索引的操作符类
+        method: hnsw 或 ivfflat
+        m: hnsw 每个节点的最大连接数
+        ef_construction: hnsw 构建时的候选列表大小
+        lists: ivfflat 聚类中心数量, None 表示按表的行数计算
+        maintenance_work_mem: 构建索引使用的内存, 图/聚类能完整放进内存时构建最快
+        parallel_workers: 并行构建的 worker 数量, None 表示使用服务端默认值
+        quantization: None 表示索引全精度向量; halfvec / bit 表示在量化表达式上建索引
+        dim: 向量维度, 量化表达式需要
+
+    分区表先在父表上创建 ON ONLY 索引, 再逐个分区单独构建并 ATTACH:
+    每个分区的 ivfflat lists 按该分区的行数计算, 之后也可以单独对某个分区 REINDEX。
+
+    返回构建耗时 (秒)
+    """
+    if quantization is None:
+        key, opclass = column, metric_spec(metric)["opclass"]
+    else:
+        key, opclass = f"({quantized_sql(column, quantization, dim)})", quantized_opclass(quantization, metric)
+    if method == "hnsw":
+        options = f"m = {int(m)}, ef_construction = {int(ef_construction)}"
+    elif method == "ivfflat":
+        # lists 为 None 时每个分区各自按行数计算
+        options = f"lists = {int(lists if lists is not None else ivfflat_lists(table_row_count(cursor, table_name)))}"
+    else:
+        raise ValueError(f"未知的索引类型: {method}, 可选: {INDEX_METHODS}")
+
+    # SET LOCAL 只在当前事务内生效, 不影响连接池中该连接之后的查询
+    cursor.execute("SELECT set_config('maintenance_work_mem', %s, true)", (maintenance_work_mem,))
+    if parallel_workers is not None:
+        cursor.execute("SELECT set_config('max_parallel_maintenance_workers', %s, true)", (str(parallel_workers),))
+
+    start = time.perf_counter()
+    cursor.execute(f"DROP INDEX IF EXISTS {index_name}")
+    partitions = table_partitions(cursor, table_name)
+    if not partitions:
+        cursor.execute(f"""
+        CREATE INDEX {index_name} ON {table_name}
+        USING {method} ({key} {opclass}) WITH ({options});
+        """)
+    else:
+        cursor.execute(f"""
+        CREATE INDEX {index_name} ON ONLY {table_name}
+        USING {method} ({key} {opclass}) WITH ({options});
+        """)
+        for partition in partitions:
+            suffix = partition[len(table_name) + 1:] if partition.startswith(f"{table_name}_") else partition
+            partition_index = f"{index_name}_{suffix}"
+            build_vector_index(cursor, partition_index, partition, column, metric, method, m, ef_construction,
+                               lists, maintenance_work_mem, parallel_workers, quantization, dim)
+            cursor.execute(f"ALTER INDEX {index_name} ATTACH PARTITION {partition_index}")
+    # 旧索引已删除, 之前按任何 metric 确认过的结果都不再成立
+    forget_vector_indexes(cursor, table_name, column)
+    return time.perf_counter() - start
+
+
+ITERATIVE_SCANS = ("off", "relaxed_order", "strict_order")
+
+
+def set_search_params(cursor, ef_search=None, probes=None, iterative_scan=None, max_scan_tuples=None):
+    """
+    设置当前事务内的向量检索参数, 在召回率与延迟之间取舍
+
+    参数:
+        cursor: 数据库游标
+        ef_search: hnsw.ef_search, 越大召回率越高、越慢 (至少应不小于 LIMIT)
+        probes: ivfflat.probes, 越大召回率越高、越慢
+        iterative_scan: pgvector 0.8 的迭代索引扫描 (off / relaxed_order / strict_order)。
+                        带过滤条件时, 索引扫描返回的行大多被过滤掉, 开启后会继续扫描直到凑够 LIMIT 行;
+                        relaxed_order 的结果可能略有乱序, 需要在外层按距离重新排序 (候选召回已经这样做);
+                        ivfflat 不支持 strict_order, 此时使用 relaxed_order
+        max_scan_tuples: hnsw.max_scan_tuples, 迭代扫描最多访问的元组数
+    """
+    if ef_search is not None:
+        cursor.execute("SELECT set_config('hnsw.ef_search', %s, true)", (str(ef_search),))
+    if probes is not None:
+        cursor.execute("SELECT set_config('ivfflat.probes', %s, true)", (str(probes),))
+    if iterative_scan is not None:
+        if iterative_scan not in ITERATIVE_SCANS:
+            raise ValueError(f"未知的迭代扫描方式: {iterative_scan}, 可选: {ITERATIVE_SCANS}")
+        # 两个参数在一条语句中设置, 只多一次往返
+        cursor.execute("SELECT set_config('hnsw.iterative_scan', %s, true), "
+                       "set_config('ivfflat.iterative_scan', %s, true)",
+                       (iterative_scan, "off" if iterative_scan == "off" else "relaxed_order"))
+    if max_scan_tuples is not None:
+        cursor.execute("SELECT set_config('hnsw.max_scan_tuples', %s, true)", (str(max_scan_tuples),))